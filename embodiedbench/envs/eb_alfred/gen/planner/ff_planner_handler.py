@@ -1,10 +1,17 @@
 import pdb
 import ast
-import multiprocessing
+import os
+import copy
 import re
+import json
+import queue
 import shlex
+import hashlib
+import tempfile
+import threading
 import subprocess
 import time
+from multiprocessing.pool import ThreadPool
 
 import constants
 from embodiedbench.envs.eb_alfred.gen.utils import game_util
@@ -12,6 +19,11 @@ from embodiedbench.envs.eb_alfred.gen.utils import py_util
 
 DEBUG = False
 
+# on-disk plan cache shared by all generation workers running from the same directory ('' disables it)
+PLAN_CACHE_DIR = os.environ.get('ff_plan_cache', os.path.join(constants.LOG_FILE, 'planner', 'plan_cache'))
+# maximum number of concurrent ff processes per generation worker
+FF_POOL_SIZE = int(os.environ.get('ff_pool_size', 3))
+
 CAPS_ACTION_TO_PLAN_ACTION = {
     'GOTOLOCATION': 'GotoLocation',
     'SCAN': 'Scan',
@@ -190,20 +202,155 @@ def get_plan_async(args):
     return get_plan_from_file((domain, filepath, solver_type))
 
 
+def canonicalize_problem(problem_str):
+    '''
+    problem text without its name and with the lines of the :objects and :init sections sorted, so that
+    the same state written by different problems (or processes, whose set iteration orders differ)
+    hashes the same. The :goal section is kept in order.
+    '''
+    lines = [line.strip() for line in problem_str.split('\n')]
+    lines = [line for line in lines if line and not line.startswith('(define (problem')]
+    sections = [[]]
+    for line in lines:
+        if line.startswith('(:'):
+            sections.append([])
+        sections[-1].append(line)
+    return '\n'.join('\n'.join(section if section[0].startswith('(:goal') else sorted(section))
+                     for section in sections if section)
+
+
+class PlanCache(object):
+    '''
+    parsed ff output of one solver type keyed on the hash of (domain, canonical problem, solver type),
+    one json file per key so concurrent workers can share the directory (files are written atomically)
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.memory = {}
+        self.domain_digests = {}
+        self.hits = 0
+        self.misses = 0
+        self.solve_seconds = 0.
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, domain, problem_str, solver_type):
+        if domain not in self.domain_digests:
+            with open(domain, 'rb') as f:
+                self.domain_digests[domain] = hashlib.sha1(f.read()).hexdigest()
+        problem_digest = hashlib.sha1(canonicalize_problem(problem_str).encode('utf-8')).hexdigest()
+        return '%s_%s_%d' % (self.domain_digests[domain][:16], problem_digest, solver_type)
+
+    def get(self, key):
+        if key in self.memory:
+            return self.memory[key]
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key + '.json')
+            if os.path.isfile(path):
+                try:
+                    with open(path) as f:
+                        self.memory[key] = json.load(f)
+                    return self.memory[key]
+                except ValueError:
+                    pass
+        return None
+
+    def put(self, key, parsed_plans):
+        self.memory[key] = parsed_plans
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key + '.json')
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(parsed_plans, f)
+            os.replace(tmp_path, path)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats_str(self):
+        return 'plan cache hits %d, misses %d (hit rate %.2f), %.1fs solving, %.3fs per solve' % (
+            self.hits, self.misses, self.hit_rate(), self.solve_seconds, self.solve_seconds / max(self.misses, 1))
+
+
+class SolverPool(object):
+    '''
+    runs ff on problem strings with at most `size` concurrent processes; every slot owns a temp
+    directory that is reused for the problem files of all its solves
+    '''
+
+    def __init__(self, size):
+        self.threads = ThreadPool(size)
+        self.slots = queue.Queue()
+        for _ in range(size):
+            self.slots.put(tempfile.mkdtemp(prefix='ff_'))
+
+    def _solve(self, args):
+        domain, problem_str, solver_type = args
+        slot = self.slots.get()
+        try:
+            filepath = os.path.join(slot, 'problem_%d.pddl' % solver_type)
+            with open(filepath, 'w') as fid:
+                fid.write(problem_str)
+            return get_plan_from_file((domain, filepath, solver_type))
+        finally:
+            self.slots.put(slot)
+
+    def map(self, domain, problem_str, solver_types):
+        return self.threads.map(self._solve, [(domain, problem_str, solver_type) for solver_type in solver_types])
+
+
+_SOLVER_POOL = None
+_SOLVER_POOL_LOCK = threading.Lock()
+PLAN_CACHE = PlanCache(PLAN_CACHE_DIR)
+
+
+def get_solver_pool():
+    # created on first use, so that forked generation workers each get their own threads
+    global _SOLVER_POOL
+    with _SOLVER_POOL_LOCK:
+        if _SOLVER_POOL is None:
+            _SOLVER_POOL = SolverPool(FF_POOL_SIZE)
+    return _SOLVER_POOL
+
+
+def solve_cached(domain, problem_str, solver_types):
+    '''
+    parsed plans of every solver type for a problem (in the order of solver_types), from the plan
+    cache or solved by the pool (results with a solver timeout are not cached)
+    '''
+    solver_types = list(solver_types)
+    keys = [PLAN_CACHE.key(domain, problem_str, solver_type) for solver_type in solver_types]
+    parsed_plans = [PLAN_CACHE.get(key) for key in keys]
+    missing = [i for i, parsed_plan in enumerate(parsed_plans) if parsed_plan is None]
+    if not missing:
+        PLAN_CACHE.hits += 1
+        return copy.deepcopy(parsed_plans)
+    PLAN_CACHE.misses += 1
+    start_t = time.time()
+    solved = get_solver_pool().map(domain, problem_str, [solver_types[i] for i in missing])
+    PLAN_CACHE.solve_seconds += time.time() - start_t
+    for i, parsed_plan in zip(missing, solved):
+        if parsed_plan[0] != 'timeout':
+            PLAN_CACHE.put(keys[i], copy.deepcopy(parsed_plan))
+        parsed_plans[i] = parsed_plan
+    return copy.deepcopy(parsed_plans)
+
+
 class PlanParser(object):
     def __init__(self, domain_file_path):
         self.domain = domain_file_path
         self.problem_id = -1
-        self.process_pool = multiprocessing.Pool(3)
-        #from multiprocessing.pool import ThreadPool
-        #self.process_pool = ThreadPool(3)
 
     def get_plan(self):
-        parsed_plans = self.process_pool.map(get_plan_async, zip([self.domain] * 3, [self.problem_id] * 3, range(3, 6)))
-        return self.find_best_plan(parsed_plans)
+        filepath = '%s/planner/generated_problems/problem_%s.pddl' % (constants.LOG_FILE, self.problem_id)
+        return self.get_plan_from_file(self.domain, filepath)
 
     def get_plan_from_file(self, domain_path, filepath):
-        parsed_plans = self.process_pool.map(get_plan_from_file, zip([domain_path] * 3, [filepath] * 3, range(3, 6)))
+        with open(filepath) as fid:
+            problem_str = fid.read()
+        parsed_plans = solve_cached(domain_path, problem_str, range(3, 6))
         return self.find_best_plan(parsed_plans)
 
     # Unncessary, planner should be optimal. But the planner produces some weird actions
@@ -233,12 +380,10 @@ class PlanParser(object):
 
 
 class SinglePlanParser(PlanParser):
-    def get_plan(self):
-        parsed_plan = get_plan_async([self.domain, self.problem_id, 3])
-        return parsed_plan
-
     def get_plan_from_file(self, domain_path, filepath):
-        parsed_plan = get_plan_from_file([domain_path, filepath, 3])
+        with open(filepath) as fid:
+            problem_str = fid.read()
+        parsed_plan = solve_cached(domain_path, problem_str, [3])[0]
         return parsed_plan
 
 
@@ -250,3 +395,4 @@ if __name__ == '__main__':
     parser.problem_id = sys.argv[1]
     result_plan = parser.get_plan()
     print('plan\n' + '\n'.join(['%03d: %s' % (pp, game_util.get_action_str(pl)) for pp, pl in enumerate(result_plan)]))
+    print(PLAN_CACHE.stats_str())
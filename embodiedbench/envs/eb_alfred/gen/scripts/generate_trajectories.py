@@ -4,6 +4,7 @@ sys.path.append(os.path.join(os.environ['ALFRED_ROOT']))
 sys.path.append(os.path.join(os.environ['ALFRED_ROOT'], 'gen'))
 
 import time
+import signal
 import multiprocessing as mp
 import json
 import random
@@ -20,6 +21,8 @@ from embodiedbench.envs.eb_alfred.env.thor_env import ThorEnv
 from embodiedbench.envs.eb_alfred.gen.game_states.task_game_state_full_knowledge import TaskGameStateFullKnowledge
 from embodiedbench.envs.eb_alfred.gen.utils.video_util import VideoSaver
 from embodiedbench.envs.eb_alfred.gen.utils.dataset_management_util import load_successes_from_disk, load_fails_from_disk
+from embodiedbench.envs.eb_alfred.gen.utils.job_queue import JobQueue
+from embodiedbench.envs.eb_alfred.gen.planner import ff_planner_handler
 
 # params
 RAW_IMAGES_FOLDER = 'raw_images/'
@@ -382,7 +385,11 @@ def print_successes(succ_traj):
     print("\n##################################")
 
 
-def main(args):
+def job_queue_path(args):
+    return args.queue or os.path.join(args.save_path, 'jobs.sqlite')
+
+
+def main(args, worker_id=0):
     # settings
     constants.DATA_SAVE_PATH = args.save_path
     print("Force Unsave Data: %s" % str(args.force_unsave))
@@ -427,6 +434,10 @@ def main(args):
     fail_traj = load_fails_from_disk(args.save_path)
     print("Loaded %d known failed tuples" % len(fail_traj))
 
+    # jobs are shared with the other workers (and previous runs) through the job queue
+    queue = JobQueue(job_queue_path(args))
+    run_start = time.time()
+
     # create env and agent
     env = ThorEnv()
 
@@ -460,11 +471,18 @@ def main(args):
     # keeps trying out new task tuples as trajectories either fail or suceed
     while True:
 
-        sampled_task = next(task_sampler)
-        print(sampled_task)  # DEBUG
-        if sampled_task is None:
-            sys.exit("No valid tuples left to sample (all are known to fail or already have %d trajectories" %
-                     args.repeats_per_cond)
+        # requeued jobs (resumed, or taken from a hung worker) first, then newly sampled tuples
+        job = queue.claim(worker_id)
+        if job is None:
+            sampled_task = next(task_sampler)
+            print(sampled_task)  # DEBUG
+            if sampled_task is None:
+                sys.exit("No valid tuples left to sample (all are known to fail or already have %d trajectories" %
+                         args.repeats_per_cond)
+            job = queue.add_and_claim(tuple(str(v) for v in sampled_task[:4]) + (int(sampled_task[4]),), worker_id)
+            if job is None:  # another worker is generating this tuple
+                continue
+        job_id, sampled_task = job
         gtype, pickup_obj, movable_obj, receptacle_obj, sampled_scene = sampled_task
         print("sampled tuple: " + str((gtype, pickup_obj, movable_obj, receptacle_obj, sampled_scene)))
 
@@ -476,6 +494,7 @@ def main(args):
                                                                 (succ_traj['receptacle'] == receptacle_obj) &
                                                                 (succ_traj['scene'] == str(sampled_scene))])
         num_place_fails = 0  # count of errors related to placement failure for no valid positions.
+        job_successes, job_failures, job_error = 0, 0, None
 
         # continue until we're (out of tries + have never succeeded) or (have gathered the target number of instances)
         while tries_remaining > 0 and target_remaining > 0:
@@ -582,6 +601,8 @@ def main(args):
                 estr = str(e)
                 if len(estr) > 120:
                     estr = estr[:120]
+                job_failures += 1
+                job_error = estr
                 if estr not in errors:
                     errors[estr] = 0
                 errors[estr] += 1
@@ -607,10 +628,16 @@ def main(args):
                 "receptacle": receptacle_obj,
                 "scene": str(sampled_scene)}, ignore_index=True)
             target_remaining -= 1
+            job_successes += 1
             tries_remaining += args.trials_before_fail  # on success, add more tries for future successes
 
         # if this combination resulted in a certain number of failures with no successes, flag it as not possible.
-        if tries_remaining == 0 and target_remaining == args.repeats_per_cond:
+        impossible = tries_remaining == 0 and target_remaining == args.repeats_per_cond
+        queue.finish(job_id, job_successes, job_failures, failed=impossible, error=job_error)
+        print(ff_planner_handler.PLAN_CACHE.stats_str())
+        if args.num_threads == 0:
+            queue.print_throughput(run_start)
+        if impossible:
             new_fails = [(gtype, pickup_obj, movable_obj, receptacle_obj, str(sampled_scene))]
             fail_traj = load_fails_from_disk(args.save_path, to_write=new_fails)
             print("%%%%%%%%%%")
@@ -692,15 +719,72 @@ def delete_save(in_parallel):
     return True
 
 
+def run_worker(args, worker_id):
+    # own process group, so that a hung worker can be killed together with its Unity process
+    os.setpgrp()
+    try:
+        main(args, worker_id)
+    except SystemExit as e:
+        print(e)  # no tuples left to sample
+
+
+def start_worker(args, worker_id):
+    proc = mp.Process(target=run_worker, args=(args, worker_id))
+    proc.start()
+    return proc
+
+
+def kill_worker(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.join()
+
+
 def parallel_main(args):
-    procs = [mp.Process(target=main, args=(args,)) for _ in range(args.num_threads)]
+    '''
+    runs args.num_threads workers that claim jobs from the job queue, restarts workers (and with them
+    Unity) that exceed the per-job timeout or die, and reports throughput
+    '''
+    queue = JobQueue(job_queue_path(args))
+    run_start = last_report = time.time()
+    workers = {}
+    crashes = {}
+    for worker_id in range(args.num_threads):
+        workers[worker_id] = start_worker(args, worker_id)
+        crashes[worker_id] = 0
+        time.sleep(0.1)
     try:
-        for proc in procs:
-            proc.start()
-            time.sleep(0.1)
+        while workers:
+            time.sleep(5)
+            for worker_id, proc in list(workers.items()):
+                job = queue.running_job(worker_id)
+                if job is not None and args.job_timeout > 0 and time.time() - job[1] > args.job_timeout:
+                    print("Worker %d timed out on job %d; restarting it" % (worker_id, job[0]))
+                    kill_worker(proc)
+                    queue.release(job[0], worker_id, 'timeout after %ds' % args.job_timeout, args.max_job_attempts)
+                    workers[worker_id] = start_worker(args, worker_id)
+                elif not proc.is_alive():
+                    if job is not None:
+                        queue.release(job[0], worker_id, 'worker exited with code %s' % proc.exitcode, args.max_job_attempts)
+                    if proc.exitcode == 0:
+                        del workers[worker_id]  # nothing left to sample
+                    elif job is None and crashes[worker_id] >= args.max_job_attempts:
+                        print("Worker %d keeps crashing outside of jobs; not restarting it" % worker_id)
+                        del workers[worker_id]
+                    else:
+                        print("Worker %d died (exit code %s); restarting it" % (worker_id, proc.exitcode))
+                        crashes[worker_id] = 0 if job is not None else crashes[worker_id] + 1
+                        workers[worker_id] = start_worker(args, worker_id)
+            if time.time() - last_report > args.report_every:
+                queue.print_throughput(run_start)
+                last_report = time.time()
     finally:
-        for proc in procs:
-            proc.join()
+        for proc in workers.values():
+            kill_worker(proc)
+        queue.print_throughput(run_start)
+        queue.close()
 
 
 if __name__ == "__main__":
@@ -713,8 +797,13 @@ if __name__ == "__main__":
     parser.add_argument('--x_display', type=str, required=False, default=constants.X_DISPLAY, help="x_display id")
     parser.add_argument("--just_examine", action='store_true', help="just examine what data is gathered; don't gather more")
     parser.add_argument("--in_parallel", action='store_true', help="this collection will run in parallel with others, so load from disk on every new sample")
-    parser.add_argument("-n", "--num_threads", type=int, default=0, help="number of processes for parallel mode")
+    parser.add_argument("-n", "--num_threads", type=int, default=0, help="number of worker processes (0: generate in this process without supervision)")
     parser.add_argument('--json_file', type=str, default="", help="path to json file with trajectory dump")
+    parser.add_argument('--queue', type=str, default="", help="sqlite job queue (default: <save_path>/jobs.sqlite)")
+    parser.add_argument('--resume', action='store_true', help="continue the pending and interrupted jobs of the job queue")
+    parser.add_argument('--job_timeout', type=int, default=1800, help="seconds a worker may spend on one tuple before it is restarted (0: no timeout)")
+    parser.add_argument('--max_job_attempts', type=int, default=3, help="attempts of a timed-out or crashed job before it is marked failed")
+    parser.add_argument('--report_every', type=int, default=60, help="seconds between throughput reports")
 
     # params
     parser.add_argument("--repeats_per_cond", type=int, default=3)
@@ -723,7 +812,18 @@ if __name__ == "__main__":
 
     parse_args = parser.parse_args()
 
-    if parse_args.in_parallel and parse_args.num_threads > 1:
+    if not os.path.isdir(parse_args.save_path):
+        os.makedirs(parse_args.save_path)
+    queue = JobQueue(job_queue_path(parse_args))
+    if parse_args.resume:
+        print("Resuming job queue: %d interrupted jobs requeued, %s" % (queue.requeue_running(), queue.counts()))
+    else:
+        queue.drop_unfinished()
+    queue.close()
+
+    if parse_args.num_threads > 0:
+        # workers share save_path, so each reloads the others' successes
+        parse_args.in_parallel = parse_args.in_parallel or parse_args.num_threads > 1
         parallel_main(parse_args)
     else:
         main(parse_args)
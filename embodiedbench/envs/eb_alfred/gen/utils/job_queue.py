@@ -0,0 +1,124 @@
+import time
+import sqlite3
+
+
+class JobQueue(object):
+    '''
+    Persistent queue of (goal, pickup, movable, receptacle, scene) generation jobs, shared by the
+    generator processes through SQLite. Free workers claim the oldest pending job (so slow jobs never
+    hold up the others), and the counts of every finished job are kept for throughput reports and
+    for resuming an interrupted run.
+    '''
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                goal TEXT, pickup TEXT, movable TEXT, receptacle TEXT, scene INTEGER,
+                status TEXT DEFAULT 'pending',  -- pending, running, done, failed
+                worker INTEGER, attempts INTEGER DEFAULT 0,
+                successes INTEGER DEFAULT 0, failures INTEGER DEFAULT 0,
+                started REAL, finished REAL, error TEXT);
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+        ''')
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same job
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def claim(self, worker):
+        '''
+        mark the oldest pending job as running on worker; returns (job id, task tuple) or None
+        '''
+        self._transaction()
+        try:
+            row = self.conn.execute("SELECT id, goal, pickup, movable, receptacle, scene FROM jobs "
+                                    "WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE jobs SET status = 'running', worker = ?, started = ?, attempts = attempts + 1 "
+                                  "WHERE id = ?", (worker, time.time(), row[0]))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return None if row is None else (row[0], tuple(row[1:]))
+
+    def add_and_claim(self, task, worker):
+        '''
+        add a freshly sampled task and claim it; returns None if the same task is already queued or
+        running elsewhere
+        '''
+        self._transaction()
+        try:
+            busy = self.conn.execute("SELECT 1 FROM jobs WHERE goal = ? AND pickup = ? AND movable = ? AND receptacle = ? "
+                                     "AND scene = ? AND status IN ('pending', 'running')", task).fetchone()
+            job_id = None
+            if busy is None:
+                job_id = self.conn.execute("INSERT INTO jobs (goal, pickup, movable, receptacle, scene, status, worker, started, attempts) "
+                                           "VALUES (?, ?, ?, ?, ?, 'running', ?, ?, 1)", task + (worker, time.time())).lastrowid
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return None if job_id is None else (job_id, task)
+
+    def finish(self, job_id, successes, failures, failed=False, error=None):
+        self.conn.execute("UPDATE jobs SET status = ?, successes = successes + ?, failures = failures + ?, finished = ?, error = ? "
+                          "WHERE id = ?", ('failed' if failed else 'done', successes, failures, time.time(), error, job_id))
+
+    def release(self, job_id, worker, error, max_attempts):
+        '''
+        put a job whose worker hung or died back in the queue, or fail it after max_attempts.
+        only a job still running on worker is released, the worker may have finished it in the meantime.
+        '''
+        return self.conn.execute("UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                                 "worker = NULL, finished = ?, error = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                                 (max_attempts, time.time(), error, job_id, worker)).rowcount > 0
+
+    def running_job(self, worker):
+        '''
+        (job id, started) of the job running on worker, or None
+        '''
+        return self.conn.execute("SELECT id, started FROM jobs WHERE status = 'running' AND worker = ?", (worker,)).fetchone()
+
+    def requeue_running(self):
+        '''
+        jobs left running by an interrupted run go back to pending (used on resume)
+        '''
+        return self.conn.execute("UPDATE jobs SET status = 'pending', worker = NULL WHERE status = 'running'").rowcount
+
+    def drop_unfinished(self):
+        '''
+        forget the pending and running jobs of a previous run (when not resuming)
+        '''
+        return self.conn.execute("DELETE FROM jobs WHERE status IN ('pending', 'running')").rowcount
+
+    def stats(self, since=0):
+        '''
+        per goal type: (successes, failures, finished jobs) of the jobs finished after since
+        '''
+        rows = self.conn.execute("SELECT goal, SUM(successes), SUM(failures), COUNT(*) FROM jobs "
+                                 "WHERE finished >= ? AND status IN ('done', 'failed') GROUP BY goal ORDER BY goal", (since,))
+        return {goal: (successes, failures, jobs) for goal, successes, failures, jobs in rows}
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def print_throughput(self, since):
+        hours = max(time.time() - since, 1e-6) / 3600
+        stats = self.stats(since)
+        total_successes = sum(s for s, f, j in stats.values())
+        print("###################################")
+        print("Jobs: %s" % self.counts())
+        print("Throughput: %.1f trajectories/hour" % (total_successes / hours))
+        for goal, (successes, failures, jobs) in stats.items():
+            tries = successes + failures
+            print("\t%-36s %6.1f traj/h\tfailure rate %.2f (%d/%d tries, %d jobs)" %
+                  (goal, successes / hours, failures / tries if tries else 0., failures, tries, jobs))
+        print("###################################")
+
+    def close(self):
+        self.conn.close()
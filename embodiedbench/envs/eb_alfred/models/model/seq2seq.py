@@ -6,8 +6,10 @@ import pprint
 import collections
 import numpy as np
 from torch import nn
+from torch.utils.data import DataLoader
 from tensorboardX import SummaryWriter
-from tqdm import trange
+from tqdm import tqdm, trange
+from models.utils.feature_store import TaskDataset
 
 class Module(nn.Module):
 
@@ -279,10 +281,15 @@ class Module(nn.Module):
     def iterate(self, data, batch_size):
         '''
         breaks dataset into batch_size chunks for training
+        (jsons and frame features are read ahead by DataLoader workers, see TaskDataset)
         '''
-        for i in trange(0, len(data), batch_size, desc='batch'):
-            tasks = data[i:i+batch_size]
-            batch = [self.load_task_json(task) for task in tasks]
+        num_workers = getattr(self.args, 'num_workers', 0)
+        loader = DataLoader(TaskDataset(data, self.args, feat_pt=None if getattr(self, 'test_mode', False) else getattr(self, 'feat_pt', None)),
+                            batch_size=batch_size, shuffle=False, collate_fn=list,
+                            num_workers=num_workers, pin_memory=self.args.gpu,
+                            prefetch_factor=getattr(self.args, 'prefetch_factor', 2) if num_workers > 0 else None,
+                            persistent_workers=False)
+        for batch in tqdm(loader, desc='batch'):
             feat = self.featurize(batch)
             yield batch, feat
 
@@ -9,6 +9,7 @@ from torch.nn.utils.rnn import pad_sequence, pack_padded_sequence, pad_packed_se
 from model.seq2seq import Module as Base
 from models.utils.metric import compute_f1, compute_exact
 from gen.utils.image_util import decompress_mask
+from models.utils.feature_store import FeatureStore, feature_key
 
 
 class Module(Base):
@@ -53,6 +54,9 @@ class Module(Base):
         # paths
         self.root_path = os.getcwd()
         self.feat_pt = 'feat_conv.pt'
+        # packed features (models/utils/feature_store.py), trajectories not in the store fall back to feat_pt
+        feat_store = getattr(args, 'feat_store', None)
+        self.feat_store = FeatureStore(feat_store) if feat_store else None
 
         # params
         self.max_subgoals = 25
@@ -103,8 +107,14 @@ class Module(Base):
 
             # load Resnet features from disk
             if load_frames and not self.test_mode:
-                root = self.get_task_root(ex)
-                im = torch.load(os.path.join(root, self.feat_pt))
+                # preloaded by the DataLoader workers in iterate
+                im = ex.pop('feat_frames', None)
+                if im is None:
+                    key = feature_key(ex['split'], ex['root'])
+                    if self.feat_store is not None and key in self.feat_store:
+                        im = self.feat_store.get(key)
+                    else:
+                        im = torch.load(os.path.join(self.get_task_root(ex), self.feat_pt))
 
                 num_low_actions = len(ex['plan']['low_actions']) + 1  # +1 for additional stop action
                 num_feat_frames = im.shape[0]
@@ -160,7 +170,8 @@ class Module(Base):
                 feat[k] = pad_seq
             else:
                 # default: tensorize and pad sequence
-                seqs = [torch.tensor(vv, device=device, dtype=torch.float if ('frames' in k) else torch.long) for vv in v]
+                seqs = [vv.to(device=device, dtype=torch.float, non_blocking=True) if torch.is_tensor(vv) else
+                        torch.tensor(vv, device=device, dtype=torch.float if ('frames' in k) else torch.long) for vv in v]
                 pad_seq = pad_sequence(seqs, batch_first=True, padding_value=self.pad)
                 feat[k] = pad_seq
 
@@ -29,6 +29,9 @@ if __name__ == '__main__':
     parser.add_argument('--dout', help='where to save model', default='exp/model:{model}')
     parser.add_argument('--use_templated_goals', help='use templated goals instead of human-annotated goal descriptions (only available for train set)', action='store_true')
     parser.add_argument('--resume', help='load a checkpoint')
+    parser.add_argument('--feat_store', help='packed feature store (models/utils/feature_store.py) to read Resnet feats from instead of per-trajectory files', default=None)
+    parser.add_argument('--num_workers', help='DataLoader workers reading jsons and feats ahead of training', default=4, type=int)
+    parser.add_argument('--prefetch_factor', help='batches prefetched per DataLoader worker', default=2, type=int)
 
     # hyper parameters
     parser.add_argument('--batch', help='batch size', default=8, type=int)
@@ -0,0 +1,54 @@
+import os
+import sys
+sys.path.append(os.path.join(os.environ['ALFRED_ROOT']))
+sys.path.append(os.path.join(os.environ['ALFRED_ROOT'], 'models'))
+
+import json
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
+from torch.utils.data import DataLoader
+from models.utils.feature_store import TaskDataset
+
+
+def examples_per_second(tasks, args, num_workers, batch, num_batches):
+    loader = DataLoader(TaskDataset(tasks, args, feat_pt=args.feat_pt), batch_size=batch, shuffle=False,
+                        collate_fn=list, num_workers=num_workers, prefetch_factor=2 if num_workers > 0 else None)
+    num_examples = 0
+    start = time.time()
+    for i, examples in enumerate(loader):
+        num_examples += len(examples)
+        if i + 1 == num_batches:
+            break
+    return num_examples / (time.time() - start)
+
+
+if __name__ == '__main__':
+    '''
+    examples/sec of the training input pipeline (preprocessed json + Resnet feats) on CPU, reading
+    per-trajectory feat files serially (the previous behaviour) and through DataLoader workers
+    with and without the packed feature store
+    '''
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--data', help='dataset folder', default='data/json_feat_2.1.0')
+    parser.add_argument('--splits', help='json file containing train/dev/test splits', default='data/splits/oct21.json')
+    parser.add_argument('--split', help='split to read', default='train')
+    parser.add_argument('--pp_folder', help='folder name for preprocessed data', default='pp')
+    parser.add_argument('--feat_store', help='packed feature store', default='data/feat_store')
+    parser.add_argument('--feat_pt', help='filename of per-trajectory feats', default='feat_conv.pt')
+    parser.add_argument('--batch', help='batch size', default=8, type=int)
+    parser.add_argument('--num_batches', help='batches read per setting', default=200, type=int)
+    parser.add_argument('--num_workers', help='DataLoader workers', default=4, type=int)
+    args = parser.parse_args()
+
+    with open(args.splits) as f:
+        tasks = json.load(f)[args.split]
+
+    files_args = Namespace(**{**vars(args), 'feat_store': None})
+    settings = [('feat files, serial', files_args, 0),
+                ('feat files, %d workers' % args.num_workers, files_args, args.num_workers)]
+    if os.path.isdir(args.feat_store):
+        settings += [('feat store, serial', args, 0),
+                     ('feat store, %d workers' % args.num_workers, args, args.num_workers)]
+    for name, setting_args, num_workers in settings:
+        rate = examples_per_second(tasks, setting_args, num_workers, args.batch, args.num_batches)
+        print('{:<24} {:8.1f} examples/sec'.format(name, rate))
@@ -5,11 +5,53 @@ sys.path.append(os.path.join(os.environ['ALFRED_ROOT'], 'models'))
 
 import torch
 import os
+import time
+import bisect
 from PIL import Image
 from nn.resnet import Resnet
+from torch.utils.data import Dataset, DataLoader
+from models.utils.feature_store import FeatureStoreWriter
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
 
 
+class FrameDataset(Dataset):
+    '''
+    decodes and normalizes single frames in DataLoader workers. The frames of all trajectories are
+    indexed back-to-back, so batches are fixed-size and span trajectory boundaries.
+    '''
+
+    def __init__(self, trajectories, transform):
+        self.trajectories = trajectories  # list of (root, image paths)
+        self.transform = transform
+        self.offsets = [0]
+        for root, fimages in trajectories:
+            self.offsets.append(self.offsets[-1] + len(fimages))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, i):
+        traj_idx = bisect.bisect_right(self.offsets, i) - 1
+        path = self.trajectories[traj_idx][1][i - self.offsets[traj_idx]]
+        try:
+            with Image.open(path) as image:
+                return traj_idx, self.transform(image.convert('RGB')), True
+        except Exception as e:
+            print('{}: {}'.format(path, e))
+            return traj_idx, torch.zeros(3, 224, 224), False
+
+
+def find_trajectories(data, img_folder):
+    for root, dirs, files in os.walk(data):
+        if os.path.basename(root) == img_folder:
+            fimages = sorted([os.path.join(root, f) for f in files
+                              if (f.endswith('.png') or (f.endswith('.jpg')))])
+            if len(fimages) > 0:
+                yield root, fimages
+            else:
+                print('empty; skipping {}'.format(root))
+
+
 if __name__ == '__main__':
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
 
@@ -22,33 +64,109 @@ if __name__ == '__main__':
     parser.add_argument('--filename', help='filename of feat', default='feat_conv.pt')
     parser.add_argument('--img_folder', help='folder containing raw images', default='raw_images')
 
+    # pipeline
+    parser.add_argument('--num_workers', help='image decoding workers', default=max((os.cpu_count() or 2) // 2, 1), type=int)
+    parser.add_argument('--num_threads', help='torch threads for the Resnet on cpu (0: torch default)', default=0, type=int)
+    parser.add_argument('--precision', help='inference precision (fp16 needs --gpu, bf16 works on cpu)', default='fp32', choices=['fp32', 'fp16', 'bf16'])
+    parser.add_argument('--channels_last', help='run the Resnet in channels-last memory format', action='store_true')
+    parser.add_argument('--feat_store', help='write into a packed feature store (models/utils/feature_store.py) instead of per-trajectory files', default=None)
+    parser.add_argument('--store_dtype', help='dtype of the feature store', default='float32', choices=['float32', 'float16'])
+    parser.add_argument('--resume', help='skip trajectories listed in the done-manifest of a previous run', action='store_true')
+
     # parser
     args = parser.parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    device = torch.device('cuda') if args.gpu else torch.device('cpu')
 
     # load resnet model
     extractor = Resnet(args, eval=True)
+    if args.channels_last:
+        extractor.resnet_model.model = extractor.resnet_model.model.to(memory_format=torch.channels_last)
+
+    # done-manifest: one trajectory root (relative to --data) per line, appended once its feats are written
+    manifest_path = os.path.join(args.feat_store or args.data, '%s.done' % args.filename)
+    done = set()
+    if args.resume and os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            done = set(line.strip() for line in f if line.strip())
+
+    trajectories = []
+    for root, fimages in find_trajectories(args.data, args.img_folder):
+        rel_root = os.path.relpath(root, args.data)
+        if rel_root in done:
+            continue
+        if args.skip_existing and os.path.isfile(os.path.join(root.replace(args.img_folder, ''), args.filename)):
+            continue
+        trajectories.append((root, fimages))
+    print('{} trajectories to extract ({} already done)'.format(len(trajectories), len(done)))
+
+    writer = FeatureStoreWriter(args.feat_store, dtype=args.store_dtype) if args.feat_store else None
+    dataset = FrameDataset(trajectories, extractor.transform)
+    loader = DataLoader(dataset, batch_size=args.batch, shuffle=False, num_workers=args.num_workers,
+                        pin_memory=args.gpu, prefetch_factor=4 if args.num_workers > 0 else None)
+    remaining = [len(fimages) for root, fimages in trajectories]
+    failed = [False] * len(trajectories)
+    chunks = []  # feats of the current trajectory, only kept when writing per-trajectory files
     skipped = []
+    start_time = time.time()
+    num_frames = 0
+    manifest = open(manifest_path, 'a')
 
-    for root, dirs, files in os.walk(args.data):
-        if os.path.basename(root) == args.img_folder:
-            fimages = sorted([os.path.join(root, f) for f in files
-                              if (f.endswith('.png') or (f.endswith('.jpg')))])
-            if len(fimages) > 0:
-                if args.skip_existing and os.path.isfile(os.path.join(root, 'feat_conv.pt')):
-                    continue
-                try:
-                    print('{}'.format(root))
-                    image_loader = Image.open if isinstance(fimages[0], str) else Image.fromarray
-                    images = [image_loader(f) for f in fimages]
-                    feat = extractor.featurize(images, batch=args.batch)
-                    torch.save(feat.cpu(), os.path.join(root.replace('raw_images', ''), args.filename))
-                except Exception as e:
-                    print(e)
-                    print("Skipping " + root)
-                    skipped.append(root)
+    def finish(traj_idx):
+        root = trajectories[traj_idx][0]
+        rel_root = os.path.relpath(root, args.data)
+        key = os.path.dirname(rel_root)
+        if failed[traj_idx]:
+            print("Skipping " + root)
+            skipped.append(root)
+            if writer is not None and key in writer.entries:
+                writer.entries.pop(key)
+                writer.open_keys.clear()
+        elif writer is not None:
+            writer.flush()
+        else:
+            torch.save(torch.cat(chunks, dim=0), os.path.join(root.replace(args.img_folder, ''), args.filename))
+        if not failed[traj_idx]:
+            manifest.write(rel_root + '\n')
+            manifest.flush()
+        chunks.clear()
 
-            else:
-                print('empty; skipping {}'.format(root))
+    dtype = {'fp16': torch.float16, 'bf16': torch.bfloat16}.get(args.precision)
+    with torch.no_grad(), torch.autocast(device_type=device.type, dtype=dtype, enabled=dtype is not None):
+        for traj_ids, images, ok in loader:
+            images = images.to(device, non_blocking=True)
+            if args.channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            feat = extractor.resnet_model.extract(images).float().cpu()
+            traj_ids = traj_ids.tolist()
+            ok = ok.tolist()
+
+            # split the batch into per-trajectory chunks (frames arrive in trajectory order)
+            i = 0
+            while i < len(traj_ids):
+                traj_idx = traj_ids[i]
+                n = min(remaining[traj_idx], len(traj_ids) - i)
+                failed[traj_idx] = failed[traj_idx] or not all(ok[i:i+n])
+                if not failed[traj_idx]:
+                    if writer is not None:
+                        rel_root = os.path.relpath(trajectories[traj_idx][0], args.data)
+                        key = os.path.dirname(rel_root)
+                        writer.extend(key, feat[i:i+n], group=key.split('/')[0])
+                    else:
+                        chunks.append(feat[i:i+n])
+                remaining[traj_idx] -= n
+                if remaining[traj_idx] == 0:
+                    finish(traj_idx)
+                i += n
+
+            num_frames += len(traj_ids)
+            print('\r{} frames, {:.1f} frames/sec'.format(num_frames, num_frames / (time.time() - start_time)), end='')
+
+    print()
+    manifest.close()
+    if writer is not None:
+        writer.close()
 
     print("Skipped:")
-    print(skipped)
\ No newline at end of file
+    print(skipped)
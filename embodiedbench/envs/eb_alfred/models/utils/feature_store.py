@@ -0,0 +1,222 @@
+import os
+import json
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+INDEX_FILE = 'index.json'
+
+
+def feature_key(split, root):
+    '''
+    store key of a trajectory, e.g. train/pick_and_place_simple-Mug-None-Shelf-1/trial_T20190001_000000_000000
+    (the path of the trajectory folder relative to the data folder, see Module.get_task_root)
+    '''
+    return '/'.join([split] + root.split('/')[-2:])
+
+
+class FeatureStore(object):
+    '''
+    read-only view of packed ResNet features: shard files holding the frames of many trajectories
+    back-to-back (raw arrays of frame_shape), and index.json mapping every trajectory key to
+    [shard, first frame, number of frames]. Shards are memory-mapped lazily in the process that
+    reads them, so a store can be handed to DataLoader workers.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.dtype = np.dtype(index['dtype'])
+        self.frame_shape = tuple(index['frame_shape'])
+        self.entries = index['entries']
+        self.shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        return state
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _shard(self, name):
+        if name not in self.shards:
+            path = os.path.join(self.root, name)
+            frame_bytes = self.dtype.itemsize * int(np.prod(self.frame_shape))
+            num_frames = os.path.getsize(path) // frame_bytes
+            self.shards[name] = np.memmap(path, dtype=self.dtype, mode='r', shape=(num_frames,) + self.frame_shape)
+        return self.shards[name]
+
+    def get(self, key):
+        '''
+        features of a trajectory as a float tensor (num_frames x C x H x W), copied out of its shard
+        '''
+        shard, start, num_frames = self.entries[key]
+        frames = np.array(self._shard(shard)[start:start + num_frames], dtype=np.float32)
+        return torch.from_numpy(frames)
+
+
+class FeatureStoreWriter(object):
+    '''
+    appends trajectory features to shard files, one series of shards per group (e.g. split), starting
+    a new shard every shard_frames frames. index.json is rewritten on flush() and close(), so an
+    interrupted run keeps every trajectory written up to its last flush. Reopening an existing store
+    continues it in new shards (bytes written after the last flush are never referenced).
+    '''
+
+    def __init__(self, root, dtype='float32', shard_frames=200000):
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.shard_frames = shard_frames
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.dtype = np.dtype(index['dtype'])
+            self.frame_shape = tuple(index['frame_shape'])
+            self.entries = index['entries']
+            self.shards = index['shards']
+        else:
+            self.dtype = np.dtype(dtype)
+            self.frame_shape = None
+            self.entries = {}
+            self.shards = {}  # shard name -> number of frames
+        self.files = {}  # group -> (shard name, open file)
+        self.open_keys = {}  # group -> key of the trajectory that extend() continues
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def append(self, key, feat, group='shard'):
+        feat = self._to_numpy(feat)
+        name, f = self._shard_for(group, len(feat))
+        f.write(np.ascontiguousarray(feat, dtype=self.dtype).tobytes())
+        self.entries[key] = [name, self.shards[name], len(feat)]
+        self.shards[name] += len(feat)
+        self.open_keys[group] = key
+
+    def extend(self, key, feat, group='shard'):
+        '''
+        append frames to the trajectory last written to group, or start it, so that a trajectory can be
+        written chunk by chunk (its frames stay contiguous in one shard)
+        '''
+        if self.open_keys.get(group) != key:
+            return self.append(key, feat, group)
+        feat = self._to_numpy(feat)
+        name, f = self.files[group]
+        f.write(np.ascontiguousarray(feat, dtype=self.dtype).tobytes())
+        self.entries[key][2] += len(feat)
+        self.shards[name] += len(feat)
+
+    def _to_numpy(self, feat):
+        feat = feat.cpu().numpy() if torch.is_tensor(feat) else np.asarray(feat)
+        if self.frame_shape is None:
+            self.frame_shape = tuple(feat.shape[1:])
+        assert tuple(feat.shape[1:]) == self.frame_shape, 'feature shape %s does not match the store %s' % (feat.shape[1:], self.frame_shape)
+        return feat
+
+    def _shard_for(self, group, num_frames):
+        if group in self.files:
+            name, f = self.files[group]
+            if self.shards[name] == 0 or self.shards[name] + num_frames <= self.shard_frames:
+                return name, f
+            f.close()
+        n = len([s for s in self.shards if s.startswith(group + '_')])
+        name = '%s_%03d.bin' % (group, n)
+        self.shards[name] = 0
+        self.files[group] = (name, open(os.path.join(self.root, name), 'wb'))
+        return self.files[group]
+
+    def flush(self):
+        for name, f in self.files.values():
+            f.flush()
+        index = {'dtype': self.dtype.name, 'frame_shape': self.frame_shape, 'entries': self.entries, 'shards': self.shards}
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+        for name, f in self.files.values():
+            f.close()
+        self.files = {}
+        self.open_keys = {}
+
+
+class TaskDataset(Dataset):
+    '''
+    loads the preprocessed json and, with feat_pt, the ResNet features of each task, so that
+    DataLoader workers read ahead of the training loop. Features come from the packed store
+    (args.feat_store) when the trajectory is in it, otherwise from <trajectory>/<feat_pt>.
+    The loaded features are passed to featurize as ex['feat_frames'].
+    '''
+
+    def __init__(self, tasks, args, feat_pt=None):
+        self.tasks = tasks
+        self.args = args
+        self.feat_pt = feat_pt
+        feat_store = getattr(args, 'feat_store', None)
+        self.store = FeatureStore(feat_store) if feat_pt and feat_store else None
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __getitem__(self, i):
+        task = self.tasks[i]
+        json_path = os.path.join(self.args.data, task['task'], '%s' % self.args.pp_folder, 'ann_%d.json' % task['repeat_idx'])
+        with open(json_path) as f:
+            ex = json.load(f)
+        if self.feat_pt:
+            key = feature_key(ex['split'], ex['root'])
+            if self.store is not None and key in self.store:
+                ex['feat_frames'] = self.store.get(key)
+            else:
+                ex['feat_frames'] = torch.load(os.path.join(self.args.data, key, self.feat_pt))
+        return ex
+
+
+def pack_splits(data, splits, out, feat_pt='feat_conv.pt', dtype='float32', shard_frames=200000):
+    '''
+    pack the <trajectory>/<feat_pt> files of every split into one store, one series of shards per split
+    '''
+    writer = FeatureStoreWriter(out, dtype=dtype, shard_frames=shard_frames)
+    missing = []
+    for split, tasks in splits.items():
+        keys = sorted(set(feature_key(split, task['task']) for task in tasks))
+        print('Packing {} ({} trajectories)'.format(split, len(keys)))
+        for key in keys:
+            if key in writer:
+                continue
+            feat_path = os.path.join(data, key, feat_pt)
+            if not os.path.isfile(feat_path):
+                missing.append(feat_path)
+                continue
+            writer.append(key, torch.load(feat_path), group=split)
+        writer.flush()
+    writer.close()
+    if missing:
+        print('Missing features for {} trajectories, e.g. {}'.format(len(missing), missing[0]))
+    return writer
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--data', help='dataset folder', default='data/json_feat_2.1.0')
+    parser.add_argument('--splits', help='json file containing train/dev/test splits', default='data/splits/oct21.json')
+    parser.add_argument('--out', help='folder of the packed feature store', default='data/feat_store')
+    parser.add_argument('--feat_pt', help='filename of per-trajectory feats', default='feat_conv.pt')
+    parser.add_argument('--dtype', help='dtype of stored features', default='float32', choices=['float32', 'float16'])
+    parser.add_argument('--shard_frames', help='max frames per shard file', default=200000, type=int)
+    args = parser.parse_args()
+
+    with open(args.splits) as f:
+        splits = {k: v for k, v in json.load(f).items() if 'test' not in k}  # test splits have no expert frames
+    writer = pack_splits(args.data, splits, args.out, feat_pt=args.feat_pt, dtype=args.dtype, shard_frames=args.shard_frames)
+    print('Wrote {} trajectories in {} shards to {}'.format(len(writer.entries), len(writer.shards), args.out))
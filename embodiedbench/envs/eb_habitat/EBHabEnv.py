@@ -13,9 +13,9 @@ Dependencies:
 """
 import gym
 import os
+import itertools
 import time
 import json
-import imageio
 from PIL import Image 
 import numpy as np
 import habitat
@@ -33,6 +33,7 @@ import embodiedbench.envs.eb_habitat.predicate_task
 import embodiedbench.envs.eb_habitat.config
 import embodiedbench.envs.eb_habitat.measures
 from embodiedbench.envs.eb_habitat.utils import observations_to_image, merge_to_file, draw_text
+from embodiedbench.envs.video_writer import BackgroundVideoWriter
 from embodiedbench.main import logger
 
 HABITAT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config/task/language_rearrangement.yaml')
@@ -107,9 +108,104 @@ def transform_action_to_natural_language(skill_set):
     return language_skill_set
 
 
+def env_feedback_text(action, was_invalid, is_holding, feedback_verbosity):
+    """
+    Feedback message for an executed PDDL action (its compact string, e.g. 'pick_apple(robot_0)').
+    Returns (feedback, whether the robot holds an object after the action).
+    """
+    if was_invalid:
+        env_feedback = 'Last action is invalid.'
+        if 'pick' in action and feedback_verbosity:
+            if is_holding:
+                env_feedback += ' Robot cannot pick any object when holding something. Please place the object before picking something.'
+            else:
+                env_feedback += ' Robot cannot pick any object that is not near the robot. Navigate to other place to find the object.'
+        elif 'place' in action and feedback_verbosity:
+            if is_holding:
+                env_feedback += ' Robot cannot place any object that is not near the robot. Navigate to other place to find the object.'
+            else:
+                env_feedback += ' Robot cannot place any object when not holding something. Please pick the object before place it.'
+        elif 'open' in action and feedback_verbosity:
+            env_feedback += " Check whether the receptacle is already open or the robot is not near the receptacle."
+        elif 'close' in action and feedback_verbosity:
+            env_feedback += " Check whether the receptacle is already closed or the robot is not near the receptacle."
+    else:
+        env_feedback = 'Last action executed successfully'
+        if 'pick' in action and feedback_verbosity:
+            is_holding = True
+            env_feedback += ' and you are holding {}.'.format(action.split('(')[0].split('_')[1])
+        elif 'place' in action and feedback_verbosity:
+            is_holding = False
+            env_feedback += ' and you are holding nothing.'
+        elif 'open' in action and feedback_verbosity:
+            if 'fridge' in action:
+                env_feedback += ' and now refrigerator is open.'
+            elif 'cab' in action:
+                env_feedback += ' and now cabinet {} is open.'.format(action.split('(')[1].strip(')').split('_')[1])
+            else:
+                raise NotImplementedError
+        elif 'close' in action and feedback_verbosity:
+            if 'fridge' in action:
+                env_feedback += ' and now refrigerator is closed.'
+            elif 'cab' in action:
+                env_feedback += ' and now cabinet {} is closed.'.format(action.split('(')[1].strip(')').split('_')[1])
+            else:
+                raise NotImplementedError
+        else:
+            env_feedback += '.'
+
+    # we don't use this info
+    # env_feedback += ' The current task progress is {}.'.format(info['task_progress'])
+    return env_feedback, is_holding
+
+
+class ActionTable:
+    """
+    Lookup tables for the skill set of a task: action id <-> language action, and the feedback
+    message (and holding state) of every PDDL action for each (invalid, holding, verbosity)
+    outcome, so that a step does no string processing.
+    """
+
+    def __init__(self, skill_set):
+        self.language_skill_set = transform_action_to_natural_language(skill_set)
+        # first id of each description, as list.index would return
+        self.language_to_id = {}
+        for i, text in enumerate(self.language_skill_set):
+            self.language_to_id.setdefault(text, i)
+        self.feedback = {}
+        for name, param_names in skill_set:
+            # the compact string habitat reports as info['action']
+            action = '{}({})'.format(name, ','.join(param_names))
+            for was_invalid, is_holding, verbosity in itertools.product((False, True), repeat=3):
+                try:
+                    self.feedback[(action, was_invalid, is_holding, verbosity)] = env_feedback_text(
+                        action, was_invalid, is_holding, verbosity)
+                except NotImplementedError:
+                    # left to env_feedback_text, which raises at step time as before
+                    pass
+
+    def env_feedback(self, action, was_invalid, is_holding, feedback_verbosity):
+        entry = self.feedback.get((action, bool(was_invalid), bool(is_holding), bool(feedback_verbosity)))
+        if entry is None:
+            return env_feedback_text(action, was_invalid, is_holding, feedback_verbosity)
+        return entry
+
+
+# skill set -> ActionTable, shared by all envs and episodes with the same entity set
+_action_tables = {}
+
+
+def get_action_table(skill_set):
+    key = tuple((name, tuple(param_names)) for name, param_names in skill_set)
+    if key not in _action_tables:
+        _action_tables[key] = ActionTable(skill_set)
+    return _action_tables[key]
+
+
+
 
 class EBHabEnv(gym.Env):
-    def __init__(self, eval_set='train', exp_name='', down_sample_ratio=1.0, start_epi_index=0, resolution=500, recording=False):
+    def __init__(self, eval_set='train', exp_name='', down_sample_ratio=1.0, start_epi_index=0, resolution=500, recording=False, recording_stride=1, recording_scale=1.0):
         """
         Initialize the HabitatRearrange environment.
         """
@@ -139,9 +235,14 @@ class EBHabEnv(gym.Env):
         self.number_of_episodes = self.env.number_of_episodes * down_sample_ratio
         self._reset = False
         self._current_episode_num = 0 
-        while start_epi_index >= 1 and self._current_episode_num < start_epi_index:
-            self.env.reset(return_info=False)
-            self._current_episode_num += 1
+        if start_epi_index >= 1:
+            # advance the episode iterator directly instead of resetting the simulator for every skipped episode.
+            # habitat.Env.__init__ already took episode 0 from the iterator, so skip start_epi_index - 1 more
+            # and set the next one as the episode the first reset() runs
+            habitat_env = self.env.env.env._env
+            habitat_env.episode_iterator.skip(start_epi_index - 1)
+            habitat_env.current_episode = next(habitat_env.episode_iterator)
+            self._current_episode_num = start_epi_index
 
         self._current_step = 0
         self._max_episode_steps = 30
@@ -155,17 +256,27 @@ class EBHabEnv(gym.Env):
         # init instruction and skill sets
         self.episode_language_instruction = ''
         self.episode_data = None
-        self.skill_set = self.env.env.env._env.task.actions['pddl_hl_action']._action_datas
-        self.language_skill_set = transform_action_to_natural_language(self.skill_set)
+        self.skill_set = None
+        self._update_skill_set()
 
         # env feedback and image save
         # feedback verbosity, 0: concise, 1: verbose
         self.feedback_verbosity = 1
         self.log_path = 'running/eb_habitat/{}'.format(exp_name)
-        # video recorder
+        # video recorder, frames are encoded in the background while the episode runs
         self.recording = recording
-        self.episode_video = []
+        self.recording_stride = recording_stride
+        self.recording_scale = recording_scale
+        self.episode_video = None
         
+    def _update_skill_set(self):
+        """Look up the action tables when the task's skill set changes (they are cached per entity set)."""
+        skill_set = self.env.env.env._env.task.actions['pddl_hl_action']._action_datas
+        if skill_set is not self.skill_set:
+            self.skill_set = skill_set
+            self.action_table = get_action_table(skill_set)
+            self.language_skill_set = self.action_table.language_skill_set
+
     def current_episode(self, all_info: bool = False):
         return self.env.current_episode(all_info)
 
@@ -180,6 +291,10 @@ class EBHabEnv(gym.Env):
         logger.info('Episode {}: {}'.format(str(self._current_episode_num), str(self.current_episode())))
         self.episode_language_instruction = info['lang_goal']
         self.episode_data = self.dataset.episodes[self._current_episode_num]
+        assert self.current_episode().episode_id == self.episode_data.episode_id, \
+            'episode {} of the dataset is {}, but the env runs {}'.format(
+                self._current_episode_num, self.episode_data.episode_id, self.current_episode().episode_id)
+        self._update_skill_set()
         self._current_step = 0
         self._cur_invalid_actions = 0
         self._current_episode_num += 1
@@ -187,7 +302,10 @@ class EBHabEnv(gym.Env):
         self._reset = True
         self.episode_log = []
         if self.recording:
-            self.episode_video = []
+            self._discard_episode_video()
+            self.episode_video = BackgroundVideoWriter(
+                os.path.join(self.log_path, 'video', 'video_episode_{}.tmp.mp4'.format(self._current_episode_num)),
+                fps=30, stride=self.recording_stride, scale=self.recording_scale)
         self._episode_start_time = time.time()
         return obs
 
@@ -199,49 +317,8 @@ class EBHabEnv(gym.Env):
         Returns:
             str: Descriptive message about step outcome
         """
-        if info['was_prev_action_invalid']:
-            env_feedback = 'Last action is invalid.'
-            if 'pick' in info['action'] and self.feedback_verbosity:
-                if self.is_holding:
-                    env_feedback += ' Robot cannot pick any object when holding something. Please place the object before picking something.'
-                else:
-                    env_feedback += ' Robot cannot pick any object that is not near the robot. Navigate to other place to find the object.'
-            elif 'place' in info['action'] and self.feedback_verbosity:
-                if self.is_holding:
-                    env_feedback += ' Robot cannot place any object that is not near the robot. Navigate to other place to find the object.'
-                else:
-                    env_feedback += ' Robot cannot place any object when not holding something. Please pick the object before place it.'
-            elif 'open' in info['action'] and self.feedback_verbosity:
-                env_feedback += " Check whether the receptacle is already open or the robot is not near the receptacle."
-            elif 'close' in info['action'] and self.feedback_verbosity:
-                env_feedback += " Check whether the receptacle is already closed or the robot is not near the receptacle."
-        else:
-            env_feedback = 'Last action executed successfully'
-            if 'pick' in info['action'] and self.feedback_verbosity:
-                self.is_holding = True
-                env_feedback += ' and you are holding {}.'.format(info['action'].split('(')[0].split('_')[1])
-            elif 'place' in info['action'] and self.feedback_verbosity:
-                self.is_holding = False
-                env_feedback += ' and you are holding nothing.'
-            elif 'open' in info['action'] and self.feedback_verbosity:
-                if 'fridge' in info['action']:
-                    env_feedback += ' and now refrigerator is open.'
-                elif 'cab' in info['action']:
-                    env_feedback += ' and now cabinet {} is open.'.format(info['action'].split('(')[1].strip(')').split('_')[1])
-                else:
-                    raise NotImplementedError
-            elif 'close' in info['action'] and self.feedback_verbosity:
-                if 'fridge' in info['action']:
-                    env_feedback += ' and now refrigerator is closed.'
-                elif 'cab' in info['action']:
-                    env_feedback += ' and now cabinet {} is closed.'.format(info['action'].split('(')[1].strip(')').split('_')[1])
-                else:
-                    raise NotImplementedError
-            else:
-                env_feedback += '.'
-        
-        # we don't use this info
-        # env_feedback += ' The current task progress is {}.'.format(info['task_progress'])
+        env_feedback, self.is_holding = self.action_table.env_feedback(
+            info['action'], info['was_prev_action_invalid'], self.is_holding, self.feedback_verbosity)
         return env_feedback
 
     def step(self, action, reasoning='', **kwargs):
@@ -254,7 +331,9 @@ class EBHabEnv(gym.Env):
         """
         assert self._reset, 'Reset env before stepping'
         self._current_step += 1
+        step_start_time = time.time()
         obs, reward, done, info = self.env.step(action, **kwargs)
+        info['env_step_seconds'] = time.time() - step_start_time
         if self.recording:
             self.episode_video.append(self.env.render("rgb_array"))
 
@@ -305,14 +384,19 @@ class EBHabEnv(gym.Env):
                     json.dump(item, f, ensure_ascii=False)
                     f.write('\n')  
         
-        if len(self.episode_video):
-            folder = self.log_path + '/video'
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            video_writer = imageio.get_writer(os.path.join(folder, 'video_episode_{}_steps_{}.mp4'.format(self._current_episode_num, self._current_step)), fps=30)
-            for data in self.episode_video:
-                video_writer.append_data(data)
-            video_writer.close()
+        if self.episode_video is not None:
+            video_path = self.episode_video.close()
+            if video_path is not None:
+                os.replace(video_path, os.path.join(self.log_path, 'video', 'video_episode_{}_steps_{}.mp4'.format(self._current_episode_num, self._current_step)))
+            self.episode_video = None
+
+    def _discard_episode_video(self):
+        # the previous episode was not saved
+        if self.episode_video is not None:
+            video_path = self.episode_video.close()
+            if video_path is not None:
+                os.remove(video_path)
+            self.episode_video = None
 
 
 
@@ -321,6 +405,7 @@ class EBHabEnv(gym.Env):
 
     def close(self) -> None:
         """Terminate the environment."""
+        self._discard_episode_video()
         self.env.close()
 
 
@@ -335,8 +420,8 @@ if __name__ == '__main__':
     for _ in range(30):
         env.save_image(obs)
         action = int(input('action id: ')) #env.action_space.sample()
-        if action in env.language_skill_set:
-            action = env.language_skill_set.index(action)
+        if action in env.action_table.language_to_id:
+            action = env.action_table.language_to_id[action]
         else:
             action = int(action)
             if action < 0:
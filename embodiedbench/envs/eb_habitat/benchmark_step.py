@@ -0,0 +1,89 @@
+"""
+Replays recorded EB-Habitat episodes (the episode_*_step_*.json logs written by EBHabEnv)
+and reports the per-step simulator time together with the hit rate of the per-step
+predicate cache. Before replaying, the language actions and env feedback produced by the
+precomputed action tables are checked against the recorded ones. Run it twice to compare
+against uncached predicate evaluation:
+
+    python -m embodiedbench.envs.eb_habitat.benchmark_step --log_path running/eb_habitat/<exp>/base
+    pred_cache=0 python -m embodiedbench.envs.eb_habitat.benchmark_step --log_path running/eb_habitat/<exp>/base
+"""
+import os
+import re
+import glob
+import json
+import argparse
+import numpy as np
+from embodiedbench.envs.eb_habitat.EBHabEnv import EBHabEnv
+
+
+def load_recorded_actions(log_path):
+    """Map episode number -> list of executed action ids from the episode logs."""
+    episodes = {}
+    for filename in glob.glob(os.path.join(log_path, 'episode_*_step_*.json')):
+        episode_num = int(re.search(r'episode_(\d+)_step_', os.path.basename(filename)).group(1))
+        with open(filename, 'r', encoding='utf-8') as f:
+            episodes[episode_num] = [json.loads(line)['action_id'] for line in f if line.strip()]
+    return dict(sorted(episodes.items()))
+
+
+def check_action_tables(env, log_path):
+    """Compare action descriptions and env feedback from env.action_table with the logged ones."""
+    num_steps, mismatches = 0, []
+    for filename in sorted(glob.glob(os.path.join(log_path, 'episode_*_step_*.json'))):
+        is_holding = False
+        with open(filename, 'r', encoding='utf-8') as f:
+            steps = [json.loads(line) for line in f if line.strip()]
+        for step in steps:
+            # planner-side entries (invalid or empty plans) never reached the env
+            if 'env_feedback' not in step:
+                continue
+            num_steps += 1
+            feedback, is_holding = env.action_table.env_feedback(
+                step['action'], step['was_prev_action_invalid'], is_holding, env.feedback_verbosity)
+            description = env.language_skill_set[step['action_id']]
+            if feedback != step['env_feedback'] or description != step['action_description']:
+                mismatches.append((os.path.basename(filename), step['env_step']))
+    return num_steps, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log_path', type=str, required=True)
+    parser.add_argument('--eval_set', type=str, default='base')
+    parser.add_argument('--num_episodes', type=int, default=None)
+    args = parser.parse_args()
+
+    episodes = load_recorded_actions(args.log_path)
+    if args.num_episodes is not None:
+        episodes = dict(list(episodes.items())[:args.num_episodes])
+
+    env = EBHabEnv(eval_set=args.eval_set)
+    num_steps, mismatches = check_action_tables(env, args.log_path)
+    print('action tables: {} logged steps, {} mismatches{}'.format(
+        num_steps, len(mismatches), ': {}'.format(mismatches[:10]) if mismatches else ''))
+    pred_cache = env.env.env.env._env.task.pred_cache
+    step_times = []
+    for episode_num, actions in episodes.items():
+        # episode numbers in the log file names are 1-based
+        while env._current_episode_num < episode_num - 1:
+            env.env.reset(return_info=False)
+            env._current_episode_num += 1
+        env.reset()
+        for action in actions:
+            _, _, done, info = env.step(action)
+            step_times.append(info['env_step_seconds'])
+            if done:
+                break
+    env.close()
+
+    print('pred_cache enabled: {}'.format(pred_cache.enabled))
+    print('episodes: {}, steps: {}'.format(len(episodes), len(step_times)))
+    print('step time mean: {:.4f}s, median: {:.4f}s, p90: {:.4f}s'.format(
+        np.mean(step_times), np.median(step_times), np.percentile(step_times, 90)))
+    print('predicate cache hits: {}, misses: {}, hit rate: {:.2%}'.format(
+        pred_cache.hits, pred_cache.misses, pred_cache.hit_rate()))
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,7 @@ from episodes import LangRearrangeDatasetV0
 from generator import (LangRearrangeEpisodeGenerator,
                                      generate_all_instructions,
                                      get_flat_eps_split)
+from job_queue import EpisodeJobQueue, run_jobs, supervise_workers
 from utils import get_category_info
 from ..utils import get_parser
 
@@ -41,20 +42,48 @@ class LangEpisodeGeneratorConfig(RearrangeEpisodeGeneratorConfig):
     recep_cat_groups: Dict[str, Any] = field(default_factory=dict)
 
 
-def generate_episodes(args, cfg, conn, iter_eps, proc_idx):
-    with LangRearrangeEpisodeGenerator(
-        cfg=cfg,
-        instruct_path=args.instruct_path,
-        iter_eps=iter_eps,
-        debug_visualization=args.debug,
-        limit_scene_set=args.limit_scene_set,
-        proc_idx=proc_idx,
-    ) as ep_gen:
-        if not osp.isdir(args.db_output):
-            os.makedirs(args.db_output)
-        ep_gen.vdb.output_path = osp.abspath(args.db_output)
-        conn.send(ep_gen.generate_episodes(args.num_episodes, args.verbose))
-        conn.close()
+def generate_worker(args, cfg, ckpt_dir, worker_idx):
+    """
+    Generates jobs from the queue until it is drained. The input of a job is
+    its (split index, episode split), loaded from the queue; the split index
+    fixes the scene, and the generator (and its simulator) is kept across jobs.
+    """
+    queue = EpisodeJobQueue(ckpt_dir)
+    ep_gen = None
+
+    def run_job(name):
+        nonlocal ep_gen
+        split_idx, iter_eps = queue.load_input(name)
+        if ep_gen is None:
+            ep_gen = LangRearrangeEpisodeGenerator(
+                cfg=cfg,
+                instruct_path=args.instruct_path,
+                iter_eps=iter_eps,
+                debug_visualization=args.debug,
+                limit_scene_set=args.limit_scene_set,
+                proc_idx=split_idx,
+            )
+            if not osp.isdir(args.db_output):
+                os.makedirs(args.db_output)
+            ep_gen.vdb.output_path = osp.abspath(args.db_output)
+        else:
+            ep_gen.set_iter_eps(iter_eps, split_idx)
+        result = ep_gen.generate_episodes(args.num_episodes, args.verbose)
+        if len(result) != args.num_episodes:
+            logger.warning(
+                f"Problem generating job {name}. Expected {args.num_episodes}, got {len(result)}"
+            )
+        return result
+
+    def close_gen():
+        nonlocal ep_gen
+        if ep_gen is not None:
+            ep_gen.__exit__(None, None, None)
+            ep_gen = None
+
+    run_jobs(queue, worker_idx, run_job, args.max_attempts, on_error=close_gen)
+    close_gen()
+    queue.close()
 
 
 def summarize_episodes(episodes, show_examples=False, tokenizer_name=None):
@@ -111,7 +140,13 @@ def get_base_info(cfg, args, conn):
     print("Done rearrange gen")
     tmp_ep_gen.sim.close(destroy=True)
     del tmp_ep_gen.sim
-    conn.send((tmp_ep_gen._obj_sets, tmp_ep_gen._receptacle_sets))
+    conn.send(
+        (
+            tmp_ep_gen._obj_sets,
+            tmp_ep_gen._receptacle_sets,
+            tmp_ep_gen._scene_sampler.num_scenes(),
+        )
+    )
     del tmp_ep_gen
     conn.close()
 
@@ -154,7 +189,7 @@ def start(args):
     )
     proc.daemon = True
     proc.start()
-    obj_sets, recep_sets = parent_conn.recv()
+    obj_sets, recep_sets, num_scenes = parent_conn.recv()
     proc.join()
 
     assert args.seed is not None
@@ -182,39 +217,27 @@ def start(args):
     for k in ep_keys:
         rng.shuffle(all_eps[k])
 
-    proc_infos = []
+    n_jobs = args.n_jobs if args.n_jobs is not None else args.n_procs
     to_gen_distinct_instructs = defaultdict(lambda: [set(), 0])
-
-    for i in range(args.n_procs):
-        use_cfg = cfg.copy()
-        use_cfg.gpu_device_id = i // procs_per_gpu
-        parent_conn, child_conn = mp_ctx.Pipe()
+    job_eps = {}
+    job_scenes = []
+    for i in range(n_jobs):
         iter_eps = get_flat_eps_split(
             all_eps,
             i,
             args.total_take,
             args.cur_gen_idx,
-            args.n_procs,
+            n_jobs,
             args.num_episodes,
             instruct_samples,
         )
         for ep in iter_eps:
             to_gen_distinct_instructs[ep.instruct_info.instruct_id][0].add(ep.instruct)
             to_gen_distinct_instructs[ep.instruct_info.instruct_id][1] += 1
-
-        if args.proc_debug:
-            p = Thread(
-                target=generate_episodes,
-                args=(args, use_cfg, child_conn, iter_eps, i),
-            )
-        else:
-            p = mp_ctx.Process(
-                target=generate_episodes,
-                args=(args, use_cfg, child_conn, iter_eps, i),
-            )
-        print(f"Starting worker {i}")
-        p.start()
-        proc_infos.append((parent_conn, p))
+        # The generator picks the scene from the split index.
+        name = f"gen{args.cur_gen_idx}-{i:04d}"
+        job_eps[name] = (i, iter_eps)
+        job_scenes.append((name, f"scene{i % num_scenes}"))
 
     total_distinct = sum(len(x[0]) for x in to_gen_distinct_instructs.values())
     total_instructs = sum(x[1] for x in to_gen_distinct_instructs.values())
@@ -223,28 +246,32 @@ def start(args):
         print(f"    {k}: {len(v[0])} distinct, {v[1]} total")
     print()
 
-    not_collected = list(range((len(proc_infos))))
-    for i, (conn, proc) in enumerate(proc_infos):
-        try:
-            result = conn.recv()
-        except EOFError as e:
-            logger.warning(f"Problem in worker {i}. Could not generate any episodes.")
-            continue
-        proc.join()
-        if result is None:
-            print("Result is none skipping")
-            continue
-        n_eps_collected = len(result)
-        not_collected.pop(not_collected.index(i))
-        print(
-            f"Collected {n_eps_collected} episodes from worker {i}. Waiting for {not_collected}"
-        )
-        dataset.episodes.extend(result)
-        if n_eps_collected != args.num_episodes:
-            logger.warning(
-                f"Problem collecting episodes from worker {i}. Expected {args.num_episodes}, got {n_eps_collected}"
-            )
-        print("Done extending episodes list.")
+    ckpt_dir = osp.splitext(args.out)[0] + "_ckpt"
+    if args.no_resume:
+        EpisodeJobQueue.clear(ckpt_dir)
+    queue = EpisodeJobQueue(ckpt_dir)
+    n_todo = queue.add_jobs(job_scenes, job_eps)
+    print(f"{n_todo} of {n_jobs} jobs to generate, checkpoints in {ckpt_dir}")
+
+    def start_worker(worker_idx):
+        use_cfg = cfg.copy()
+        use_cfg.gpu_device_id = worker_idx // procs_per_gpu
+        worker_args = (args, use_cfg, ckpt_dir, worker_idx)
+        if args.proc_debug:
+            p = Thread(target=generate_worker, args=worker_args)
+        else:
+            p = mp_ctx.Process(target=generate_worker, args=worker_args)
+        print(f"Starting worker {worker_idx}")
+        p.start()
+        return p
+
+    if n_todo > 0:
+        supervise_workers(queue, start_worker, args.n_procs, args.max_attempts)
+
+    for name, error in queue.failed_jobs().items():
+        logger.warning(f"Could not generate job {name}: {error}")
+    dataset.episodes.extend(queue.load_results())
+    queue.close()
     print("Summarizing the episodes")
     summarize_episodes(dataset.episodes)
 
@@ -287,6 +314,23 @@ if __name__ == "__main__":
         default=200_000,
         help="The maximum number of instruction allowed per instruction type.",
     )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=None,
+        help="Number of queued jobs of `--num-episodes` episodes each (defaults to `--n-procs`).",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Attempts per job before it is given up.",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Discard the job checkpoints of a previous run instead of skipping the finished jobs.",
+    )
     parser.add_argument("--proc-debug", action="store_true")
     parser.add_argument(
         "--instruct-dir", default="interactive_and_embodied/projects/llarp/instructs"
@@ -32,6 +32,7 @@ import config
 import dataset
 # import llarp.task
 from create_episodes import summarize_episodes
+from job_queue import EpisodeJobQueue, run_jobs, supervise_workers
 from utils import get_instruct_data
 from utils import PLACABLE_RECEP_TYPE, get_allowed_actions
 
@@ -139,7 +140,11 @@ def get_obs(env):
 
 
 class DataValidator:
-    def __init__(self):
+    def __init__(self, symbolic_presearch=True):
+        self._symbolic_presearch = symbolic_presearch
+        self._symbolic_counts = defaultdict(int)
+        self._method_times = defaultdict(lambda: deque(maxlen=100))
+        self._last_method = None
         self._bad_ep_ids = []
         self._good_idxs = []
         self._bad_causes = defaultdict(int)
@@ -192,34 +197,34 @@ class DataValidator:
             SimulatorObjectType.ARTICULATED_RECEPTACLE_ENTITY.value
         ]
         new_preds = self._pddl.get_true_predicates()
-        ret_preds = []
-        for pred in new_preds:
-            if pred.name not in self._core_preds:
-                continue
-
-            if pred.name == "on_top":
-                obj_entity = pred._arg_values[0]
-                if obj_entity not in self._relevant_entities:
-                    continue
-
-            # Ignore the object in robot_at if it is not of interest
-            if (
-                pred.name in ["robot_at", "robot_at_obj"]
-                and pred._arg_values[0].expr_type.parent.name
-                == SimulatorObjectType.MOVABLE_ENTITY.value
-                and pred._arg_values[0] not in self._relevant_entities
-            ):
-                continue
-
-            if (
-                pred.name in ["robot_at", "robot_at_obj"]
-                and pred._arg_values[0].expr_type.is_subtype_of(recep_type)
-                and not self._has_recep_entity
-            ):
-                continue
-
-            ret_preds.append(pred)
-        return ret_preds
+        return [pred for pred in new_preds if self._is_core_pred(pred, recep_type)]
+
+    def _is_core_pred(self, pred, recep_type):
+        if pred.name not in self._core_preds:
+            return False
+
+        if pred.name == "on_top":
+            obj_entity = pred._arg_values[0]
+            if obj_entity not in self._relevant_entities:
+                return False
+
+        # Ignore the object in robot_at if it is not of interest
+        if (
+            pred.name in ["robot_at", "robot_at_obj"]
+            and pred._arg_values[0].expr_type.parent.name
+            == SimulatorObjectType.MOVABLE_ENTITY.value
+            and pred._arg_values[0] not in self._relevant_entities
+        ):
+            return False
+
+        if (
+            pred.name in ["robot_at", "robot_at_obj"]
+            and pred._arg_values[0].expr_type.is_subtype_of(recep_type)
+            and not self._has_recep_entity
+        ):
+            return False
+
+        return True
 
     def _setup_core_preds(self):
         recep_type = self._pddl.expr_types[
@@ -264,6 +269,143 @@ class DataValidator:
             ret_acs = [ac for ac in self._all_actions if ac.name != "place"]
         return ret_acs
 
+    def _symbolic_successor(self, preds, action):
+        """
+        Predicts the core predicates after applying `action`, following the
+        postconditions of the PDDL domain (`config/task/pddl_domain_replica_cad.yaml`)
+        projected onto the predicates tracked by `_get_preds`. Returns None if
+        the successor cannot be predicted.
+        """
+
+        recep_type = self._pddl.expr_types[
+            SimulatorObjectType.ARTICULATED_RECEPTACLE_ENTITY.value
+        ]
+        state = {pred_to_str(pred): pred for pred in preds}
+
+        def add(name, *args):
+            pred = self._possible_preds.get(f"{name}({','.join(x.name for x in args)})")
+            if pred is not None and self._is_core_pred(pred, recep_type):
+                state[pred_to_str(pred)] = pred
+
+        def remove(matches):
+            for k in [k for k, pred in state.items() if matches(pred)]:
+                del state[k]
+
+        entity = action.param_values[0] if len(action.param_values) > 0 else None
+        if action.name == "nav":
+            remove(lambda pred: pred.name in ["robot_at", "robot_at_obj"])
+            add("robot_at", entity)
+            for pred in preds:
+                if pred.name in ["on_top", "in"] and pred._arg_values[1] == entity:
+                    add("robot_at_obj", pred._arg_values[0])
+        elif action.name.startswith("pick_"):
+            # The picked object is bound by the precondition: an object of the category next to the robot.
+            pick_obj_name = action.name[len("pick_") :]
+            objs = [
+                pred._arg_values[0]
+                for pred in preds
+                if pred.name == "robot_at_obj"
+                and pred._arg_values[0].expr_type.name == pick_obj_name
+            ]
+            if len(objs) == 0:
+                return None
+            obj = objs[0]
+            remove(
+                lambda pred: pred.name == "not_holding"
+                or (pred.name in ["on_top", "in"] and pred._arg_values[0] == obj)
+            )
+            add("holding", obj)
+        elif action.name == "place":
+            held = [pred._arg_values[0] for pred in preds if pred.name == "holding"]
+            if len(held) == 0:
+                return None
+            remove(lambda pred: pred.name == "holding")
+            add("not_holding")
+            # Only one of them exists, depending on the receptacle type.
+            add("on_top", held[0], entity)
+            add("in", held[0], entity)
+            add("robot_at_obj", held[0])
+        elif action.name in RECEP_ACTIONS:
+            verb, recep_kind = action.name.split("_")
+            remove(
+                lambda pred: pred.name in [f"opened_{recep_kind}", f"closed_{recep_kind}"]
+                and pred._arg_values[0] == entity
+            )
+            add(f"{'opened' if verb == 'open' else 'closed'}_{recep_kind}", entity)
+        else:
+            return None
+        return list(state.values())
+
+    def _symbolic_search(self, start_preds, goal_expr):
+        """
+        The same BFS as `_compute_subgoals`, but over predicted predicate
+        states only. Returns the list of actions reaching the goal or None.
+        """
+
+        Q = deque([SearchNode(start_preds, None, None, None, 0, None)])
+        visited = set([get_pred_hash(start_preds)])
+        while len(Q) != 0:
+            node = Q.popleft()
+            if node.depth > SEARCH_DEPTH_TIMEOUT:
+                break
+            for action in self._get_cur_actions(node):
+                if not action.is_precond_satisfied_from_predicates(node.pred_state):
+                    continue
+                new_preds = self._symbolic_successor(node.pred_state, action)
+                if new_preds is None:
+                    continue
+                new_node = SearchNode(new_preds, action, node, None, node.depth + 1, None)
+                if goal_expr.is_true_from_predicates(new_preds):
+                    plan = []
+                    while new_node.prev_action is not None:
+                        plan.insert(0, new_node.prev_action)
+                        new_node = new_node.parent
+                    return plan
+                new_pred_hash = get_pred_hash(new_preds)
+                if new_pred_hash not in visited:
+                    visited.add(new_pred_hash)
+                    Q.append(new_node)
+        return None
+
+    def _verify_plan(self, env, ordered_actions, plan, start_state, start_obs, start_preds, goal_expr):
+        """
+        Executes a symbolic plan in the simulator. Returns the episode info if
+        every precondition holds on the simulated predicates and the goal is
+        reached, otherwise None.
+        """
+
+        sim_info = self._pddl.sim_info
+        sim = sim_info.sim
+        sim.set_state(start_state, True)
+
+        pred_state = start_preds
+        pred_subgoals = []
+        obs = [start_obs]
+        for action in plan:
+            if not action.is_precond_satisfied_from_predicates(pred_state):
+                return None
+            action.apply(sim_info)
+            pred_state = self._get_preds()
+            obs.append({k: np.copy(v) for k, v in get_obs(env).items()})
+            subgoal_preds = [
+                pred_to_str(pred) for pred in pred_state if pred not in start_preds
+            ]
+            if len(subgoal_preds) != 0:
+                pred_subgoals.append(subgoal_preds)
+
+        if not goal_expr.is_true_from_predicates(pred_state):
+            return None
+
+        all_obs = stack_obs(obs)
+        head_rgb = all_obs["head_rgb"]
+        sums = head_rgb.reshape(head_rgb.shape[0], -1).sum(1)
+        if np.all(sums == sums[0]) and len(plan) > 2:
+            # Let the full search decide about static demos.
+            return None
+
+        action_idxs = [ordered_actions.index(ac.compact_str) for ac in plan]
+        return EpisodeInfo(np.array(action_idxs), pred_subgoals, all_obs)
+
     def _compute_subgoals(self, env, ordered_actions):
         """
         Performs BFS to find a path from the start to the predicate goal state.
@@ -313,6 +455,27 @@ class DataValidator:
 
         start_state = sim.capture_state()
 
+        if self._symbolic_presearch:
+            # Plan over predicates first and only verify the candidate plan in
+            # the simulator; fall back to the simulated BFS on mismatch.
+            self._possible_preds = {
+                pred_to_str(pred): pred for pred in self._pddl.get_possible_predicates()
+            }
+            plan = self._symbolic_search(start_preds, goal_expr)
+            if plan is None:
+                self._symbolic_counts["no_plan"] += 1
+            else:
+                ep_info = self._verify_plan(
+                    env, ordered_actions, plan, start_state, start_obs, start_preds, goal_expr
+                )
+                sim.set_state(start_state)
+                if ep_info is not None:
+                    self._symbolic_counts["verified"] += 1
+                    self._last_method = "symbolic"
+                    return ep_info, "good_episode"
+                self._symbolic_counts["sim_mismatch"] += 1
+        self._last_method = "bfs"
+
         Q = deque([SearchNode(start_preds, None, None, start_state, 0, start_obs)])
         visited = set([get_pred_hash(start_preds)])
 
@@ -393,6 +556,15 @@ class DataValidator:
 
     def _print_stats(self):
         print(f"Average search time: {np.mean(self._avg_times)} seconds")
+        for method, times in self._method_times.items():
+            print(f"  {method}: {np.mean(times):.3f} seconds per episode")
+        if self._symbolic_presearch:
+            n_searched = sum(self._symbolic_counts.values())
+            print(
+                f"Symbolic pre-search agreement: {self._symbolic_counts['verified']}/{n_searched}"
+                f" (no symbolic plan {self._symbolic_counts['no_plan']},"
+                f" simulator mismatch {self._symbolic_counts['sim_mismatch']})"
+            )
         print(
             f"Ac len {np.mean(self._ac_lens)}, Subgoal len {np.mean(self._subgoal_lens)}"
         )
@@ -506,7 +678,9 @@ class DataValidator:
             start_t = time.time()
             # Get without the semantic ID since the same solution will apply even with semantic info.
             base_instruct_id = env.current_episode.instruct_id.split("_")[0]
+            self._last_method = None
             if base_instruct_id in self._instruct_sols:
+                self._last_method = "solution_template"
                 ep_info, msg = self._compute_subgoals_from_sol(
                     env,
                     ordered_actions,
@@ -516,6 +690,8 @@ class DataValidator:
             else:
                 ep_info, msg = self._compute_subgoals(env, ordered_actions)
             search_time = time.time() - start_t
+            if self._last_method is not None:
+                self._method_times[self._last_method].append(search_time)
 
             if ep_info is None:
                 self._bad_causes[msg] += 1
@@ -538,21 +714,65 @@ class DataValidator:
         return ret_eps
 
 
-def validate_eps(config, eps, conn):
-    dataset = make_dataset(
-        config.habitat.dataset.type, config=config.habitat.dataset, preset_eps=eps
-    )
-    data_validator = DataValidator()
-    with habitat.Env(config=config, dataset=dataset) as env:
-        print("Starting validation")
-        conn.send(data_validator.validate_eps(env))
-    conn.close()
+def get_scene_jobs(eps, job_size: int) -> Dict[str, list]:
+    """
+    Splits the episodes into jobs of at most `job_size` episodes of a single
+    scene. Job names are stable across runs over the same episodes, so finished
+    jobs are recognized by their checkpoints on restart.
+    """
+    scene_eps = defaultdict(list)
+    for ep in eps:
+        scene_eps[ep.scene_id].append(ep)
+    jobs = {}
+    for scene_id in sorted(scene_eps.keys()):
+        scene_name = osp.basename(scene_id).split(".")[0]
+        use_eps = scene_eps[scene_id]
+        for i in range(0, len(use_eps), job_size):
+            jobs[f"{scene_name}-{i // job_size:03d}"] = use_eps[i : i + job_size]
+    return jobs
+
+
+def validate_worker(
+    config, ckpt_dir, worker_idx, symbolic_presearch=True, max_attempts=3
+):
+    """
+    Validates jobs from the queue until it is drained, loading the episodes of
+    each job from the queue. The environment (and the scene loaded in
+    habitat-sim) is kept across jobs and only the episodes are swapped, so
+    consecutive jobs of the same scene skip the scene load.
+    """
+    queue = EpisodeJobQueue(ckpt_dir)
+    data_validator = DataValidator(symbolic_presearch)
+    env = None
+
+    def run_job(name):
+        nonlocal env
+        eps = queue.load_input(name)
+        if env is None:
+            dataset = make_dataset(
+                config.habitat.dataset.type, config=config.habitat.dataset, preset_eps=eps
+            )
+            env = habitat.Env(config=config, dataset=dataset)
+            print("Starting validation")
+        else:
+            env.episodes = eps
+            env.number_of_episodes = len(eps)
+        return data_validator.validate_eps(env)
+
+    def close_env():
+        nonlocal env
+        if env is not None:
+            env.close()
+            env = None
+
+    run_jobs(queue, worker_idx, run_job, max_attempts, on_error=close_env)
+    close_env()
+    queue.close()
 
 
 def start(args):
     config = habitat.get_config(args.cfg, args.opts)
     dataset = make_dataset(config.habitat.dataset.type, config=config.habitat.dataset)
-    split_datasets = []
     eps = dataset.episodes
     if args.limit_count is not None:
         eps = eps[: args.limit_count]
@@ -566,50 +786,43 @@ def start(args):
     if args.only_summarize:
         return
 
-    split_size = len(eps) // args.n_procs
-    for i in range(args.n_procs):
-        split_datasets.append(eps[split_size * i : (i + 1) * split_size])
+    save_prefix = config.habitat.dataset.data_path.split(".")[0]
+    ckpt_dir = save_prefix + "_val_ckpt"
+    if args.no_resume:
+        EpisodeJobQueue.clear(ckpt_dir)
+    job_eps = get_scene_jobs(eps, args.job_size)
+    queue = EpisodeJobQueue(ckpt_dir)
+    n_todo = queue.add_jobs(
+        [(name, job[0].scene_id) for name, job in job_eps.items()], job_eps
+    )
+    print(f"{n_todo} of {len(job_eps)} jobs to validate, checkpoints in {ckpt_dir}")
 
-    proc_infos = []
     mp_ctx = mp.get_context("forkserver")
 
-    for split_dataset in split_datasets:
-        parent_conn, child_conn = mp_ctx.Pipe()
+    def start_worker(worker_idx):
+        worker_args = (
+            config,
+            ckpt_dir,
+            worker_idx,
+            not args.no_symbolic_presearch,
+            args.max_attempts,
+        )
         if args.proc_debug:
-            p = Thread(
-                target=validate_eps,
-                args=(config, split_dataset, child_conn),
-            )
+            p = Thread(target=validate_worker, args=worker_args)
         else:
-            p = mp_ctx.Process(
-                target=validate_eps,
-                args=(config, split_dataset, child_conn),
-            )
+            p = mp_ctx.Process(target=validate_worker, args=worker_args)
         p.start()
-        proc_infos.append((parent_conn, p))
-
-    dataset.episodes = []
-    all_actions = []
-    all_obs = defaultdict(list)
-    all_masks = []
-    all_instructs = []
-
-    orig_ordered_instruct = None
-    for i, (conn, proc) in enumerate(proc_infos):
-        try:
-            ret_eps = conn.recv()
-        except EOFError as e:
-            print(e)
-            print(f"Process {i} crashed")
-            continue
-        dataset.episodes.extend(ret_eps)
-
-        proc.join()
-        print(f"Process {i} finished")
+        return p
 
-    summarize_episodes(dataset.episodes)
+    if n_todo > 0:
+        supervise_workers(queue, start_worker, args.n_procs, args.max_attempts)
 
-    save_prefix = config.habitat.dataset.data_path.split(".")[0]
+    for name, error in queue.failed_jobs().items():
+        print(f"Job {name} failed: {error}")
+    dataset.episodes = queue.load_results()
+    queue.close()
+
+    summarize_episodes(dataset.episodes)
 
     new_ep_path = save_prefix + "_val.pickle"
     num_distinct_instructs = len(set(ep.instruction for ep in dataset.episodes))
@@ -634,6 +847,28 @@ if __name__ == "__main__":
     parser.add_argument("--n-procs", default=1, type=int)
     parser.add_argument("--proc-debug", action="store_true")
     parser.add_argument("--only-summarize", action="store_true")
+    parser.add_argument(
+        "--no-symbolic-presearch",
+        action="store_true",
+        help="Always search in the simulator instead of verifying a symbolic plan.",
+    )
+    parser.add_argument(
+        "--job-size",
+        default=50,
+        type=int,
+        help="Maximum number of episodes (all from one scene) per queued job.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        default=3,
+        type=int,
+        help="Attempts per job before it is given up.",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Discard the job checkpoints of a previous run instead of skipping the finished jobs.",
+    )
     parser.add_argument(
         "opts",
         default=None,
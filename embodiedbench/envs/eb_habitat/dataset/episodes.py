@@ -3,10 +3,14 @@
 # Copyright (C) 2024 Apple Inc. All Rights Reserved.
 #
 import os
+import mmap
 import json
 import pickle
 import random
+import struct
+from collections.abc import Sequence
 from itertools import groupby
+from types import SimpleNamespace
 from typing import Any, Dict, List, Optional
 
 import attr
@@ -21,6 +25,9 @@ from habitat.datasets.rearrange.rearrange_dataset import (RearrangeDatasetV0,
 from habitat.tasks.rearrange.multi_task.pddl_predicate import Predicate
 
 DEFAULT_PHYSICS_CONFIG_PATH = os.path.join(os.path.dirname(__file__), '../data/default.physics_config.json')
+# Load episodes lazily from the indexed episode store built next to the dataset pickle.
+LAZY_EPISODES = os.environ.get("habitat_lazy_episodes", "1") == "1"
+EPISODE_STORE_MAGIC = b"EBHABEP1"
 
 def check_and_gen_physics_config():
     if os.path.exists(DEFAULT_PHYSICS_CONFIG_PATH):
@@ -52,6 +59,184 @@ class LangRearrangeEpisode(RearrangeEpisode):
     subgoals: List[List[str]] = None
 
 
+def decode_binary_episode(ep, all_T, idx_to_name) -> Dict[str, Any]:
+    """
+    Converts one episode record of `LangRearrangeDatasetV0.to_binary` back into
+    the keyword arguments of `LangRearrangeEpisode`.
+    """
+    ep["rigid_objs"] = [
+        [idx_to_name[ni], all_T[ti]] for ni, ti in ep["rigid_objs"]
+    ]
+    ep["ao_states"] = {idx_to_name[ni]: v for ni, v in ep["ao_states"].items()}
+    ep["name_to_receptacle"] = {
+        idx_to_name[k]: idx_to_name[v] for k, v in ep["name_to_receptacle"]
+    }
+
+    new_markers = []
+    for name, mtype, offset, link, obj in ep["markers"]:
+        new_markers.append(
+            {
+                "name": idx_to_name[name],
+                "type": idx_to_name[mtype],
+                "params": {
+                    "offset": offset,
+                    "link": idx_to_name[link],
+                    "object": idx_to_name[obj],
+                },
+            }
+        )
+    ep["markers"] = new_markers
+    return ep
+
+
+def episode_store_path(datasetfile_path: str) -> str:
+    return os.path.splitext(datasetfile_path)[0] + ".episodes"
+
+
+def is_episode_store_fresh(store_path: str, datasetfile_path: str) -> bool:
+    if not os.path.exists(store_path):
+        return False
+    if not os.path.exists(datasetfile_path):
+        return True
+    return os.path.getmtime(store_path) >= os.path.getmtime(datasetfile_path)
+
+
+def write_episode_store(store_path: str, data_dict: Dict[str, Any]) -> None:
+    """
+    Writes the output of `to_binary` as an indexed episode store:
+    magic | header length (u64) | pickled header | offset table (u64 * (n + 1)) | episode records.
+    Each record is a self-contained pickled episode (names and transforms
+    already resolved), so a single episode can be read without the rest.
+    """
+    all_T = data_dict["all_transforms"]
+    idx_to_name = data_dict["idx_to_name"]
+    records = []
+    scene_ids = []
+    for ep in data_dict["all_eps"]:
+        ep = decode_binary_episode(dict(ep), all_T, idx_to_name)
+        scene_ids.append(ep["scene_id"])
+        records.append(pickle.dumps(ep, protocol=pickle.HIGHEST_PROTOCOL))
+    header = pickle.dumps(
+        {"num_episodes": len(records), "scene_ids": scene_ids},
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    offsets = np.zeros(len(records) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(record) for record in records])
+
+    # write to a temporary file first so concurrent workers never see a partial store
+    tmp_path = f"{store_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(EPISODE_STORE_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(offsets.tobytes())
+        for record in records:
+            f.write(record)
+    os.replace(tmp_path, store_path)
+
+
+class EpisodeStore:
+    """
+    Read-only, memory-mapped view of an indexed episode store. Opening it only
+    parses the header and maps the offset table; `get_episode(i)` decodes a
+    single record. Loaded episodes are kept so in-place edits (e.g. subgoals
+    set by the dataset validator) persist.
+    """
+
+    def __init__(self, store_path: str) -> None:
+        self.store_path = store_path
+        self._open()
+
+    def _open(self) -> None:
+        with open(self.store_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic_len = len(EPISODE_STORE_MAGIC)
+        if self._mm[:magic_len] != EPISODE_STORE_MAGIC:
+            raise ValueError(f"{self.store_path} is not an episode store")
+        (header_len,) = struct.unpack_from("<Q", self._mm, magic_len)
+        header_start = magic_len + 8
+        header = pickle.loads(self._mm[header_start : header_start + header_len])
+        self.num_episodes = header["num_episodes"]
+        self.scene_ids = header["scene_ids"]
+        offsets_start = header_start + header_len
+        self._offsets = np.frombuffer(
+            self._mm, dtype="<u8", count=self.num_episodes + 1, offset=offsets_start
+        )
+        self._data_start = offsets_start + 8 * (self.num_episodes + 1)
+        self._loaded: Dict[int, LangRearrangeEpisode] = {}
+
+    def __len__(self) -> int:
+        return self.num_episodes
+
+    def get_episode(self, i: int) -> "LangRearrangeEpisode":
+        if i not in self._loaded:
+            start = self._data_start + int(self._offsets[i])
+            end = self._data_start + int(self._offsets[i + 1])
+            episode = LangRearrangeEpisode(**pickle.loads(self._mm[start:end]))
+            episode.episode_id = str(i)
+            self._loaded[i] = episode
+        return self._loaded[i]
+
+    def __getstate__(self):
+        # the memory map is re-opened in worker processes instead of being pickled
+        return {"store_path": self.store_path}
+
+    def __setstate__(self, state):
+        self.store_path = state["store_path"]
+        self._open()
+
+
+class LazyEpisodeList(Sequence):
+    """
+    List-like view over a subset of the episodes of an `EpisodeStore`.
+    Slicing, filtering by scene and sharding only touch the index, episodes
+    are decoded on access.
+    """
+
+    def __init__(self, store: EpisodeStore, indices: Optional[List[int]] = None) -> None:
+        self.store = store
+        self.indices = list(range(len(store))) if indices is None else indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return LazyEpisodeList(self.store, self.indices[i])
+        return self.store.get_episode(self.indices[i])
+
+    def __iter__(self):
+        for i in self.indices:
+            yield self.store.get_episode(i)
+
+    def scene_id(self, i: int) -> str:
+        return self.store.scene_ids[self.indices[i]]
+
+    @property
+    def scene_ids(self) -> List[str]:
+        return [self.store.scene_ids[i] for i in self.indices]
+
+    def filter(self, scene_filter) -> "LazyEpisodeList":
+        """Applies an episode filter that only looks at `scene_id`."""
+        return LazyEpisodeList(
+            self.store,
+            [
+                i
+                for i in self.indices
+                if scene_filter(SimpleNamespace(scene_id=self.store.scene_ids[i]))
+            ],
+        )
+
+
+def shard_episodes(episodes, shard_id: int, num_shards: int):
+    """Contiguous block `shard_id` out of `num_shards` of the episodes."""
+    if num_shards <= 1:
+        return episodes
+    assert 0 <= shard_id < num_shards
+    n = len(episodes)
+    return episodes[shard_id * n // num_shards : (shard_id + 1) * n // num_shards]
+
+
 @registry.register_dataset(name="LangRearrangeDataset-v0")
 class LangRearrangeDatasetV0(RearrangeDatasetV0):
     def __init__(self, config=None, preset_eps=None) -> None:
@@ -66,16 +251,41 @@ class LangRearrangeDatasetV0(RearrangeDatasetV0):
 
         if preset_eps is None:
             datasetfile_path = config.data_path.format(split=config.split)
-            logger.info(f"Loading from {datasetfile_path}")
-            with open(datasetfile_path, "rb") as f:
-                self.from_binary(pickle.load(f), scenes_dir=config.scenes_dir)
-
-            self.episodes = list(
-                filter(self.build_content_scenes_filter(config), self.episodes)
+            store_path = episode_store_path(datasetfile_path)
+            if LAZY_EPISODES and is_episode_store_fresh(store_path, datasetfile_path):
+                logger.info(f"Loading lazily from {store_path}")
+                self.episodes = LazyEpisodeList(EpisodeStore(store_path)).filter(
+                    self.build_content_scenes_filter(config)
+                )
+            else:
+                logger.info(f"Loading from {datasetfile_path}")
+                with open(datasetfile_path, "rb") as f:
+                    data_dict = pickle.load(f)
+                if LAZY_EPISODES:
+                    # one-time conversion, later loads only touch the header and offset table
+                    try:
+                        write_episode_store(store_path, data_dict)
+                    except OSError as e:
+                        logger.warning(f"Could not write episode store {store_path}: {e}")
+                self.from_binary(data_dict, scenes_dir=config.scenes_dir)
+
+                self.episodes = list(
+                    filter(self.build_content_scenes_filter(config), self.episodes)
+                )
+            self.episodes = shard_episodes(
+                self.episodes,
+                int(os.environ.get("habitat_shard_id", 0)),
+                int(os.environ.get("habitat_num_shards", 1)),
             )
         else:
             self.episodes = preset_eps
 
+    @property
+    def scene_ids(self) -> List[str]:
+        if isinstance(self.episodes, LazyEpisodeList):
+            return sorted(set(self.episodes.scene_ids))
+        return sorted({episode.scene_id for episode in self.episodes})
+
     def to_json(self) -> str:
         result = DatasetFloatJSONEncoder().encode(self)
         return result
@@ -153,30 +363,9 @@ class LangRearrangeDatasetV0(RearrangeDatasetV0):
         all_T = data_dict["all_transforms"]
         idx_to_name = data_dict["idx_to_name"]
         for i, ep in enumerate(data_dict["all_eps"]):
-            ep["rigid_objs"] = [
-                [idx_to_name[ni], all_T[ti]] for ni, ti in ep["rigid_objs"]
-            ]
-            ep["ao_states"] = {idx_to_name[ni]: v for ni, v in ep["ao_states"].items()}
-            ep["name_to_receptacle"] = {
-                idx_to_name[k]: idx_to_name[v] for k, v in ep["name_to_receptacle"]
-            }
-
-            new_markers = []
-            for name, mtype, offset, link, obj in ep["markers"]:
-                new_markers.append(
-                    {
-                        "name": idx_to_name[name],
-                        "type": idx_to_name[mtype],
-                        "params": {
-                            "offset": offset,
-                            "link": idx_to_name[link],
-                            "object": idx_to_name[obj],
-                        },
-                    }
-                )
-            ep["markers"] = new_markers
-
-            rearrangement_episode = LangRearrangeEpisode(**ep)
+            rearrangement_episode = LangRearrangeEpisode(
+                **decode_binary_episode(ep, all_T, idx_to_name)
+            )
             rearrangement_episode.episode_id = str(i)
             self.episodes.append(rearrangement_episode)
 
@@ -210,25 +399,41 @@ class CustomEpisodeIterator(EpisodeIterator):
             random.seed(seed)
             np.random.seed(seed)
 
+        if not isinstance(episodes, (list, LazyEpisodeList)):
+            episodes = list(episodes)
+
         # sample episodes
         if num_episode_sample >= 0:
-            episodes = np.random.choice(  # type: ignore[assignment]
-                episodes, num_episode_sample, replace=False  # type: ignore[arg-type]
+            sampled = np.random.choice(
+                len(episodes), num_episode_sample, replace=False
             )
-
-        if not isinstance(episodes, list):
-            episodes = list(episodes)
+            if isinstance(episodes, LazyEpisodeList):
+                episodes = LazyEpisodeList(
+                    episodes.store, [episodes.indices[p] for p in sampled]
+                )
+            else:
+                episodes = [episodes[p] for p in sampled]
 
         self.episodes = episodes
         self.cycle = cycle
         self.group_by_scene = group_by_scene
         self.shuffle = shuffle
 
+        # The iterator works on positions into `episodes` so that shuffling,
+        # scene grouping and skipping never decode episodes of a lazy store.
+        positions = list(range(len(episodes)))
         if shuffle:
-            random.shuffle(self.episodes)
+            random.shuffle(positions)
+            # shuffle the episode list itself in place, as before
+            if isinstance(episodes, LazyEpisodeList):
+                episodes.indices[:] = [episodes.indices[p] for p in positions]
+            else:
+                episodes[:] = [episodes[p] for p in positions]
+            positions = list(range(len(episodes)))
 
         if group_by_scene:
-            self.episodes = self._group_scenes(self.episodes)
+            positions = self._group_scenes(positions)
+        self.positions = positions
 
         self.max_scene_repetition_episodes = max_scene_repeat_episodes
         self.max_scene_repetition_steps = max_scene_repeat_steps
@@ -237,7 +442,7 @@ class CustomEpisodeIterator(EpisodeIterator):
         self._step_count = 0
         self._prev_scene_id: Optional[str] = None
 
-        self._iterator = iter(self.episodes)
+        self._iterator = iter(self.positions)
 
         self.step_repetition_range = step_repetition_range
         self._set_shuffle_intervals()
@@ -246,32 +451,43 @@ class CustomEpisodeIterator(EpisodeIterator):
         return self
 
     def __next__(self):
+        return self.episodes[self._next_position()]
+
+    def skip(self, num_episodes: int) -> None:
+        """Advances the iterator as if `num_episodes` episodes were returned, without loading them."""
+        for _ in range(num_episodes):
+            self._next_position()
+
+    def _scene_id(self, position: int) -> str:
+        if isinstance(self.episodes, LazyEpisodeList):
+            return self.episodes.scene_id(position)
+        return self.episodes[position].scene_id
+
+    def _next_position(self) -> int:
         self._forced_scene_switch_if()
-        next_episode = next(self._iterator, None)
-        if next_episode is None:
+        next_position = next(self._iterator, None)
+        if next_position is None:
             if not self.cycle:
                 raise StopIteration
 
-            self._iterator = iter(self.episodes)
+            self._iterator = iter(self.positions)
 
             if self.shuffle:
                 self._shuffle()
 
-            next_episode = next(self._iterator)
+            next_position = next(self._iterator)
 
-        if (
-            self._prev_scene_id != next_episode.scene_id
-            and self._prev_scene_id is not None
-        ):
+        scene_id = self._scene_id(next_position)
+        if self._prev_scene_id != scene_id and self._prev_scene_id is not None:
             self._rep_count = 0
             self._step_count = 0
 
-        self._prev_scene_id = next_episode.scene_id
-        return next_episode
+        self._prev_scene_id = scene_id
+        return next_position
 
     def _forced_scene_switch(self) -> None:
         grouped_episodes = [
-            list(g) for k, g in groupby(self._iterator, key=lambda x: x.scene_id)
+            list(g) for k, g in groupby(self._iterator, key=self._scene_id)
         ]
 
         if len(grouped_episodes) > 1:
@@ -282,24 +498,24 @@ class CustomEpisodeIterator(EpisodeIterator):
 
     def _shuffle(self) -> None:
         assert self.shuffle
-        episodes = list(self._iterator)
+        positions = list(self._iterator)
 
-        random.shuffle(episodes)
+        random.shuffle(positions)
 
         if self.group_by_scene:
-            episodes = self._group_scenes(episodes)
+            positions = self._group_scenes(positions)
 
-        self._iterator = iter(episodes)
+        self._iterator = iter(positions)
 
-    def _group_scenes(self, episodes):
+    def _group_scenes(self, positions):
         assert self.group_by_scene
 
         scene_sort_keys: Dict[str, int] = {}
-        for e in episodes:
-            if e.scene_id not in scene_sort_keys:
-                scene_sort_keys[e.scene_id] = len(scene_sort_keys)
+        for p in positions:
+            if self._scene_id(p) not in scene_sort_keys:
+                scene_sort_keys[self._scene_id(p)] = len(scene_sort_keys)
 
-        return sorted(episodes, key=lambda e: scene_sort_keys[e.scene_id])
+        return sorted(positions, key=lambda p: scene_sort_keys[self._scene_id(p)])
 
     def step_taken(self) -> None:
         self._step_count += 1
@@ -110,6 +110,16 @@ class LangRearrangeEpisodeGenerator(RearrangeEpisodeGenerator):
 
         self._iter_eps = iter_eps
 
+    def set_iter_eps(self, iter_eps, proc_idx):
+        """
+        Continues with another split of episodes, keeping the simulator. The
+        scene is fixed by `proc_idx`, so splits with the same scene slot reuse
+        the loaded scene.
+        """
+        self._iter_eps = iter_eps
+        self._proc_idx = proc_idx
+        self._cur_ep_idx = 0
+
     def generate_scene(self) -> str:
         """
         Gets the scene ID for the current episode. Is fixed by the process ID.
@@ -0,0 +1,272 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2024 Apple Inc. All Rights Reserved.
+#
+import os
+import os.path as osp
+import pickle
+import shutil
+import sqlite3
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+JOBS_DB = "jobs.db"
+POLL_INTERVAL = 5.0
+
+
+class EpisodeJobQueue:
+    """
+    Batches of episodes to generate or validate, shared by the worker processes
+    through SQLite. Every job belongs to a scene and workers claim the pending
+    jobs of the scene they already have loaded before moving on to another
+    scene, so habitat-sim reloads scenes as rarely as possible.
+
+    The input of every job still to run (e.g. its episodes) is pickled once to
+    `<ckpt_dir>/inputs/<job>.pickle` and loaded by the worker that claims it, so
+    worker processes are not started with the inputs of all jobs.
+    The output of every finished job is pickled to `<ckpt_dir>/<job>.pickle`.
+    The checkpoints are the source of truth: a restarted run only queues the
+    jobs without one, and the final dataset is merged from them.
+    """
+
+    def __init__(self, ckpt_dir: str):
+        os.makedirs(ckpt_dir, exist_ok=True)
+        self.ckpt_dir = ckpt_dir
+        self.conn = sqlite3.connect(
+            osp.join(ckpt_dir, JOBS_DB), timeout=60, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                name TEXT PRIMARY KEY, scene TEXT,
+                status TEXT DEFAULT 'pending',  -- pending, running, done, failed
+                worker INTEGER, attempts INTEGER DEFAULT 0,
+                started REAL, finished REAL, error TEXT)
+            """
+        )
+
+    @staticmethod
+    def clear(ckpt_dir: str) -> None:
+        """
+        Removes the checkpoints and job table of a previous run.
+        """
+        if osp.isdir(ckpt_dir):
+            shutil.rmtree(ckpt_dir)
+
+    def ckpt_path(self, name: str) -> str:
+        return osp.join(self.ckpt_dir, f"{name}.pickle")
+
+    def input_path(self, name: str) -> str:
+        return osp.join(self.ckpt_dir, "inputs", f"{name}.pickle")
+
+    def add_jobs(
+        self, job_scenes: List[Tuple[str, str]], job_inputs: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Replaces the job table with `job_scenes` (job name, scene) in order. Jobs
+        that already have a checkpoint are marked as done. The `job_inputs` of the
+        other jobs are written for `load_input`. Returns the number of jobs left
+        to run.
+        """
+        if job_inputs is not None:
+            os.makedirs(osp.join(self.ckpt_dir, "inputs"), exist_ok=True)
+            for name, _ in job_scenes:
+                if osp.exists(self.ckpt_path(name)):
+                    continue
+                path = self.input_path(name)
+                with open(path + ".tmp", "wb") as f:
+                    pickle.dump(job_inputs[name], f)
+                os.replace(path + ".tmp", path)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("DELETE FROM jobs")
+            for name, scene in job_scenes:
+                status = "done" if osp.exists(self.ckpt_path(name)) else "pending"
+                self.conn.execute(
+                    "INSERT INTO jobs (name, scene, status) VALUES (?, ?, ?)",
+                    (name, scene, status),
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return self.counts().get("pending", 0)
+
+    def claim(self, worker: int, scene: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """
+        Marks the oldest pending job of `scene` as running on `worker`, or else
+        the oldest pending job of a scene no other worker is on, or else the
+        oldest pending job. Returns (job name, scene) or None when the queue is
+        drained.
+        """
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same job.
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT name, scene FROM jobs WHERE status = 'pending' "
+                "ORDER BY scene = ? DESC, "
+                "scene IN (SELECT scene FROM jobs WHERE status = 'running') ASC, rowid LIMIT 1",
+                (scene,),
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started = ?, "
+                    "attempts = attempts + 1 WHERE name = ?",
+                    (worker, time.time(), row[0]),
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], row[1])
+
+    def load_input(self, name: str) -> Any:
+        with open(self.input_path(name), "rb") as f:
+            return pickle.load(f)
+
+    def finish(self, name: str, result: Any) -> None:
+        """
+        Checkpoints the output of a job and marks it as done.
+        """
+        path = self.ckpt_path(name)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(result, f)
+        os.replace(path + ".tmp", path)
+        self.conn.execute(
+            "UPDATE jobs SET status = 'done', finished = ?, error = NULL WHERE name = ?",
+            (time.time(), name),
+        )
+
+    def fail(self, name: str, error: str, max_attempts: int) -> None:
+        """
+        Puts a job back in the queue, or fails it after `max_attempts` attempts.
+        """
+        self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, finished = ?, error = ? WHERE name = ?",
+            (max_attempts, time.time(), error, name),
+        )
+
+    def running_job(self, worker: int) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT name FROM jobs WHERE status = 'running' AND worker = ?", (worker,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def counts(self) -> Dict[str, int]:
+        return dict(
+            self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        )
+
+    def unfinished_jobs(self) -> List[str]:
+        return [
+            name
+            for (name,) in self.conn.execute(
+                "SELECT name FROM jobs WHERE status IN ('pending', 'running') ORDER BY rowid"
+            ).fetchall()
+        ]
+
+    def failed_jobs(self) -> Dict[str, str]:
+        return dict(
+            self.conn.execute("SELECT name, error FROM jobs WHERE status = 'failed'").fetchall()
+        )
+
+    def load_results(self) -> List[Any]:
+        """
+        Concatenates the checkpointed outputs of the finished jobs in job order.
+        """
+        results = []
+        for (name,) in self.conn.execute(
+            "SELECT name FROM jobs WHERE status = 'done' ORDER BY rowid"
+        ).fetchall():
+            with open(self.ckpt_path(name), "rb") as f:
+                results.extend(pickle.load(f))
+        return results
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def run_jobs(
+    queue: EpisodeJobQueue,
+    worker_idx: int,
+    run_job: Callable[[str], Any],
+    max_attempts: int,
+    on_error: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    Worker loop: claims jobs, preferring the scene of the previous job, until the
+    queue is drained. A job that raises is put back in the queue (up to
+    `max_attempts` attempts) and `on_error` is called so the worker can drop a
+    simulator that may be in a bad state.
+    """
+    scene = None
+    while True:
+        job = queue.claim(worker_idx, scene)
+        if job is None:
+            break
+        name, scene = job
+        print(f"Worker {worker_idx} running job {name} ({scene})")
+        try:
+            result = run_job(name)
+        except Exception:
+            error = traceback.format_exc()
+            print(f"Worker {worker_idx} failed job {name}:\n{error}")
+            queue.fail(name, error, max_attempts)
+            scene = None
+            if on_error is not None:
+                on_error()
+            continue
+        queue.finish(name, result)
+
+
+def supervise_workers(
+    queue: EpisodeJobQueue,
+    start_worker: Callable[[int], Any],
+    n_workers: int,
+    max_attempts: int,
+) -> List[str]:
+    """
+    Starts `n_workers` workers with `start_worker(worker_idx)` (which returns a
+    started Process or Thread) and waits until all of them have exited. A worker
+    that dies while jobs are left (e.g. on a habitat-sim crash) has its job put
+    back in the queue and is restarted, up to `max_attempts` times per worker.
+    Returns the jobs left unfinished once all workers are gone; they are not
+    part of `load_results()` and run again when the run is resumed.
+    """
+    workers = {i: start_worker(i) for i in range(n_workers)}
+    restarts = {i: 0 for i in range(n_workers)}
+    last_counts = None
+    while len(workers) > 0:
+        time.sleep(POLL_INTERVAL)
+        for i, proc in list(workers.items()):
+            if proc.is_alive():
+                continue
+            proc.join()
+            del workers[i]
+            name = queue.running_job(i)
+            if name is not None:
+                exitcode = getattr(proc, "exitcode", None)
+                print(f"Worker {i} exited with code {exitcode} while running job {name}")
+                queue.fail(name, f"worker exited with code {exitcode}", max_attempts)
+            if queue.counts().get("pending", 0) > 0:
+                if restarts[i] < max_attempts:
+                    restarts[i] += 1
+                    print(f"Restarting worker {i} ({restarts[i]}/{max_attempts})")
+                    workers[i] = start_worker(i)
+                else:
+                    print(f"Worker {i} was restarted {max_attempts} times, not restarting it")
+        counts = queue.counts()
+        if counts != last_counts:
+            print(f"Jobs: {counts}")
+            last_counts = counts
+
+    unfinished = queue.unfinished_jobs()
+    if len(unfinished) > 0:
+        print(
+            f"WARNING: {len(unfinished)} jobs were not run and are missing from the "
+            f"merged output, resume the run to finish them: {unfinished}"
+        )
+    return unfinished
@@ -93,7 +93,7 @@ class TaskProgressMonitor(Measure):
             if self._achieved[i]:
                 continue
             self._achieved[i] = all(
-                pred.is_true(task.pddl.sim_info) for pred in subgoal
+                task.pred_cache.is_true(pred) for pred in subgoal
             )
 
         self._metric = sum(self._achieved.values()) / max(self._total_count, 1)
@@ -544,15 +544,17 @@ class PddlGoalDistanceMeasure(Measure):
 
         for i, expr in enumerate(task.goal_expr.sub_exprs):
             if isinstance(expr, Predicate):
-                dist = self._get_pred_distance(expr, task.pddl.sim_info)
+                dist = task.pred_cache.get_value(
+                    "distance", expr, self._get_pred_distance
+                )
             else:
                 assert expr.expr_type == LogicalExprType.OR
                 dist = None
                 for sub_expr in expr.sub_exprs:
                     assert len(sub_expr.sub_exprs) == 1
                     assert isinstance(sub_expr.sub_exprs[0], Predicate)
-                    pred_dist = self._get_pred_distance(
-                        sub_expr.sub_exprs[0], task.pddl.sim_info
+                    pred_dist = task.pred_cache.get_value(
+                        "distance", sub_expr.sub_exprs[0], self._get_pred_distance
                     )
                     if dist is None:
                         dist = pred_dist
@@ -583,7 +585,7 @@ class PddlGoalBreakdownMeasure(Measure):
 
         for i, expr in enumerate(task.goal_expr.sub_exprs):
             expr_name = _extract_pred_name(expr, i)
-            self._metric[expr_name] = expr.is_true(task.pddl.sim_info)
+            self._metric[expr_name] = task.pred_cache.is_expr_true(expr)
 
 
 @registry.register_measure
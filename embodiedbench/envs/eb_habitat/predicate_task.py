@@ -3,6 +3,7 @@
 # Copyright (C) 2024 Apple Inc. All Rights Reserved.
 #
 import inspect
+import os
 import os.path as osp
 import random
 import time
@@ -28,7 +29,7 @@ import embodiedbench.envs.eb_habitat.config
 from embodiedbench.envs.eb_habitat.dataset.episodes import LangRearrangeEpisode
 from embodiedbench.envs.eb_habitat.dataset.utils import get_category_info
 from embodiedbench.envs.eb_habitat.actions import KinematicArmEEAction
-from embodiedbench.envs.eb_habitat.utils import PLACABLE_RECEP_TYPE, get_pddl 
+from embodiedbench.envs.eb_habitat.utils import PLACABLE_RECEP_TYPE, PredicateStepCache, get_pddl 
 
 
 @registry.register_task(name="RearrangePredicateTask-v0")
@@ -41,6 +42,10 @@ class RearrangePredicateTask(RearrangeTask):
         )
 
         self.pddl = get_pddl(config, self._all_cls, obj_cats)
+        # predicate results shared by all measures and sensors within a step
+        self.pred_cache = PredicateStepCache(
+            enabled=os.environ.get("pred_cache", "1") == "1"
+        )
         self._fix_agent_pos = config.fix_agent_pos
 
         super().__init__(
@@ -216,7 +221,7 @@ class RearrangePredicateTask(RearrangeTask):
             return False
         if self._goal_expr is None:
             return False
-        ret = self.pddl.is_expr_true(self._goal_expr)
+        ret = self.pred_cache.is_expr_true(self._goal_expr)
         return ret
 
     @add_perf_timing_func()
@@ -239,6 +244,7 @@ class RearrangePredicateTask(RearrangeTask):
     @add_perf_timing_func()
     def step(self, *args, action, **kwargs):
         self.pddl.sim_info.reset_pred_truth_cache()
+        self.pred_cache.invalidate(self.pddl.sim_info)
         fix_top_down_cam_pos(self._sim)
         self.num_steps += 1
         if "action_args" not in action:
@@ -279,6 +285,7 @@ class RearrangePredicateTask(RearrangeTask):
         fix_top_down_cam_pos(self._sim)
 
         self._sim.maybe_update_articulated_agent()
+        self.pred_cache.invalidate(self.pddl.sim_info)
         return self._get_observations(episode)
 
     def get_sampled(self) -> List[PddlEntity]:
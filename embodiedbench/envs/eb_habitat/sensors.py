@@ -294,9 +294,9 @@ class ObsLangSensor(Sensor):
 
     def get_observation(self, *args, **kwargs):
         # Fetch the predicates that are true in the current simulator step.
-        sim_info = self._task.pddl_problem.sim_info
+        pred_cache = self._task.pred_cache
         true_preds: List[Predicate] = [
-            p for p in self.predicates_list if p.is_true(sim_info)
+            p for p in self.predicates_list if pred_cache.is_true(p)
         ]
 
         # Conver the predicates to a string representation.
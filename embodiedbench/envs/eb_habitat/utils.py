@@ -11,7 +11,8 @@ import yaml
 from habitat.tasks.rearrange.multi_task.pddl_action import PddlAction
 from habitat.tasks.rearrange.multi_task.pddl_domain import PddlDomain
 from habitat.tasks.rearrange.multi_task.pddl_logical_expr import (
-    LogicalExpr, LogicalQuantifierType)
+    LogicalExpr, LogicalExprType, LogicalQuantifierType)
+from habitat.tasks.rearrange.multi_task.pddl_predicate import Predicate
 from habitat.tasks.rearrange.multi_task.rearrange_pddl import (
     ExprType, PddlEntity, SimulatorObjectType)
 from transformers import (AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer,
@@ -25,6 +26,84 @@ import embodiedbench.envs.eb_habitat.dataset
 PLACABLE_RECEP_TYPE = "place_receptacle"
 
 
+class PredicateStepCache:
+    """
+    Memoizes predicate truth values, logical expression results and predicate
+    distances for one version of the simulator state. The task bumps the
+    version whenever the simulator state changes (every step and reset), so
+    each ground predicate is evaluated at most once per step no matter how
+    many measures and sensors query it.
+    """
+
+    def __init__(self, sim_info=None, enabled=True):
+        self.sim_info = sim_info
+        self.enabled = enabled
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._truth: Dict[str, bool] = {}
+        self._expr_truth: Dict[int, bool] = {}
+        self._values: Dict[Tuple[str, str], float] = {}
+
+    def invalidate(self, sim_info=None):
+        if sim_info is not None:
+            self.sim_info = sim_info
+        self.version += 1
+        self._truth.clear()
+        self._expr_truth.clear()
+        self._values.clear()
+
+    def is_true(self, pred: Predicate) -> bool:
+        if not self.enabled:
+            return pred.is_true(self.sim_info)
+        key = repr(pred)
+        if key in self._truth:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._truth[key] = pred.is_true(self.sim_info)
+        return self._truth[key]
+
+    def is_expr_true(self, expr) -> bool:
+        """
+        Evaluates a quantifier-free expression, routing every ground predicate
+        through the cache.
+        """
+        if isinstance(expr, Predicate):
+            return self.is_true(expr)
+        if not self.enabled:
+            return expr.is_true(self.sim_info)
+        key = id(expr)
+        if key in self._expr_truth:
+            return self._expr_truth[key]
+
+        sub_truths = (self.is_expr_true(sub_expr) for sub_expr in expr.sub_exprs)
+        if expr.expr_type in (LogicalExprType.AND, LogicalExprType.NAND):
+            ret = all(sub_truths)
+        elif expr.expr_type in (LogicalExprType.OR, LogicalExprType.NOR):
+            ret = any(sub_truths)
+        else:
+            raise ValueError(f"Unsupported expression type {expr.expr_type}")
+        if expr.expr_type in (LogicalExprType.NAND, LogicalExprType.NOR):
+            ret = not ret
+        self._expr_truth[key] = ret
+        return ret
+
+    def get_value(self, name: str, pred: Predicate, compute_fn):
+        """
+        Memoizes a per-predicate quantity such as the distance to satisfying it.
+        """
+        if not self.enabled:
+            return compute_fn(pred, self.sim_info)
+        key = (name, repr(pred))
+        if key not in self._values:
+            self._values[key] = compute_fn(pred, self.sim_info)
+        return self._values[key]
+
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
 def draw_text(img, text, position):
     draw = ImageDraw.Draw(img)
     font = ImageFont.load_default()
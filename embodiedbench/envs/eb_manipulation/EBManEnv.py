@@ -11,11 +11,13 @@ from amsolver.action_modes import ArmActionMode, ActionMode
 from amsolver.observation_config import ObservationConfig
 from amsolver.task_environment import TTMS_FOLDER   
 import numpy as np
-from amsolver.backend.utils import task_file_to_task_class
+from amsolver.backend.utils import TASK_REGISTRY
 from pathlib import Path
 from amsolver.utils import name_to_task_class
+from amsolver.dataset_catalog import load_catalog
 from embodiedbench.envs.eb_manipulation.eb_man_utils import get_continous_action_from_discrete
 import os
+import json
 import time
 from PIL import Image
 from embodiedbench.main import logger
@@ -48,7 +50,8 @@ class EBManEnv(gym.Env):
         assert eval_set in ValidEvalSets
         self.task_class = None
         self.task_files = EVAL_SETS[eval_set]
-        eval_tasks = [task_file_to_task_class(t, parent_folder = 'vlm') for t in self.task_files]
+        # import every task class of the eval set once, episodes then reuse the cached classes
+        eval_tasks = TASK_REGISTRY.warm(self.task_files, parent_folder='vlm')
         data_folder = Path(os.path.join(TTMS_FOLDER, f'data/{eval_set}/eval'))
         self.dataset = self._load_dataset(eval_tasks, data_folder, self.task_files)
         if len(selected_indexes) > 0:
@@ -92,22 +95,15 @@ class EBManEnv(gym.Env):
             self.log_path = log_path
     
     def load_test_config(self, data_folder, task_name):
+        # episodes are resolved from the dataset catalog (built once) instead of walking data_folder per task
+        catalog = load_catalog(data_folder)
+        if catalog is None:
+            return []
         episode_list = []
-        for path in data_folder.rglob('configs*'):
-            t_name = path.parents[3].name
-            if t_name == task_name:
-                episode_list.append(path.parent)
-
-        def extract_variation_episode(path):
-            import re
-            match = re.search(r'variation(\d+)/episodes/episode(\d+)', str(path))
-            if match:
-                variation = int(match.group(1))
-                episode = int(match.group(2))
-                return (variation, episode)
-            return (float('inf'), float('inf'))
-
-        episode_list = sorted(episode_list, key=extract_variation_episode)
+        for variation, episode, episode_path in catalog.episodes(task_name):
+            record = catalog.get(task_name, variation, episode, validate=False)
+            if any(name.startswith('configs') for name in record['files']):
+                episode_list.append(Path(episode_path))
         return episode_list
     
     def _load_dataset(self, eval_tasks, data_folder, task_files):
@@ -154,7 +150,7 @@ class EBManEnv(gym.Env):
         self._current_step = 0
         self._current_episode_num += 1
         self._reset = True
-        self._episode_log = []
+        self.episode_log = []
         self._episode_start_time = time.time()
         self.task = self.env.get_task(self.dataset[self._current_episode_num - 1][0])
         self.current_task_variation = self.dataset[self._current_episode_num - 1][-1]
@@ -169,6 +165,8 @@ class EBManEnv(gym.Env):
         info = {}
         self._current_step += 1
         action_success = False
+        success_checks = self.task.success_checks
+        action_start_time = time.time()
         try:
             action = get_continous_action_from_discrete(discrete_action)
             obs, reward, terminate = self.task.step(action)
@@ -203,6 +201,9 @@ class EBManEnv(gym.Env):
         info['episode_elapsed_seconds'] = time.time() - self._episode_start_time
         info['episode_num'] = self._current_episode_num
         info['action'] = discrete_action
+        # wall-clock time of the discrete action and number of success evaluations it took (see SUCCESS_CHECK_MODE)
+        info['action_seconds'] = time.time() - action_start_time
+        info['success_checks'] = self.task.success_checks - success_checks
         if action_success == True:
             info['action_success'] = 1.0
         else:
@@ -219,6 +220,16 @@ class EBManEnv(gym.Env):
 
     def close(self) -> None:
         self.env.shutdown()
+
+    def save_episode_log(self):
+        if not os.path.exists(self.log_path):
+            os.makedirs(self.log_path)
+        filename = 'episode_{}_step_{}.json'.format(self._current_episode_num, self._current_step)
+        if len(self.episode_log):
+            with open(os.path.join(self.log_path, filename), 'w', encoding='utf-8') as f:
+                for item in self.episode_log:
+                    json.dump(item, f, ensure_ascii=False, default=lambda x: x.tolist() if hasattr(x, 'tolist') else str(x))
+                    f.write('\n')
     
     def save_image(self, key=['front_rgb']) -> str:
         log_path = self.log_path + '/images/' + f"episode_{self._current_episode_num}"
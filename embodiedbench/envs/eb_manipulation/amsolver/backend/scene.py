@@ -36,6 +36,10 @@ class Scene(object):
         self._obs_config = obs_config
         self._active_task = None
         self._initial_task_state = None
+        # (content digest, state right after import) of the episode task base / waypoint models in the
+        # scene, used by TaskEnvironment.load_config to skip re-importing identical models
+        self._resident_base = None
+        self._resident_waypoints = None
         self._start_arm_joint_pos = robot.arm.get_joint_positions()
         self._starting_gripper_joint_pos = robot.gripper.get_joint_positions()
         self._workspace = Shape('workspace')
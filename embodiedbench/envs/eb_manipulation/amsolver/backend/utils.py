@@ -194,14 +194,60 @@ def image_to_float_array(image, scale_factor=None):
   return scaled_array
 
 
+class TaskRegistry(object):
+  """
+  Process-wide cache of task classes, keyed by (parent folder, task file).
+
+  Task modules are imported once; they are only re-executed when `reload` is set (the
+  `task_reload=1` environment variable, meant for task development) and the file changed
+  since it was last imported.
+  """
+
+  def __init__(self, reload=False):
+    self.reload = reload
+    self._classes = {}
+    self._task_files = {}
+
+  def discover(self, parent_folder='amsolver'):
+    """Names of all task files in <parent_folder>/tasks, listed once per folder."""
+    if parent_folder not in self._task_files:
+      import importlib
+      tasks_path = os.path.dirname(importlib.import_module(parent_folder + '.tasks').__file__)
+      self._task_files[parent_folder] = sorted(
+        t.replace('.py', '') for t in os.listdir(tasks_path)
+        if t != '__init__.py' and t.endswith('.py'))
+    return self._task_files[parent_folder]
+
+  def get(self, task_file, parent_folder='amsolver'):
+    import importlib
+    name = task_file.replace('.py', '')
+    key = (parent_folder, name)
+    cached = self._classes.get(key)
+    if cached is not None and not self.reload:
+      return cached[1]
+    mod = importlib.import_module(parent_folder + ".tasks.%s" % name)
+    mtime = os.path.getmtime(mod.__file__)
+    if cached is not None:
+      if cached[0] == mtime:
+        return cached[1]
+      mod = importlib.reload(mod)
+    class_name = ''.join([w[0].upper() + w[1:] for w in name.split('_')])
+    task_class = getattr(mod, class_name)
+    self._classes[key] = (mtime, task_class)
+    return task_class
+
+  def warm(self, task_files, parent_folder='amsolver'):
+    """Import the given task classes up front (all tasks of the folder if `task_files` is None)."""
+    if task_files is None:
+      task_files = self.discover(parent_folder)
+    return [self.get(t, parent_folder) for t in task_files]
+
+
+TASK_REGISTRY = TaskRegistry(reload=os.environ.get('task_reload', '0') == '1')
+
+
 def task_file_to_task_class(task_file, parent_folder = 'amsolver'):
-  import importlib
-  name = task_file.replace('.py', '')
-  class_name = ''.join([w[0].upper() + w[1:] for w in name.split('_')])
-  mod = importlib.import_module(parent_folder+".tasks.%s" % name)
-  mod = importlib.reload(mod)
-  task_class = getattr(mod, class_name)
-  return task_class
+  return TASK_REGISTRY.get(task_file, parent_folder)
 
 
 def rgb_handles_to_mask(rgb_coded_handles):
@@ -0,0 +1,175 @@
+import os
+import re
+import json
+from os.path import join, exists
+
+from amsolver.backend.const import *
+
+CATALOG_FILE = 'catalog.json'
+CATALOG_VERSION = 1
+# folders of a variation that hold episodes
+EPISODE_GROUPS = (EPISODES_FOLDER, 'fail_cases')
+CAMERA_FOLDERS = (
+    LEFT_SHOULDER_RGB_FOLDER, LEFT_SHOULDER_DEPTH_FOLDER, LEFT_SHOULDER_MASK_FOLDER,
+    RIGHT_SHOULDER_RGB_FOLDER, RIGHT_SHOULDER_DEPTH_FOLDER, RIGHT_SHOULDER_MASK_FOLDER,
+    OVERHEAD_RGB_FOLDER, OVERHEAD_DEPTH_FOLDER, OVERHEAD_MASK_FOLDER,
+    WRIST_RGB_FOLDER, WRIST_DEPTH_FOLDER, WRIST_MASK_FOLDER,
+    FRONT_RGB_FOLDER, FRONT_DEPTH_FOLDER, FRONT_MASK_FOLDER)
+
+
+def _number(name):
+    match = re.search(r'(\d+)$', name)
+    return int(match.group(1)) if match else float('inf')
+
+
+def _scan_episode(episode_path):
+    """Files of one episode folder with (size, mtime), and the number of frames per camera folder."""
+    files, frames = {}, {}
+    with os.scandir(episode_path) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime]
+            elif entry.is_dir() and entry.name in CAMERA_FOLDERS:
+                frames[entry.name] = len(os.listdir(entry.path))
+    return {'files': files, 'frames': frames}
+
+
+def _list_dirs(path):
+    with os.scandir(path) as it:
+        return sorted((entry.name for entry in it if entry.is_dir()), key=_number)
+
+
+class DatasetCatalog(object):
+    """
+    Index of a manipulation dataset root (<root>/<task>/variation<v>/episodes/episode<e>/...), built
+    with a single walk and stored in <root>/catalog.json. Episodes are then resolved by direct lookup
+    instead of globbing / listing the (possibly network mounted) dataset on every start.
+
+    Staleness is detected from the mtimes of the task, variation and episode-group folders (which
+    change when episodes are added or removed), and per episode from the size/mtime of its files.
+    """
+
+    def __init__(self, dataset_root, data=None):
+        self.dataset_root = str(dataset_root)
+        self.path = join(self.dataset_root, CATALOG_FILE)
+        self.data = data if data is not None else {'version': CATALOG_VERSION, 'dirs': {}, 'tasks': {}}
+
+    # ---------------- building / loading ----------------
+    def build(self):
+        dirs, tasks = {}, {}
+        for task in _list_dirs(self.dataset_root):
+            task_path = join(self.dataset_root, task)
+            dirs[task] = os.stat(task_path).st_mtime
+            variations = {}
+            for variation in _list_dirs(task_path):
+                if not variation.startswith('variation'):
+                    continue
+                variation_path = join(task_path, variation)
+                dirs[join(task, variation)] = os.stat(variation_path).st_mtime
+                groups = {}
+                for group in EPISODE_GROUPS:
+                    group_path = join(variation_path, group)
+                    if not exists(group_path):
+                        continue
+                    dirs[join(task, variation, group)] = os.stat(group_path).st_mtime
+                    groups[group] = {episode: _scan_episode(join(group_path, episode))
+                                     for episode in _list_dirs(group_path)}
+                variations[str(_number(variation))] = groups
+            tasks[task] = variations
+        self.data = {'version': CATALOG_VERSION, 'dirs': dirs, 'tasks': tasks}
+        return self
+
+    def save(self):
+        tmp_path = '%s.tmp%d' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    def is_stale(self):
+        if self.data.get('version') != CATALOG_VERSION:
+            return True
+        for rel_path, mtime in self.data['dirs'].items():
+            path = join(self.dataset_root, rel_path)
+            if not exists(path) or os.stat(path).st_mtime != mtime:
+                return True
+        # new task folders
+        return any(task not in self.data['tasks'] for task in _list_dirs(self.dataset_root))
+
+    # ---------------- lookups ----------------
+    def episode_path(self, task, variation, episode, group=EPISODES_FOLDER):
+        return join(self.dataset_root, task, VARIATIONS_FOLDER % int(variation), group, episode)
+
+    def episode_names(self, task, variation, group=EPISODES_FOLDER):
+        """Episode folder names of a variation, or None if the variation is not in the catalog."""
+        groups = self.data['tasks'].get(task, {}).get(str(variation))
+        if groups is None or group not in groups:
+            return None
+        return list(groups[group])
+
+    def episodes(self, task, group=EPISODES_FOLDER):
+        """(variation, episode name, episode path) of every episode of a task, sorted by variation and episode."""
+        episodes = []
+        for variation, groups in self.data['tasks'].get(task, {}).items():
+            for episode in groups.get(group, {}):
+                episodes.append((int(variation), episode, self.episode_path(task, variation, episode, group)))
+        return sorted(episodes, key=lambda x: (x[0], _number(x[1])))
+
+    def get(self, task, variation, episode, group=EPISODES_FOLDER, validate=True):
+        """
+        Catalog record of one episode ({'files': {name: [size, mtime]}, 'frames': {camera folder: count}}).
+        With `validate`, the recorded files are checked against the disk and the record is refreshed if
+        any of them changed.
+        """
+        groups = self.data['tasks'].get(task, {}).get(str(variation), {})
+        record = groups.get(group, {}).get(episode)
+        if record is None or not validate:
+            return record
+        episode_path = self.episode_path(task, variation, episode, group)
+        for name, (size, mtime) in record['files'].items():
+            file_path = join(episode_path, name)
+            if not exists(file_path) or os.stat(file_path).st_size != size or os.stat(file_path).st_mtime != mtime:
+                record = _scan_episode(episode_path)
+                groups[group][episode] = record
+                break
+        return record
+
+
+_CATALOGS = {}
+
+
+def load_catalog(dataset_root, rebuild_if_stale=True):
+    """
+    The catalog of a dataset root, loaded once per process. It is (re)built and written when missing or
+    stale; if the root is not writable the freshly built catalog is only kept in memory.
+    """
+    dataset_root = str(dataset_root)
+    if dataset_root in _CATALOGS:
+        return _CATALOGS[dataset_root]
+    if not exists(dataset_root):
+        return None
+    catalog = DatasetCatalog(dataset_root)
+    if exists(catalog.path):
+        with open(catalog.path, 'r') as f:
+            catalog.data = json.load(f)
+    if not exists(catalog.path) or (rebuild_if_stale and catalog.is_stale()):
+        catalog.build()
+        try:
+            catalog.save()
+        except OSError as e:
+            print("Could not write dataset catalog %s: %s" % (catalog.path, e))
+    _CATALOGS[dataset_root] = catalog
+    return catalog
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the episode catalog of a manipulation dataset root.')
+    parser.add_argument('dataset_roots', nargs='+', help='e.g. embodiedbench/envs/eb_manipulation/data/base/eval')
+    args = parser.parse_args()
+    for root in args.dataset_roots:
+        catalog = DatasetCatalog(root).build()
+        catalog.save()
+        num_episodes = sum(len(episodes) for variations in catalog.data['tasks'].values()
+                           for groups in variations.values() for episodes in groups.values())
+        print('Wrote %s (%d tasks, %d episodes)' % (catalog.path, len(catalog.data['tasks']), num_episodes))
@@ -1,5 +1,4 @@
 #Modified From the rlbench: https://github.com/stepjam/RLBench
-import importlib
 import pickle
 from os import listdir
 from os.path import join, exists
@@ -11,7 +10,8 @@ from natsort import natsorted
 from pyrep.objects import VisionSensor
 
 from amsolver.backend.const import *
-from amsolver.backend.utils import image_to_float_array, rgb_handles_to_mask
+from amsolver.backend.utils import image_to_float_array, rgb_handles_to_mask, TASK_REGISTRY
+from amsolver.dataset_catalog import load_catalog
 from amsolver.demo import Demo
 from amsolver.observation_config import ObservationConfig
 
@@ -24,14 +24,11 @@ def name_to_task_class(task_file: str, parent_folder = "vlm"):
     name = task_file.replace('.py', '')
     class_name = ''.join([w[0].upper() + w[1:] for w in name.split('_')])
     try:
-        mod = importlib.import_module(parent_folder+".tasks.%s" % name)
-        mod = importlib.reload(mod)
+        task_class = TASK_REGISTRY.get(name, parent_folder)
     except ModuleNotFoundError as e:
         raise InvalidTaskName(
             "The task file '%s' does not exist or cannot be compiled."
             % name) from e
-    try:
-        task_class = getattr(mod, class_name)
     except AttributeError as e:
         raise InvalidTaskName(
             "Cannot find the class name '%s' in the file '%s'."
@@ -52,14 +49,18 @@ def get_stored_demos(amount: int, image_paths: bool, dataset_root: str,
             task_name, task_root))
 
     # Sample an amount of examples for the variation of this task
+    examples_group = 'fail_cases' if fail_demos else EPISODES_FOLDER
     examples_path = join(
         task_root, VARIATIONS_FOLDER % variation_number,
-        EPISODES_FOLDER)
-    if fail_demos:
-        examples_path = join(
-        task_root, VARIATIONS_FOLDER % variation_number,
-        'fail_cases')
-    examples = listdir(examples_path)
+        examples_group)
+    # episode names and frame counts come from the dataset catalog, listdir is only the fallback
+    catalog = load_catalog(dataset_root)
+    examples = None
+    if catalog is not None:
+        examples = catalog.episode_names(task_name, variation_number, examples_group)
+    if examples is None:
+        catalog = None
+        examples = listdir(examples_path)
     if amount == -1:
         amount = len(examples)
     if amount > len(examples):
@@ -101,7 +102,17 @@ def get_stored_demos(amount: int, image_paths: bool, dataset_root: str,
 
         num_steps = len(obs)
 
-        if not (num_steps == len(listdir(l_sh_rgb_f)) == len(
+        record = None
+        if catalog is not None:
+            record = catalog.get(task_name, variation_number, str(example), examples_group)
+        if record is not None:
+            num_frames = [record['frames'].get(folder, 0) for folder in (
+                LEFT_SHOULDER_RGB_FOLDER, LEFT_SHOULDER_DEPTH_FOLDER, RIGHT_SHOULDER_RGB_FOLDER,
+                RIGHT_SHOULDER_DEPTH_FOLDER, OVERHEAD_RGB_FOLDER, OVERHEAD_DEPTH_FOLDER,
+                WRIST_RGB_FOLDER, WRIST_DEPTH_FOLDER, FRONT_RGB_FOLDER, FRONT_DEPTH_FOLDER)]
+            if any(n != num_steps for n in num_frames):
+                raise RuntimeError('Broken dataset assumption')
+        elif not (num_steps == len(listdir(l_sh_rgb_f)) == len(
                 listdir(l_sh_depth_f)) == len(listdir(r_sh_rgb_f)) == len(
                 listdir(r_sh_depth_f)) == len(listdir(oh_rgb_f)) == len(
                 listdir(oh_depth_f)) == len(listdir(wrist_rgb_f)) == len(
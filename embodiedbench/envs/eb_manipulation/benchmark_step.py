@@ -0,0 +1,83 @@
+"""
+Replays recorded EB-Manipulation episodes (the episode_*_step_*.json logs written by EBManEnv)
+under each success check mode of TaskEnvironment and reports the wall-clock time per discrete
+action, the number of success evaluations, and whether reward / termination match the
+reference mode ('every') step by step:
+
+    python -m embodiedbench.envs.eb_manipulation.benchmark_step --log_path running/eb_manipulation/<exp>/base
+    python -m embodiedbench.envs.eb_manipulation.benchmark_step --log_path ... --modes every stride --stride 20
+"""
+import os
+import re
+import glob
+import json
+import argparse
+import numpy as np
+import amsolver.task_environment as task_environment
+from embodiedbench.envs.eb_manipulation.EBManEnv import EBManEnv
+
+
+def load_recorded_actions(log_path):
+    """Map episode number -> list of executed discrete actions from the episode logs."""
+    episodes = {}
+    for filename in glob.glob(os.path.join(log_path, 'episode_*_step_*.json')):
+        episode_num = int(re.search(r'episode_(\d+)_step_', os.path.basename(filename)).group(1))
+        with open(filename, 'r', encoding='utf-8') as f:
+            episodes[episode_num] = [json.loads(line)['action'] for line in f if line.strip()]
+    return dict(sorted(episodes.items()))
+
+
+def replay(env, episodes):
+    """(reward, terminate) of every replayed step per episode, plus action times and success checks."""
+    outcomes, action_times, success_checks = {}, [], []
+    for episode_num, actions in episodes.items():
+        # episode numbers in the log file names are 1-based
+        env._current_episode_num = episode_num - 1
+        env.reset()
+        outcomes[episode_num] = []
+        for action in actions:
+            _, reward, terminate, info = env.step(action)
+            outcomes[episode_num].append((reward, terminate))
+            action_times.append(info['action_seconds'])
+            success_checks.append(info['success_checks'])
+            if terminate:
+                break
+    return outcomes, action_times, success_checks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log_path', type=str, required=True)
+    parser.add_argument('--eval_set', type=str, default='base')
+    parser.add_argument('--num_episodes', type=int, default=None)
+    parser.add_argument('--modes', nargs='+', default=['every', 'stride', 'events'])
+    parser.add_argument('--stride', type=int, default=task_environment.SUCCESS_CHECK_STRIDE)
+    args = parser.parse_args()
+
+    episodes = load_recorded_actions(args.log_path)
+    if args.num_episodes is not None:
+        episodes = dict(list(episodes.items())[:args.num_episodes])
+
+    env = EBManEnv(eval_set=args.eval_set, log_path=os.path.join(args.log_path, 'benchmark_step'))
+    task_environment.SUCCESS_CHECK_STRIDE = args.stride
+    reference = None
+    for mode in args.modes:
+        # read by every TaskEnvironment created on reset
+        task_environment.SUCCESS_CHECK_MODE = mode
+        outcomes, action_times, success_checks = replay(env, episodes)
+        print('mode: {}{}'.format(mode, ' (stride {})'.format(args.stride) if mode == 'stride' else ''))
+        print('  episodes: {}, actions: {}'.format(len(outcomes), len(action_times)))
+        print('  action time mean: {:.4f}s, median: {:.4f}s, p90: {:.4f}s'.format(
+            np.mean(action_times), np.median(action_times), np.percentile(action_times, 90)))
+        print('  success checks per action: {:.1f}'.format(np.mean(success_checks)))
+        if reference is None:
+            reference = outcomes
+            continue
+        mismatches = [episode_num for episode_num in outcomes if outcomes[episode_num] != reference.get(episode_num)]
+        print('  equivalent to {}: {} ({} mismatching episodes{})'.format(
+            args.modes[0], not mismatches, len(mismatches), ': {}'.format(mismatches) if mismatches else ''))
+    env.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -21,9 +21,12 @@ from amsolver.backend.exceptions import *
 from amsolver.observation_config import ObservationConfig, CameraConfig
 from amsolver.backend.robot import Robot
 from amsolver.utils import name_to_task_class
+from amsolver.backend.utils import TASK_REGISTRY
 from tools.task_validator import task_smoke, TaskValidationError
 
 CURRENT_DIR = dirname(abspath(__file__))
+# task files are edited while the builder runs, pick up changes on reload
+TASK_REGISTRY.reload = True
 
 
 def print_fail(message, end='\n'):
@@ -3,6 +3,7 @@ import random
 import numpy as np
 from ai2thor.controller import Controller
 from ai2thor.platform import CloudRendering
+from pose_db import PoseDB
 
 # Constants
 min_distance = 2.5  # Minimum distance between agent and target object
@@ -29,52 +30,8 @@ def load_scene_object_mapping(filepath):
     with open(filepath, 'r') as f:
         return json.load(f)
 
-def get_object_ids_by_type(metadata, object_type):
-    objects = []
-    for obj in metadata["objects"]:
-        if obj["objectType"] == object_type:
-            objects.append(obj["objectId"])
-    return objects
-
-def calculate_distance(pos1, pos2):
-    return np.sqrt((pos1['x'] - pos2['x'])**2 + (pos1['z'] - pos2['z'])**2)
-
-def get_valid_pose(controller, target_object_id):
-
-    event = controller.step(
-        action="GetInteractablePoses",
-        objectId=target_object_id,
-        horizons=[0]
-        # rotations=DEFAULT_ROTATIONS,
-        # standings=[True]
-    )
-
-    print(len(event.metadata["actionReturn"]))
-    
-    # Get object position
-    obj_metadata = next(obj for obj in controller.last_event.metadata["objects"] 
-                       if obj["objectId"] == target_object_id)
-    obj_position = {
-        'x': obj_metadata['position']['x'],
-        'z': obj_metadata['position']['z']
-    }
-    
-    valid_poses = []
-    poses = event.metadata["actionReturn"]
-    random.shuffle(poses)
-    for pose in poses:
-        pos = {'x': pose['x'], 'z': pose['z']}
-        if calculate_distance(pos, obj_position) >= min_distance and calculate_distance(pos, obj_position) <= max_distance:
-            return pose
-            # valid_poses.append(pose)
-    
-    return None
-    #random.choice(valid_poses) if valid_poses else None
-
-def generate_dataset(mapping_filepath, output_filepath):
-    """Generate the complete navigation dataset."""
-    # Initialize controller
-    controller = Controller(
+def make_controller():
+    return Controller(
         agentMode="default",
         visibilityDistance=5,
         scene="FloorPlan1",
@@ -86,16 +43,27 @@ def generate_dataset(mapping_filepath, output_filepath):
         fieldOfView = 90,
         platform = CloudRendering
     )
+
+def get_valid_pose(scene_db, target_object_id):
+    # interactable poses (horizon 0) at the required distance from the target
+    poses = scene_db.poses_in_range(target_object_id, min_distance, max_distance)
+    print(len(poses))
+    return random.choice(poses) if poses else None
+
+def generate_dataset(mapping_filepath, output_filepath):
+    """Generate the complete navigation dataset."""
+    # Object metadata and interactable poses come from the pose database; the controller
+    # is only started for scenes (or target objects) that are not in it yet.
+    pose_db = PoseDB(make_controller)
     
     scene_mapping = load_scene_object_mapping(mapping_filepath)
     tasks = []
     
     for scene, target_type in scene_mapping.items():
-        # Initialize scene
-        controller.reset(scene=scene)
+        scene_db = pose_db.scene(scene)
         
         # Get all objects of target type
-        target_objects = get_object_ids_by_type(controller.last_event.metadata, target_type)
+        target_objects = scene_db.object_ids_by_type(target_type)
         
         if not target_objects:
             print(f"Warning: No {target_type} found in {scene}")
@@ -103,11 +71,7 @@ def generate_dataset(mapping_filepath, output_filepath):
             
         # Select first target object
         target_object_id = target_objects[0]
-
-        for obj in controller.last_event.metadata["objects"]:
-            if obj["objectId"] == target_object_id:
-                target_position = obj["position"]
-                break
+        target_position = scene_db.object_position(target_object_id)
         
         # Get other objects to hide (all objects of same type except the target)
         objects_to_hide = target_objects[1:] if len(target_objects) > 1 else []
@@ -115,7 +79,8 @@ def generate_dataset(mapping_filepath, output_filepath):
         # print(target_object_id)
         
         # Get valid initial pose
-        pose = get_valid_pose(controller, target_object_id)
+        pose_db.ensure_poses(scene, [target_object_id])
+        pose = get_valid_pose(scene_db, target_object_id)
         if not pose:
             print(f"Warning: Could not find valid pose in {scene}")
             continue
@@ -141,6 +106,9 @@ def generate_dataset(mapping_filepath, output_filepath):
         
         tasks.append(task)
     
+    pose_db.close()
+    print(f"Queried interactable poses for {pose_db.num_queries} objects")
+
     # Save dataset
     dataset = {"tasks": tasks}
     with open(output_filepath, 'w') as f:
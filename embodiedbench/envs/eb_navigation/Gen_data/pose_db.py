@@ -0,0 +1,130 @@
+import os
+import numpy as np
+
+# Per-scene cache of object metadata and GetInteractablePoses results, saved as
+# <POSE_DB_DIR>/<scene>.npz so that regenerating the datasets does not have to
+# start the simulator again for scenes that were already queried.
+POSE_DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pose_db")
+POSE_HORIZONS = [0]
+POSE_FIELDS = ["x", "y", "z", "rotation", "horizon", "standing"]
+
+
+class ScenePoseDB:
+    """Object positions and interactable agent poses of one scene, keyed by objectId."""
+
+    def __init__(self, scene, object_ids, object_types, object_positions, pose_object_idx=None, poses=None, queried=None):
+        self.scene = scene
+        self.object_ids = list(object_ids)
+        self.object_types = list(object_types)
+        self.object_positions = np.asarray(object_positions, dtype=np.float64).reshape(-1, 3)
+        self.object_index = {object_id: i for i, object_id in enumerate(self.object_ids)}
+        # all poses of the scene in one array, pose_object_idx[i] is the object pose i belongs to
+        self.pose_object_idx = np.zeros(0, dtype=np.int64) if pose_object_idx is None else np.asarray(pose_object_idx, dtype=np.int64)
+        self.poses = np.zeros((0, len(POSE_FIELDS))) if poses is None else np.asarray(poses, dtype=np.float64).reshape(-1, len(POSE_FIELDS))
+        # objects whose poses were queried (an object may have no interactable pose at all)
+        self.queried = set() if queried is None else set(int(i) for i in queried)
+        self.dirty = False
+
+    @classmethod
+    def from_metadata(cls, scene, metadata):
+        objects = metadata["objects"]
+        return cls(
+            scene,
+            [obj["objectId"] for obj in objects],
+            [obj["objectType"] for obj in objects],
+            [[obj["position"]["x"], obj["position"]["y"], obj["position"]["z"]] for obj in objects],
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(str(data["scene"]), data["object_ids"].tolist(), data["object_types"].tolist(),
+                   data["object_positions"], data["pose_object_idx"], data["poses"], data["queried"])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, scene=self.scene, object_ids=np.array(self.object_ids), object_types=np.array(self.object_types),
+                 object_positions=self.object_positions, pose_object_idx=self.pose_object_idx, poses=self.poses,
+                 queried=np.array(sorted(self.queried), dtype=np.int64))
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    def object_ids_by_type(self, object_type):
+        return [object_id for object_id, t in zip(self.object_ids, self.object_types) if t == object_type]
+
+    def object_position(self, object_id):
+        x, y, z = self.object_positions[self.object_index[object_id]].tolist()
+        return {"x": x, "y": y, "z": z}
+
+    def has_poses(self, object_id):
+        return self.object_index[object_id] in self.queried
+
+    def add_poses(self, object_id, poses):
+        idx = self.object_index[object_id]
+        rows = np.array([[float(pose[k]) for k in POSE_FIELDS] for pose in poses], dtype=np.float64).reshape(-1, len(POSE_FIELDS))
+        self.pose_object_idx = np.concatenate([self.pose_object_idx, np.full(len(rows), idx, dtype=np.int64)])
+        self.poses = np.concatenate([self.poses, rows])
+        self.queried.add(idx)
+        self.dirty = True
+
+    def poses_in_range(self, object_id, min_distance, max_distance):
+        """Interactable poses whose horizontal distance to the object is within [min_distance, max_distance]."""
+        idx = self.object_index[object_id]
+        poses = self.poses[self.pose_object_idx == idx]
+        dist = np.hypot(poses[:, 0] - self.object_positions[idx, 0], poses[:, 2] - self.object_positions[idx, 2])
+        in_range = poses[(dist >= min_distance) & (dist <= max_distance)]
+        return [dict(zip(POSE_FIELDS[:-1], row[:-1].tolist()), standing=bool(row[-1])) for row in in_range]
+
+
+class PoseDB:
+    """
+    Pose databases of all scenes. A scene is loaded from disk when it was queried
+    before, otherwise the simulator is started (make_controller is only called then)
+    and the scene is reset once to read its object metadata. Missing interactable
+    poses are queried for all requested objects of a scene in one pass.
+    """
+
+    def __init__(self, make_controller, root=POSE_DB_DIR):
+        self.make_controller = make_controller
+        self.root = root
+        self.controller = None
+        self.scenes = {}
+        self.num_queries = 0
+
+    def _path(self, scene):
+        return os.path.join(self.root, scene + ".npz")
+
+    def _reset(self, scene):
+        if self.controller is None:
+            self.controller = self.make_controller()
+        if self.controller.last_event.metadata["sceneName"] != scene:
+            self.controller.reset(scene=scene)
+        return self.controller.last_event
+
+    def scene(self, scene):
+        if scene not in self.scenes:
+            if os.path.isfile(self._path(scene)):
+                self.scenes[scene] = ScenePoseDB.load(self._path(scene))
+            else:
+                self.scenes[scene] = ScenePoseDB.from_metadata(scene, self._reset(scene).metadata)
+                self.scenes[scene].save(self._path(scene))
+        return self.scenes[scene]
+
+    def ensure_poses(self, scene, object_ids):
+        db = self.scene(scene)
+        missing = [object_id for object_id in object_ids if not db.has_poses(object_id)]
+        if missing:
+            self._reset(scene)
+            for object_id in missing:
+                event = self.controller.step(action="GetInteractablePoses", objectId=object_id, horizons=POSE_HORIZONS)
+                db.add_poses(object_id, event.metadata["actionReturn"] or [])
+                self.num_queries += 1
+        if db.dirty:
+            db.save(self._path(scene))
+        return db
+
+    def close(self):
+        if self.controller is not None:
+            self.controller.stop()
+            self.controller = None
@@ -4,6 +4,7 @@ import os
 import random
 import json
 import glob
+import gzip
 from PIL import Image
 from concurrent.futures import ThreadPoolExecutor
 import time
@@ -22,8 +23,18 @@ except ImportError as e:
     obj_interaction_actions = []
     all_agent_actions = []
 
+# object state that is captured in snapshots: field -> (action setting it true, action setting it false)
+SNAPSHOT_STATE_ACTIONS = {
+    'isOpen': ('OpenObject', 'CloseObject'),
+    'isToggled': ('ToggleObjectOn', 'ToggleObjectOff'),
+    'isDirty': ('DirtyObject', 'CleanObject'),
+    'isFilledWithLiquid': ('FillObjectWithLiquid', 'EmptyLiquidFromObject'),
+    'isCooked': ('CookObject', None),
+    'isUsedUp': ('UseUpObject', None),
+}
+
 class EBTeachEnv(gym.Env):
-    def __init__(self, data_dir=None, split='valid_seen', resolution=300):
+    def __init__(self, data_dir=None, split='valid_seen', resolution=300, use_snapshots=True):
         self.resolution = resolution
         self.split = split
         # Default data dir relative to this file or specific path
@@ -52,6 +63,9 @@ class EBTeachEnv(gym.Env):
         
         # Load EDH instances
         self.edh_instance_files = self._get_edh_files()
+        # post-history THOR states written by build_snapshots.py, restored instead of replaying the history
+        self.use_snapshots = use_snapshots
+        self.snapshot_dir = os.path.join(self.data_dir, "snapshots", self.split)
         
         # Action space: Discrete index mapping to all_agent_actions
         self.actions = all_agent_actions
@@ -104,31 +118,22 @@ class EBTeachEnv(gym.Env):
             
             instance = load_json(instance_file)
             self.current_instance = instance
-            
-            game_file = os.path.join(
-                self.data_dir, "games", self.split, f"{instance['game_id']}.game.json"
-            )
-            
-            # Helper from EdhInferenceRunner to calculate state diff task
-            check_task = EdhInferenceRunner._get_check_task(instance, self.config)
 
-            # Replay history
-            success, self.er = EdhInferenceRunner._initialize_episode_replay(
-                instance, game_file, check_task, 
-                replay_timeout=500, er=self.er
-            )
+            success = False
+            snapshot = self.load_snapshot(instance_file) if self.use_snapshots else None
+            if snapshot is not None:
+                success = self._restore_snapshot(instance, snapshot)
+                if not success:
+                    print(f"Snapshot restore failed for {os.path.basename(instance_file)}, falling back to replay.")
+            if not success:
+                success = self._replay_history(instance)
             
             if success:
                 # Load history images (optional, but good for context if we were a real agent)
                 # EdhInferenceRunner._maybe_load_history_images(instance, self.config)
                 
                 # Get initial observation
-                images = self.er.simulator.get_latest_images()
-                obs = {}
-                if "ego" in images:
-                    obs['head_rgb'] = images["ego"]
-                else:
-                    obs['head_rgb'] = np.zeros((self.resolution, self.resolution, 3), dtype=np.uint8)
+                obs = self._get_obs()
                 
                 # Get instruction
                 # EDH instance has "dialog_history": [{"speaker": "Driver", "text": "..."}]
@@ -145,6 +150,149 @@ class EBTeachEnv(gym.Env):
         print("Failed to reset after retries.")
         return {'head_rgb': np.zeros((self.resolution, self.resolution, 3), dtype=np.uint8)}
 
+    def _get_obs(self):
+        images = self.er.simulator.get_latest_images()
+        obs = {}
+        if "ego" in images:
+            obs['head_rgb'] = images["ego"]
+        else:
+            obs['head_rgb'] = np.zeros((self.resolution, self.resolution, 3), dtype=np.uint8)
+        return obs
+
+    def _replay_history(self, instance, pred_start_idx=None):
+        """
+        Set up the game of an EDH instance and replay its driver actions up to `pred_start_idx`
+        (defaults to the instance's own, i.e. the full history).
+        """
+        if pred_start_idx is not None:
+            instance = dict(instance, pred_start_idx=pred_start_idx)
+        game_file = os.path.join(
+            self.data_dir, "games", self.split, f"{instance['game_id']}.game.json"
+        )
+        
+        # Helper from EdhInferenceRunner to calculate state diff task
+        check_task = EdhInferenceRunner._get_check_task(instance, self.config)
+
+        # Replay history
+        success, self.er = EdhInferenceRunner._initialize_episode_replay(
+            instance, game_file, check_task, 
+            replay_timeout=500, er=self.er
+        )
+        return success
+
+    # ---------------- post-history state snapshots ----------------
+    def snapshot_path(self, instance_file):
+        name = os.path.splitext(os.path.basename(instance_file))[0]
+        return os.path.join(self.snapshot_dir, name + '.json.gz')
+
+    def load_snapshot(self, instance_file):
+        path = self.snapshot_path(instance_file)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_snapshot(self, instance_file, snapshot):
+        if not os.path.exists(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+        with gzip.open(self.snapshot_path(instance_file), 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+
+    def _task_progress(self):
+        _, success, _, gc_total, gc_satisfied = self.er.simulator.check_episode_progress(self.er.simulator.current_task)
+        return [bool(success), gc_total, gc_satisfied]
+
+    def capture_snapshot(self):
+        """
+        Compact description of the current THOR state: scene, agent poses and inventories, and the
+        pose and state flags of every object, together with the task progress it implies.
+        """
+        last_event = self.er.simulator.controller.last_event
+        agents = []
+        for event in getattr(last_event, 'events', [last_event]):
+            agent = event.metadata['agent']
+            agents.append({
+                'position': agent['position'],
+                'rotation': agent['rotation'],
+                'horizon': agent['cameraHorizon'],
+                'standing': agent.get('isStanding', True),
+                'inventory': [o['objectId'] for o in event.metadata.get('inventoryObjects', [])],
+            })
+        objects = []
+        for obj in last_event.metadata['objects']:
+            record = {
+                'objectId': obj['objectId'],
+                'name': obj['name'],
+                'position': obj['position'],
+                'rotation': obj['rotation'],
+                'movable': obj['pickupable'] or obj['moveable'],
+            }
+            for field in SNAPSHOT_STATE_ACTIONS:
+                record[field] = obj.get(field, False)
+            if obj.get('isFilledWithLiquid'):
+                record['fillLiquid'] = obj.get('fillLiquid') or 'water'
+            objects.append(record)
+        return {
+            'scene': last_event.metadata['sceneName'],
+            'agents': agents,
+            'objects': objects,
+            'task_progress': self._task_progress(),
+        }
+
+    def _restore_snapshot(self, instance, snapshot):
+        """
+        Set up the instance without replaying its history, then bring THOR to the snapshotted state.
+        Returns False (so the caller falls back to a full replay) whenever the restored state cannot be
+        verified to match the snapshot, e.g. when the history sliced or broke objects.
+        """
+        try:
+            if not self._replay_history(instance, pred_start_idx=0):
+                return False
+            controller = self.er.simulator.controller
+            last_event = controller.last_event
+            if last_event.metadata['sceneName'] != snapshot['scene']:
+                return False
+            current = {obj['objectId']: obj for obj in last_event.metadata['objects']}
+            if set(current) != set(obj['objectId'] for obj in snapshot['objects']):
+                return False
+
+            # poses of all movable objects in one call
+            controller.step(
+                action='SetObjectPoses',
+                objectPoses=[
+                    {'objectName': obj['name'], 'position': obj['position'], 'rotation': obj['rotation']}
+                    for obj in snapshot['objects'] if obj['movable']
+                ],
+            )
+            # state flags, only for the objects whose state differs
+            for obj in snapshot['objects']:
+                for field, (set_action, unset_action) in SNAPSHOT_STATE_ACTIONS.items():
+                    if bool(current[obj['objectId']].get(field, False)) == bool(obj[field]):
+                        continue
+                    action = set_action if obj[field] else unset_action
+                    if action is None:
+                        return False
+                    kwargs = {'fillLiquid': obj['fillLiquid']} if action == 'FillObjectWithLiquid' else {}
+                    controller.step(action=action, objectId=obj['objectId'], forceAction=True, **kwargs)
+            for agent_id, agent in enumerate(snapshot['agents']):
+                controller.step(
+                    action='TeleportFull', agentId=agent_id,
+                    x=agent['position']['x'], y=agent['position']['y'], z=agent['position']['z'],
+                    rotation=agent['rotation'], horizon=agent['horizon'], standing=agent['standing'],
+                    forceAction=True,
+                )
+                for object_id in agent['inventory']:
+                    controller.step(action='PickupObject', agentId=agent_id, objectId=object_id, forceAction=True)
+
+            restored = {obj['objectId']: obj for obj in controller.last_event.metadata['objects']}
+            for obj in snapshot['objects']:
+                if any(bool(restored[obj['objectId']].get(field, False)) != bool(obj[field]) for field in SNAPSHOT_STATE_ACTIONS):
+                    return False
+            return self._task_progress() == snapshot['task_progress']
+        except Exception as e:
+            print(f"Error restoring snapshot: {e}")
+            return False
+
     def step(self, action_idx):
         if self.er is None:
             return self.reset(), 0, True, {}
@@ -173,12 +321,7 @@ class EBTeachEnv(gym.Env):
             done = False
         
         # Get Obs
-        images = self.er.simulator.get_latest_images()
-        obs = {}
-        if "ego" in images:
-            obs['head_rgb'] = images["ego"]
-        else:
-            obs['head_rgb'] = np.zeros((self.resolution, self.resolution, 3), dtype=np.uint8)
+        obs = self._get_obs()
 
         # Metrics calculation
         task_desc, success, subgoals, gc_total, gc_satisfied = self.er.simulator.check_episode_progress(self.er.simulator.current_task)
@@ -0,0 +1,43 @@
+"""
+One-time offline pass that replays the history of every EDH instance of a split and stores the
+resulting THOR state as a per-instance snapshot, which EBTeachEnv.reset restores instead of replaying.
+
+    python -m embodiedbench.envs.eb_teach.build_snapshots --split valid_seen
+"""
+import os
+import time
+import argparse
+from embodiedbench.envs.eb_teach.EBTeachEnv import EBTeachEnv, load_json
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str, default=None)
+    parser.add_argument('--split', type=str, default='valid_seen')
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    env = EBTeachEnv(data_dir=args.data_dir, split=args.split, use_snapshots=False)
+    env._init_episode_replay()
+    num_written, num_failed, start_time = 0, 0, time.time()
+    for i, instance_file in enumerate(env.edh_instance_files):
+        if not args.overwrite and os.path.exists(env.snapshot_path(instance_file)):
+            continue
+        instance = load_json(instance_file)
+        try:
+            success = env._replay_history(instance)
+        except Exception as e:
+            print(f"Error replaying {instance_file}: {e}")
+            success = False
+        if not success:
+            num_failed += 1
+            continue
+        env.save_snapshot(instance_file, env.capture_snapshot())
+        num_written += 1
+        print(f"[{i + 1}/{len(env.edh_instance_files)}] snapshot saved for {os.path.basename(instance_file)}")
+    env.close()
+    print(f"Wrote {num_written} snapshots to {env.snapshot_dir} ({num_failed} replays failed) in {time.time() - start_time:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Background video encoder shared by the environments and random_agent_logger.
+
+Frames are handed to a worker thread through a bounded queue and encoded incrementally, so
+recording memory stays flat regardless of episode length (a full queue blocks the producer
+instead of growing). Encodes H.264 (libx264, yuv420p) with imageio-ffmpeg when available and
+falls back to OpenCV's mp4v writer otherwise; neither needs a GPU encoder.
+"""
+import os
+import queue
+import threading
+import numpy as np
+from PIL import Image
+
+try:
+    import imageio
+except ImportError:
+    imageio = None
+
+_STOP = object()
+
+
+class BackgroundVideoWriter():
+    def __init__(self, path, fps=30, stride=1, scale=1.0, max_queue=32):
+        """
+        Args:
+            path: output .mp4 path, parent folders are created
+            fps: frame rate of the written video
+            stride: keep every `stride`-th appended frame (cheap previews)
+            scale: downscale factor applied to every kept frame (e.g. 0.5 for half resolution)
+            max_queue: maximum number of frames waiting to be encoded
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.fps = fps
+        self.stride = max(int(stride), 1)
+        self.scale = scale
+        self.num_appended = 0
+        self.num_written = 0
+        self.error = None
+        self._writer = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self._thread.start()
+
+    def append(self, frame):
+        """Queue an RGB frame (H x W x 3, uint8) for encoding; blocks while the queue is full."""
+        self.num_appended += 1
+        if (self.num_appended - 1) % self.stride != 0 or self.error is not None:
+            return
+        self._queue.put(np.asarray(frame))
+
+    def close(self):
+        """Encode the remaining frames and finalize the file. Returns the path, or None if nothing was written."""
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.error is not None:
+            print(f"Error encoding video {self.path}: {self.error}")
+        return self.path if self.num_written else None
+
+    def _resize(self, frame):
+        if frame.dtype != np.uint8:
+            frame = frame.astype(np.uint8)
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = frame[:, :, :3]
+        height, width = frame.shape[:2]
+        # yuv420p needs even dimensions
+        new_width = max(int(width * self.scale) // 2 * 2, 2)
+        new_height = max(int(height * self.scale) // 2 * 2, 2)
+        if (new_width, new_height) != (width, height):
+            frame = np.asarray(Image.fromarray(frame).resize((new_width, new_height), Image.BILINEAR))
+        return frame
+
+    def _open(self, frame):
+        height, width = frame.shape[:2]
+        if imageio is not None:
+            writer = imageio.get_writer(self.path, fps=self.fps, codec='libx264',
+                                        pixelformat='yuv420p', macro_block_size=2)
+            return writer.append_data, writer.close
+        import cv2
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height))
+        return (lambda data: writer.write(cv2.cvtColor(data, cv2.COLOR_RGB2BGR))), writer.release
+
+    def _encode_loop(self):
+        write, release = None, None
+        while True:
+            frame = self._queue.get()
+            if frame is _STOP:
+                break
+            if self.error is not None:
+                continue
+            try:
+                frame = self._resize(frame)
+                if write is None:
+                    write, release = self._open(frame)
+                write(frame)
+                self.num_written += 1
+            except Exception as e:
+                self.error = e
+        if release is not None:
+            release()
@@ -5,7 +5,8 @@ import time
 import json
 from embodiedbench.envs.eb_habitat.EBHabEnv import EBHabEnv, ValidEvalSets
 from embodiedbench.planner.vlm_planner import VLMPlanner
-from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.evaluator.summarize_result import summarize_store
+from embodiedbench.evaluator.result_store import ResultStore
 from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args
 from embodiedbench.evaluator.config.system_prompts import habitat_system_prompt
 from embodiedbench.main import logger
@@ -48,6 +49,7 @@ class EB_HabitatEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.result_store.append(filename.split('_res.json')[0], episode_info)
 
     def evaluate_main(self):
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
@@ -67,10 +69,13 @@ class EB_HabitatEvaluator():
             model_type = self.config.get('model_type', 'remote')
             self.planner = VLMPlanner(self.model_name, model_type, self.env.language_skill_set, self.system_prompt, examples, n_shot=self.config['n_shots'], obs_key='head_rgb',
                                                  chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
-                                                 use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1))
+                                                 use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1),
+                                                 stream=self.config.get('stream', False))
 
+            self.result_store = ResultStore(os.path.join(self.env.log_path, 'results'))
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), output_file='summary.json')
+            summarize_store(self.result_store, output_file='summary.json')
+            self.result_store.close()
             with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
 
@@ -9,6 +9,7 @@ from embodiedbench.evaluator.config.system_prompts import eb_manipulation_system
 from embodiedbench.envs.eb_manipulation.EBManEnv import EBManEnv, EVAL_SETS, ValidEvalSets
 from embodiedbench.envs.eb_manipulation.eb_man_utils import form_object_coord_for_input, draw_bounding_boxes, draw_xyz_coordinate
 from embodiedbench.planner.manip_planner import ManipPlanner
+from embodiedbench.evaluator.result_store import ResultStore
 from embodiedbench.evaluator.config.eb_manipulation_example import vlm_examples_baseline, llm_examples, vlm_examples_ablation
 from embodiedbench.main import logger
 
@@ -50,6 +51,7 @@ class EB_ManipulationEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.result_store.append(filename.split('_res.json')[0], episode_info)
     
     def save_planner_outputs(self, reasoning_list):
         filename = 'planner_output_episode_{}.txt'.format(self.env._current_episode_num)
@@ -61,26 +63,11 @@ class EB_ManipulationEvaluator():
                 f.write(s + "\n")
     
     def print_task_eval_results(self, filename):
-        folder_path = f"{self.log_path}/results"
-        total_number_of_task = 0
-        success_number_of_task = 0
-        planner_steps = 0
-        output_format_error = 0
-
-        for file_name in sorted(os.listdir(folder_path)):
-            if file_name.endswith(".json") and file_name.startswith("episode"):
-                file_path = os.path.join(folder_path, file_name)
-                
-                # Open and load the JSON file
-                with open(file_path, 'r', encoding='utf-8') as json_file:
-                    data = json.load(json_file)
-                    task_success = data["task_success"]
-                    if data["planner_output_error"] > 0:    
-                        output_format_error += 1
-                    if task_success == 1:
-                        success_number_of_task += 1
-                    planner_steps += data["planner_steps"]
-                    total_number_of_task += 1
+        # read the incrementally maintained aggregates instead of rescanning the results folder
+        total_number_of_task = self.result_store.num_episodes()
+        success_number_of_task = self.result_store.count_where("task_success", "=", 1)
+        planner_steps = self.result_store.totals().get("planner_steps", (0, 0))[0]
+        output_format_error = self.result_store.count_where("planner_output_error", ">", 0)
 
         task_log = {}
         task_log['save_path'] = self.log_path
@@ -176,6 +163,7 @@ class EB_ManipulationEvaluator():
             episode_info["episode_elapsed_seconds"] = info["episode_elapsed_seconds"]
             self.save_episode_metric(episode_info)
             self.save_planner_outputs(reasoning_list)
+            self.env.save_episode_log()
             progress_bar.update()
         self.print_task_eval_results(filename="summary.json")
         self.env.close()
@@ -220,7 +208,9 @@ class EB_ManipulationEvaluator():
                                         multistep=self.config["multistep"],
                                         visual_icl=self.config["visual_icl"],
                                         tp=self.config["tp"])
+            self.result_store = ResultStore(os.path.join(self.log_path, 'results'))
             self.evaluate()
+            self.result_store.close()
             with open(os.path.join(self.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
                 
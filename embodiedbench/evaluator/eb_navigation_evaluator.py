@@ -5,7 +5,8 @@ from tqdm import tqdm
 import json
 from embodiedbench.envs.eb_navigation.EBNavEnv import EBNavigationEnv, ValidEvalSets
 from embodiedbench.planner.nav_planner import EBNavigationPlanner
-from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.evaluator.summarize_result import summarize_store
+from embodiedbench.evaluator.result_store import ResultStore
 import sys
 import warnings
 
@@ -37,6 +38,7 @@ class EB_NavigationEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.result_store.append(filename.split('_res.json')[0], episode_info)
 
     def evaluate_main(self):
 
@@ -63,8 +65,10 @@ class EB_NavigationEvaluator():
                                            multiview=self.config['multiview'], multistep = self.config['multistep'], 
                                            visual_icl = self.config['visual_icl'], truncate=self.config.get('truncate', False))
             
+            self.result_store = ResultStore(os.path.join(self.env.log_path, 'results'))
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), selected_key = None)
+            summarize_store(self.result_store, output_file='summary_all.json', selected_key = None)
+            self.result_store.close()
             with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
 
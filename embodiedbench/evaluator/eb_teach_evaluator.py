@@ -5,7 +5,8 @@ import time
 import json
 from embodiedbench.envs.eb_teach.EBTeachEnv import EBTeachEnv
 from embodiedbench.planner.teach_planner import EBTeachPlanner
-from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.evaluator.summarize_result import summarize_store
+from embodiedbench.evaluator.result_store import ResultStore
 from embodiedbench.evaluator.evaluator_utils import update_config_with_args
 from embodiedbench.evaluator.config.system_prompts import eb_teach_system_prompt
 from embodiedbench.main import logger
@@ -28,6 +29,7 @@ class EB_TeachEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.result_store.append(filename.split('_res.json')[0], episode_info)
 
     def evaluate_main(self):
         # Setup logging path
@@ -57,8 +59,10 @@ class EB_TeachEvaluator():
             tp=self.config.get('tp', 1)
         )
 
+        self.result_store = ResultStore(os.path.join(self.result_path, 'results'))
         self.evaluate()
-        average_json_values(os.path.join(self.result_path, 'results'), output_file='summary.json')
+        summarize_store(self.result_store, output_file='summary.json')
+        self.result_store.close()
         with open(os.path.join(self.result_path, 'config.txt'), 'w') as f:
             f.write(str(self.config))
 
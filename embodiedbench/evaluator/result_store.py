@@ -0,0 +1,113 @@
+import os
+import json
+import glob
+import sqlite3
+
+STORE_NAME = 'results.sqlite'
+
+class ResultStore():
+    """
+    Append-only SQLite store of per-episode results for one evaluation run (one log path).
+
+    Every numeric metric of an episode is written as a row of `metrics`, and the running
+    sum/count per metric is kept up to date in `aggregates` on each write, so summaries
+    are read back in O(#metrics) without re-parsing the per-episode json files.
+    """
+    def __init__(self, res_path):
+        if not os.path.exists(res_path):
+            os.makedirs(res_path)
+        self.db_path = os.path.join(res_path, STORE_NAME)
+        self.conn = sqlite3.connect(self.db_path, timeout=60)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS episodes (episode TEXT PRIMARY KEY, data TEXT);
+            CREATE TABLE IF NOT EXISTS metrics (episode TEXT, key TEXT, value REAL, PRIMARY KEY (episode, key));
+            CREATE TABLE IF NOT EXISTS aggregates (key TEXT PRIMARY KEY, total REAL, count INTEGER);
+        ''')
+
+    @staticmethod
+    def numeric_metrics(episode_info):
+        # same rules as summarize_result.average_json_values: skip strings, unwrap single element lists
+        metrics = {}
+        for key, value in episode_info.items():
+            if isinstance(value, list) and len(value) == 1:
+                value = value[0]
+            if isinstance(value, (bool, int, float)):
+                metrics[key] = float(value)
+        return metrics
+
+    def append(self, episode, episode_info):
+        """Add (or replace, when an episode is re-evaluated) the results of one episode."""
+        episode = str(episode)
+        metrics = self.numeric_metrics(episode_info)
+        with self.conn:
+            # retract the previous values of a re-evaluated episode from the aggregates
+            old = self.conn.execute('SELECT key, value FROM metrics WHERE episode = ?', (episode,)).fetchall()
+            self.conn.executemany('UPDATE aggregates SET total = total - ?, count = count - 1 WHERE key = ?',
+                                  [(value, key) for key, value in old])
+            self.conn.execute('DELETE FROM metrics WHERE episode = ?', (episode,))
+            self.conn.execute('INSERT OR REPLACE INTO episodes VALUES (?, ?)',
+                              (episode, json.dumps(episode_info, ensure_ascii=False, default=str)))
+            self.conn.executemany('INSERT INTO metrics VALUES (?, ?, ?)',
+                                  [(episode, key, value) for key, value in metrics.items()])
+            self.conn.executemany('''INSERT INTO aggregates VALUES (?, ?, 1)
+                                     ON CONFLICT(key) DO UPDATE SET total = total + excluded.total, count = count + 1''',
+                                  list(metrics.items()))
+
+    def totals(self):
+        return {key: (total, count) for key, total, count in
+                self.conn.execute('SELECT key, total, count FROM aggregates WHERE count > 0')}
+
+    def averages(self):
+        return {key: total / count for key, (total, count) in self.totals().items()}
+
+    def episode_names(self):
+        return set(episode for (episode,) in self.conn.execute('SELECT episode FROM episodes'))
+
+    def num_episodes(self):
+        return self.conn.execute('SELECT COUNT(*) FROM episodes').fetchone()[0]
+
+    def count_where(self, key, op, value):
+        """Number of episodes whose metric `key` compares to `value` with `op` (one of <, <=, =, >=, >)."""
+        assert op in ('<', '<=', '=', '>=', '>')
+        return self.conn.execute(f'SELECT COUNT(*) FROM metrics WHERE key = ? AND value {op} ?', (key, value)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def find_stores(directory):
+    """All result stores under `directory`, one per evaluation run."""
+    return sorted(glob.glob(os.path.join(directory, '**', STORE_NAME), recursive=True))
+
+
+def merge_totals(db_paths, selected_key=None, values_sum=None, counts=None):
+    """Per-metric (sum, count) over the episodes of several runs, added to values_sum and counts if given."""
+    values_sum = {} if values_sum is None else values_sum
+    counts = {} if counts is None else counts
+    for db_path in db_paths:
+        store = ResultStore(os.path.dirname(db_path))
+        for key, (total, count) in store.totals().items():
+            if selected_key is not None and key != selected_key:
+                continue
+            values_sum[key] = values_sum.get(key, 0.0) + total
+            counts[key] = counts.get(key, 0) + count
+        store.close()
+    return values_sum, counts
+
+
+def merge_averages(db_paths, selected_key=None):
+    """Averages over the episodes of several runs, computed from the stored aggregates only."""
+    values_sum, counts = merge_totals(db_paths, selected_key)
+    return {key: values_sum[key] / counts[key] for key in values_sum}
+
+
+def compare_runs(directory, keys=('task_success', 'task_progress', 'num_steps', 'planner_steps', 'episode_elapsed_seconds')):
+    """Per-run averages of the given metrics for every run stored under `directory`."""
+    comparison = {}
+    for db_path in find_stores(directory):
+        store = ResultStore(os.path.dirname(db_path))
+        averages = store.averages()
+        run = os.path.relpath(os.path.dirname(os.path.dirname(db_path)), directory)
+        comparison[run] = {'num_episodes': store.num_episodes(), **{key: averages[key] for key in keys if key in averages}}
+        store.close()
+    return comparison
@@ -2,15 +2,18 @@ import os
 import json
 import glob
 import argparse
+from embodiedbench.evaluator.result_store import ResultStore, find_stores, merge_totals, compare_runs
 
-def average_json_values(json_dir, target_file='*.json', output_file='summary_all.json', selected_key=None):
-    values_sum = {}
-    counts = {}
+def find_json_files(json_dir, target_file='*.json'):
+    return glob.glob(os.path.join(json_dir, target_file)) + glob.glob(os.path.join(json_dir, '*', target_file)) + glob.glob(os.path.join(json_dir, '*', '*', target_file))
 
-    json_files = glob.glob(os.path.join(json_dir, target_file)) + glob.glob(os.path.join(json_dir, '*', target_file)) + glob.glob(os.path.join(json_dir, '*', '*', target_file))
-    print(json_files, len(json_files))
+
+def json_totals(json_files, selected_key=None, values_sum=None, counts=None):
+    """Per-metric (sum, count) over the episode json files, added to values_sum and counts if given."""
+    values_sum = {} if values_sum is None else values_sum
+    counts = {} if counts is None else counts
     for json_file in json_files:
-        print(json_file.split('running/')[1])
+        print(json_file.split('running/')[-1])
         with open(json_file, 'r') as f:
             data = json.load(f)
             print(data[selected_key] if selected_key!= None else data)
@@ -27,7 +30,13 @@ def average_json_values(json_dir, target_file='*.json', output_file='summary_all
                     counts[key] = 0
                 values_sum[key] += value
                 counts[key] += 1
-    
+    return values_sum, counts
+
+
+def average_json_values(json_dir, target_file='*.json', output_file='summary_all.json', selected_key=None):
+    json_files = find_json_files(json_dir, target_file)
+    print(json_files, len(json_files))
+    values_sum, counts = json_totals(json_files, selected_key)
     averages = {key: values_sum[key] / counts[key] for key in values_sum}
     print('final results: ' )
     print(averages)
@@ -35,12 +44,72 @@ def average_json_values(json_dir, target_file='*.json', output_file='summary_all
         json.dump(averages, f, indent=4)
 
 
+def unstored_json_files(store):
+    """Episode json files next to a ResultStore whose episode is not in it (written before the store existed)."""
+    episodes = store.episode_names()
+    return sorted(f for f in glob.glob(os.path.join(os.path.dirname(store.db_path), '*_res.json'))
+                  if os.path.basename(f)[:-len('_res.json')] not in episodes)
+
+
+def summarize_store(store, output_file='summary.json', selected_key=None):
+    """
+    Write the averages of a run from its ResultStore, plus the episode json files of the run that
+    are not in the store (e.g. of a resumed run started before the store existed).
+    """
+    values_sum, counts = {}, {}
+    for key, (total, count) in store.totals().items():
+        if selected_key is None or key == selected_key:
+            values_sum[key], counts[key] = total, count
+    json_files = unstored_json_files(store)
+    if len(json_files):
+        print(f'{len(json_files)} episode json files missing from the result store are merged as well')
+        json_totals(json_files, selected_key, values_sum, counts)
+    averages = {key: values_sum[key] / counts[key] for key in values_sum}
+    print('final results: ' )
+    print(averages)
+    with open(os.path.join(os.path.dirname(store.db_path), output_file), 'w') as f:
+        json.dump(averages, f, indent=4)
+    return averages
+
+
+def average_store_values(directory, output_file='summary_all.json', selected_key=None, target_file='*.json'):
+    """
+    Same output as average_json_values, merged from the result stores of all runs under `directory`
+    and from the episode json files written before the result store was introduced.
+    """
+    db_paths = find_stores(directory)
+    values_sum, counts = merge_totals(db_paths, selected_key)
+    store_dirs = set(os.path.dirname(db_path) for db_path in db_paths)
+    json_files = [f for f in find_json_files(directory, target_file) 
+                  if os.path.dirname(f) not in store_dirs and os.path.basename(f) != output_file]
+    for db_path in db_paths:
+        store = ResultStore(os.path.dirname(db_path))
+        json_files.extend(unstored_json_files(store))
+        store.close()
+    if len(json_files):
+        print(f'{len(json_files)} episode json files without a result store entry are merged as well')
+        json_totals(json_files, selected_key, values_sum, counts)
+    averages = {key: values_sum[key] / counts[key] for key in values_sum}
+    print('final results: ' )
+    print(averages)
+    with open(os.path.join(directory, output_file), 'w') as f:
+        json.dump(averages, f, indent=4)
+    return averages
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process JSON files to compute average values.')
     parser.add_argument('--directory', type=str, help='Path to the directory containing JSON files')
     parser.add_argument('--target_file', default='*.json', type=str, help='target file name')
     parser.add_argument('--output_file', default='summary_all.json', type=str, help='output file name')
+    parser.add_argument('--compare', action='store_true', help='print per-run averages of every run under the directory')
     args = parser.parse_args()
 
-    average_json_values(args.directory, args.target_file, args.output_file)
+    if args.compare:
+        for run, averages in compare_runs(args.directory).items():
+            print(run, json.dumps(averages))
+    elif len(find_stores(args.directory)):
+        average_store_values(args.directory, args.output_file, target_file=args.target_file)
+    else:
+        # runs from before the result store was introduced
+        average_json_values(args.directory, args.target_file, args.output_file)
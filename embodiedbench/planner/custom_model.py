@@ -2,27 +2,83 @@ import requests
 import torch
 import os
 import io
+import time
 import requests
+from embodiedbench.main import logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 temperature = 0
 max_completion_tokens = 2048
 server_url = os.environ.get('server_url')
+# 'msgpack': one binary msgpack body (prompt, image bytes, generation params) over a keep-alive session,
+# 'multipart': the previous form upload of a single image
+custom_transport = os.environ.get('custom_transport', 'msgpack' if msgpack is not None else 'multipart')
 
 class CustomModel():
-    def __init__(self, model_path, language_only):
+    def __init__(self, model_path, language_only, task_type=None):
         self.model_path = model_path
         self.language_only = language_only
         self.model_type = 'custom'
-        
-
-    def respond(self, prompt, obs=None):        
-        with open(obs, "rb") as img_file:
-            files = {"image": img_file}
-            data = {"sentence": prompt}
-            response = requests.post(server_url, files=files, data=data)
+        self.task_type = task_type # used to distinguish between manipulation and other environments
+        # schema name understood by server.py, used for json-constrained decoding
+        self.schema = ('llm' if language_only else 'vlm') + ('_manip' if task_type == 'manip' else '')
+        # whether the last response was generated under the json schema constraint
+        self.constrained = False
+        # keep-alive connection to the server, reused by every call
+        self.session = requests.Session()
+        self.transport = custom_transport
+        # request bytes, response bytes and round-trip seconds of the last call
+        self.last_call = {}
 
-        res= response.json()['response']
+    @staticmethod
+    def check_response(response):
+        # error replies of server.py carry an `error` field and no `response`
         if response.status_code != 200:
-            print("Error:", response.text)
-        return res
+            try:
+                error = response.json().get('error', response.text)
+            except ValueError:
+                error = response.text
+            raise RuntimeError(f'custom model server returned {response.status_code}: {error}')
+
+    def respond(self, prompt, obs=None):
+        # obs: image path, or a list of image paths
+        image_paths = [] if obs is None else [obs] if isinstance(obs, str) else list(obs)
+        start = time.time()
+        if self.transport == 'msgpack':
+            images = []
+            for image_path in image_paths:
+                with open(image_path, "rb") as img_file:
+                    images.append(img_file.read())
+            body = msgpack.packb({
+                "prompt": prompt,
+                "images": images,
+                "schema": self.schema,
+                "params": {"max_new_tokens": max_completion_tokens},
+            }, use_bin_type=True)
+            response = self.session.post(server_url, data=body, headers={
+                "Content-Type": "application/msgpack", "Accept": "application/msgpack"})
+            request_bytes = len(body)
+            self.check_response(response)
+            res = msgpack.unpackb(response.content, raw=False)
+        else:
+            with open(image_paths[0], "rb") as img_file:
+                files = {"image": img_file}
+                data = {"sentence": prompt, "schema": self.schema}
+                response = self.session.post(server_url, files=files, data=data)
+            request_bytes = len(response.request.body or b'')
+            self.check_response(response)
+            res = response.json()
 
+        self.last_call = {
+            'request_bytes': request_bytes,
+            'response_bytes': len(response.content),
+            'seconds': time.time() - start,
+        }
+        logger.info('custom model call ({}): {} request bytes, {} response bytes, {:.3f}s round trip'.format(
+            self.transport, self.last_call['request_bytes'], self.last_call['response_bytes'], self.last_call['seconds']))
+        self.constrained = res.get('constrained', False)
+        return res['response']
@@ -0,0 +1,272 @@
+import io
+import os
+import math
+import base64
+import struct
+import hashlib
+from mimetypes import guess_type
+from PIL import Image
+from embodiedbench.main import logger
+
+# per-step image token budget (all images of one planner request), 0 disables resizing
+image_token_budget = int(os.environ.get('image_token_budget', 0))
+# re-encode images as 'png' or 'jpeg' (jpeg quality from image_quality)
+image_format = os.environ.get('image_format', 'png')
+image_quality = int(os.environ.get('image_quality', 85))
+image_grayscale = os.environ.get('image_grayscale', '0') == '1'
+# fraction of the frame kept by a center crop before resizing
+image_crop = float(os.environ.get('image_crop', 1.0))
+# smallest side length the budget may shrink an image to
+image_min_side = int(os.environ.get('image_min_side', 64))
+# replace frames of multi-step / multi-view prompts that are byte-identical to an earlier one with a text back-reference
+frame_dedup = os.environ.get('frame_dedup', '1') == '1'
+# if > 0, also treat frames whose perceptual hashes differ in at most this many (of 256) bits as
+# near-identical. The hash can miss small objects, so this is off by default.
+frame_dedup_distance = int(os.environ.get('frame_dedup_distance', 0))
+
+
+def openai_image_tokens(width, height):
+    # high detail: fit in 2048x2048, shortest side scaled to 768, then 170 tokens per 512px tile + 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def claude_image_tokens(width, height):
+    # images are downscaled to a long side of 1568, then about width * height / 750 tokens
+    scale = min(1.0, 1568 / max(width, height))
+    return math.ceil(width * scale * height * scale / 750)
+
+
+def gemini_image_tokens(width, height):
+    # 258 tokens for images up to 384x384, otherwise 258 per 768x768 tile
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def qwen_vl_image_tokens(width, height):
+    # sides rounded to multiples of 28 (14px patches merged 2x2), one token per 28x28 block, plus start/end
+    return max(round(width / 28), 1) * max(round(height / 28), 1) + 2
+
+
+def internvl_image_tokens(width, height):
+    # dynamic tiling into (at most 6) 448x448 tiles of 256 tokens each, plus a thumbnail tile
+    tiles = min(math.ceil(width / 448) * math.ceil(height / 448), 6)
+    return 256 * (tiles + (1 if tiles > 1 else 0))
+
+
+def image_token_formula(model_name):
+    name = model_name.lower()
+    if 'gpt' in name or name.startswith(('o1', 'o3', 'o4')):
+        return openai_image_tokens
+    if 'gemini' in name:
+        return gemini_image_tokens
+    if 'qwen' in name:
+        return qwen_vl_image_tokens
+    if 'internvl' in name:
+        return internvl_image_tokens
+    # claude, and a pixel-area estimate for any other model
+    return claude_image_tokens
+
+
+def parse_data_url(data_url):
+    """(mime type, raw bytes) of a base64 data URL."""
+    header, data = data_url.split(',', 1)
+    return header[len('data:'):].split(';')[0], base64.b64decode(data)
+
+
+def png_data_url_size(data_url):
+    """(width, height) from the IHDR chunk of a png data URL, decoding only its first bytes, else None."""
+    prefix = 'data:image/png;base64,'
+    if not data_url.startswith(prefix):
+        return None
+    header = base64.b64decode(data_url[len(prefix):len(prefix) + 32])
+    if header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+
+def to_data_url(mime_type, data):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+class ImagePolicy():
+    """
+    Chooses the resolution (and optionally crop, jpeg quality and grayscale) of the images of
+    each planner request so that their estimated image tokens, following the provider's
+    token-per-tile formula of model_name, stay under a per-step budget. All images of a step
+    are scaled by the same factor. With no budget and the default format, images are sent
+    unchanged and only the estimated tokens are logged.
+    """
+
+    def __init__(self, model_name, budget=None, fmt=None, quality=None, grayscale=None, crop=None, min_side=None):
+        self.model_name = model_name
+        self.tokens = image_token_formula(model_name)
+        self.budget = image_token_budget if budget is None else budget
+        self.format = (image_format if fmt is None else fmt).lower().replace('jpg', 'jpeg')
+        self.quality = image_quality if quality is None else quality
+        self.grayscale = image_grayscale if grayscale is None else grayscale
+        self.crop = image_crop if crop is None else crop
+        self.min_side = image_min_side if min_side is None else min_side
+
+    def _reencode(self):
+        return self.format != 'png' or self.grayscale or self.crop < 1.0
+
+    def _crop_size(self, size):
+        return max(int(size[0] * self.crop), 1), max(int(size[1] * self.crop), 1)
+
+    def choose_scale(self, sizes):
+        """Largest scale (<= 1) of the (cropped) sizes whose total estimated tokens fit the budget."""
+        def total(scale):
+            return sum(self.tokens(max(round(w * scale), 1), max(round(h * scale), 1)) for w, h in sizes)
+
+        if not self.budget or total(1.0) <= self.budget:
+            return 1.0
+        # binary search over the longest side, tokens only grow with the image size
+        longest = max(max(size) for size in sizes)
+        lo, hi = min(self.min_side, longest), longest
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if total(mid / longest) <= self.budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        if total(lo / longest) > self.budget:
+            logger.warning(f'image policy: {len(sizes)} images exceed the budget of {self.budget} tokens even at {lo}px')
+        return lo / longest
+
+    def _log(self, sizes, tokens):
+        logger.info(f'image policy: {len(sizes)} images at {sizes[0][0]}x{sizes[0][1]}'
+                    f'{" (" + self.format + ")" if self._reencode() else ""}, ~{tokens} image tokens'
+                    f'{" of " + str(self.budget) if self.budget else ""} for {self.model_name}')
+
+    def fit(self, content, frame_cache=None):
+        """
+        Resize the image_url items of one message content (list of items) in place to fit the
+        budget, and log the chosen size and the estimated image tokens of the step. With no budget
+        and no re-encoding the images are left as they are, and the tokens are only estimated when
+        its size is known from frame_cache (an EpisodeFrameCache) or the png header for every image.
+        """
+        items = [item for item in content if item.get('type') == 'image_url']
+        if not items:
+            return 0
+        if not self.budget and not self._reencode():
+            urls = [item['image_url']['url'] for item in items]
+            sizes = [(frame_cache.sizes.get(url) if frame_cache is not None else None) or png_data_url_size(url) for url in urls]
+            if None in sizes:
+                return None
+            tokens = sum(self.tokens(w, h) for w, h in sizes)
+            self._log(sizes, tokens)
+            return tokens
+        decoded = [parse_data_url(item['image_url']['url']) for item in items]
+        images = [Image.open(io.BytesIO(data)) for mime_type, data in decoded]
+        sizes = [self._crop_size(image.size) for image in images]
+        scale = self.choose_scale(sizes)
+        new_sizes = [(max(round(w * scale), 1), max(round(h * scale), 1)) for w, h in sizes]
+
+        if scale < 1.0 or self._reencode():
+            for item, image, size in zip(items, images, new_sizes):
+                if self.crop < 1.0:
+                    w, h = image.size
+                    cw, ch = self._crop_size(image.size)
+                    image = image.crop(((w - cw) // 2, (h - ch) // 2, (w - cw) // 2 + cw, (h - ch) // 2 + ch))
+                if image.size != size:
+                    image = image.resize(size, Image.LANCZOS)
+                image = image.convert('L' if self.grayscale else 'RGB')
+                buffer = io.BytesIO()
+                if self.format == 'jpeg':
+                    image.save(buffer, format='JPEG', quality=self.quality)
+                else:
+                    image.save(buffer, format='PNG')
+                item['image_url']['url'] = to_data_url(f'image/{self.format}', buffer.getvalue())
+
+        tokens = sum(self.tokens(w, h) for w, h in new_sizes)
+        self._log(new_sizes, tokens)
+        return tokens
+
+
+
+def frame_hash(image, hash_size=16):
+    """Difference hash: signs of horizontal gradients of a hash_size x hash_size grayscale thumbnail."""
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return bits
+
+
+class EpisodeFrameCache():
+    """
+    Data URLs and digests of the frames sent during an episode, keyed by file (path, modification
+    time and size), so a frame re-sent by later steps is encoded once. image_items replaces a frame
+    whose bytes equal an earlier frame of the same message by a short text back-reference, and, when
+    max_distance > 0, one whose perceptual hash is within max_distance bits of an earlier frame by a
+    "near-identical" back-reference. The number of skipped frames is logged when the episode is reset.
+    """
+
+    def __init__(self, dedup=None, max_distance=None):
+        self.dedup = frame_dedup if dedup is None else dedup
+        self.max_distance = frame_dedup_distance if max_distance is None else max_distance
+        self.frames = {}
+        # (width, height) of every data URL in frames, read from the image header
+        self.sizes = {}
+        self.encoded = 0
+        self.reused = 0
+        self.skipped = 0
+
+    def reset(self):
+        if self.encoded or self.reused:
+            logger.info(f'frame cache: {self.encoded} frames encoded, {self.reused} reused, '
+                        f'{self.skipped} repeated frames replaced by a back-reference')
+        self.frames = {}
+        self.sizes = {}
+        self.encoded = self.reused = self.skipped = 0
+
+    def _frame(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key in self.frames:
+            self.reused += 1
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+            mime_type = guess_type(path)[0] or 'application/octet-stream'
+            digest = hashlib.sha1(data).digest()
+            # opening only parses the header, the pixels are decoded for the perceptual hash
+            image = Image.open(io.BytesIO(data))
+            phash = frame_hash(image) if self.dedup and self.max_distance > 0 else None
+            url = to_data_url(mime_type, data)
+            self.frames[key] = (url, digest, phash)
+            self.sizes[url] = image.size
+            self.encoded += 1
+        return self.frames[key]
+
+    def data_url(self, path):
+        return self._frame(path)[0]
+
+    def image_items(self, paths, labels):
+        """Message content items for the frames at paths, described by labels in back-references."""
+        items, sent = [], []
+        for path, label in zip(paths, labels):
+            url, digest, phash = self._frame(path)
+            match = near_match = None
+            if self.dedup:
+                match = next((sent_label for sent_digest, _, sent_label in sent if sent_digest == digest), None)
+                if match is None and self.max_distance > 0:
+                    near_match = next((sent_label for _, sent_hash, sent_label in sent
+                                       if bin(sent_hash ^ phash).count('1') <= self.max_distance), None)
+            if match is not None:
+                self.skipped += 1
+                items.append({"type": "text", "text": f"[{label}: unchanged from {match}, image omitted]"})
+            elif near_match is not None:
+                self.skipped += 1
+                items.append({"type": "text", "text": f"[{label}: near-identical to {near_match}, image omitted]"})
+            else:
+                sent.append((digest, phash, label))
+                items.append({"type": "image_url", "image_url": {"url": url}})
+        return items
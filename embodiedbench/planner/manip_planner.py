@@ -11,6 +11,7 @@ from mimetypes import guess_type
 from embodiedbench.envs.eb_manipulation.eb_man_utils import ROTATION_RESOLUTION, VOXEL_SIZE
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
+from embodiedbench.planner.image_policy import ImagePolicy
 from embodiedbench.planner.planner_utils import local_image_to_data_url, template_manip, template_lang_manip
 from embodiedbench.main import logger
 
@@ -32,7 +33,7 @@ class ManipPlanner():
         self.n_shot = n_shot
         self.chat_history = chat_history # whether to include all the chat history for prompting
         if model_type == 'custom':
-            self.model = CustomModel(model_name, language_only)
+            self.model = CustomModel(model_name, language_only, task_type='manip')
         else:
             self.model = RemoteModel(model_name, model_type, language_only, tp=tp, task_type='manip')
 
@@ -43,6 +44,7 @@ class ManipPlanner():
         self.multi_view = multiview
         self.multi_step_image = multistep
         self.visual_icl = visual_icl
+        self.image_policy = ImagePolicy(model_name)
     
     def process_prompt(self, user_instruction, avg_obj_coord, task_variation, prev_act_feedback=[]):
         user_instruction = user_instruction.rstrip('.')
@@ -214,6 +216,7 @@ class ManipPlanner():
                         }
                     )
         
+            self.image_policy.fit(current_message[0]["content"])
             return current_message
     
     def get_message_visual_icl(self, images, first_prompt, task_prompt, task_variation, messages=[]):
@@ -275,6 +278,7 @@ class ManipPlanner():
                     }
                 }
             )
+        self.image_policy.fit(current_message[0]["content"])
         return current_message
     
     def json_to_action(self, output_text):
@@ -357,9 +361,10 @@ class ManipPlanner():
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        out = out.replace("'",'"')
-        out = out.replace('\"s ', "\'s ")
-        out = out.replace('```json', '').replace('```', '')
+        if not self.model.constrained:
+            out = out.replace("'",'"')
+            out = out.replace('\"s ', "\'s ")
+            out = out.replace('```json', '').replace('```', '')
         logger.debug(f"Model Output:\n{out}\n")
         action, _ = self.json_to_action(out)
         self.planner_steps += 1
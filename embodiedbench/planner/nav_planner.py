@@ -12,6 +12,7 @@ from embodiedbench.planner.planner_utils import local_image_to_data_url, truncat
 # from embodiedbench.planner.eb_navigation.RemoteModel_claude import RemoteModel
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
+from embodiedbench.planner.image_policy import ImagePolicy, EpisodeFrameCache
 from embodiedbench.evaluator.config.visual_icl_examples.eb_navigation.ebnav_visual_icl import create_example_json_list
 from embodiedbench.planner.planner_utils import template, template_lang
 from embodiedbench.main import logger
@@ -36,6 +37,8 @@ class EBNavigationPlanner():
 
         self.kwargs = kwargs
         self.action_key = kwargs.pop('action_key', 'action_id')
+        self.image_policy = ImagePolicy(model_name)
+        self.frame_cache = EpisodeFrameCache()
 
         self.multiview = multiview
         self.multistep = multistep
@@ -145,35 +148,15 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
                     {"type": "text", "text": prompt}],
             }
         elif self.multiview:
-            data_url1 = local_image_to_data_url(image_path=image[0])
-            data_url2 = local_image_to_data_url(image_path=image[1])
+            # frames are encoded once per episode, unchanged frames are replaced by a back-reference
+            content = self.frame_cache.image_items(image[:2], ['view 1', 'view 2'])
+            content.append({"type": "text", "text": prompt})
             current_message = {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": data_url1,
-                        }
-                    }, 
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": data_url2,
-                        }
-                    },
-                    {"type": "text", "text": prompt}],
+                "content": content,
             }
         elif self.multistep:
-            content = []
-            for img_path in image:
-                data_url = local_image_to_data_url(image_path=img_path)
-                content.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": data_url,
-                            }
-                        }) 
+            content = self.frame_cache.image_items(image, [f'image {i + 1}' for i in range(len(image))])
             content.append({"type": "text", "text": prompt})
             current_message = {
                 "role":"user",
@@ -210,6 +193,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
                     {"type": "text", "text": prompt}],
             }
 
+        self.image_policy.fit(current_message["content"], self.frame_cache)
         messages = messages + [current_message]
 
         return messages[-MESSAGE_WINDOW_LEN:]
@@ -221,6 +205,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
         self.episode_act_feedback = []
         self.planner_steps = 0
         self.output_json_error = 0
+        self.frame_cache.reset()
 
     def language_to_action(self, output_text):
         pattern = r'\*\*\d+\*\*'
@@ -258,9 +243,10 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        out = out.replace("'",'"')
-        out = out.replace('\"s ', "\'s ")
-        out = out.replace('```json', '').replace('```', '')
+        if not self.model.constrained:
+            out = out.replace("'",'"')
+            out = out.replace('\"s ', "\'s ")
+            out = out.replace('```json', '').replace('```', '')
         logger.debug(f"Model Output:\n{out}\n")
         self.planner_steps += 1
         action, valid = self.json_to_action(out)
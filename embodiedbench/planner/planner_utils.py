@@ -1,5 +1,6 @@
 import os
 import re
+import json
 import base64
 import copy
 from mimetypes import guess_type
@@ -85,6 +86,81 @@ def fix_json(json_str):
     return fixed_json
 
 
+class IncrementalPlanParser:
+    """
+    Incrementally scans a streamed JSON response and detects when the value of `json_key`
+    (the executable plan) has been completely generated.
+
+    Only string/escape state and nesting depth are tracked, so each character is visited once
+    no matter how the text is split into chunks.
+    """
+    def __init__(self, json_key='executable_plan'):
+        self.json_key = json_key
+        self.text = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None   # last complete string at the top level of the object
+        self.current_key = None   # key whose value is being generated
+        self.plan_start = None
+        self.plan_end = None      # index right after the plan value
+
+    @property
+    def plan_complete(self):
+        return self.plan_end is not None
+
+    def feed(self, chunk):
+        """Append a chunk of generated text. Returns True once the plan value is complete."""
+        self.text += chunk
+        while self.pos < len(self.text) and self.plan_end is None:
+            c = self.text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = self.text[self.string_start + 1:self.pos]
+                        if self.plan_start is not None:
+                            # the plan is a string, e.g. manipulation actions in language-only mode
+                            self.plan_end = self.pos + 1
+            elif c == '"':
+                self.in_string = True
+                self.string_start = self.pos
+                if self.depth == 1 and self.current_key == self.json_key and self.plan_start is None:
+                    self.plan_start = self.pos
+            elif c == ':' and self.depth == 1:
+                self.current_key = self.last_string
+            elif c == ',' and self.depth == 1:
+                self.current_key = None
+            elif c in '[{':
+                if self.depth == 1 and self.current_key == self.json_key and self.plan_start is None:
+                    self.plan_start = self.pos
+                self.depth += 1
+            elif c in ']}':
+                self.depth -= 1
+                if self.depth == 1 and self.plan_start is not None:
+                    self.plan_end = self.pos + 1
+            self.pos += 1
+        return self.plan_complete
+
+    def result(self):
+        """
+        The text generated so far. If generation was stopped right after the plan, the
+        enclosing object is closed so the output is still valid JSON.
+        """
+        if self.plan_complete:
+            try:
+                json.loads(self.text)
+            except json.JSONDecodeError:
+                return self.text[:self.plan_end] + '}'
+        return self.text
+
+
 class ExecutableAction_1(typing.TypedDict): 
     action_id: int = Field(
         description="The action ID to select from the available actions given by the prompt"
@@ -129,12 +205,13 @@ def convert_format_2claude(messages):
     
             for item in message["content"]:
                 if item.get("type") == "image_url":
-                    base64_data = item["image_url"]["url"][22:]
+                    # data:<media type>;base64,<data>
+                    header, base64_data = item["image_url"]["url"].split(",", 1)
                     new_item = {
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/png",
+                            "media_type": header[5:].split(";")[0],
                             "data": base64_data
                         }
                     }
@@ -160,7 +237,7 @@ def convert_format_2gemini(messages):
             new_content = []
             for item in message["content"]:
                 if item.get("type") == "image_url":
-                    base64_data = item["image_url"]["url"][22:]
+                    base64_data = item["image_url"]["url"].split(",", 1)[1]
                     new_item = {
                         "type": "image_url",
                         "image_url": {
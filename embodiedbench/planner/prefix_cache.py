@@ -0,0 +1,273 @@
+import os
+import sys
+import copy
+import time
+import hashlib
+from collections import OrderedDict
+import torch
+from transformers import DynamicCache
+
+# number of prompt prefixes whose key/value cache server.py keeps, 0 (default) disables the prefix cache.
+# Every entry is a full copy of the key/value cache of its prefix on the gpu (for gemma-3-12b-it about
+# 2 * 48 layers * 8 kv heads * 256 dims * 2 bytes = 384 KB per token, ~0.8 GB for a 2k-token prompt),
+# and a lookup copies an entry once more, so keep it at 1-2. Run the checks below before enabling it.
+prefix_cache_size = int(os.environ.get('prefix_cache_size', 0))
+# shorter shared prefixes are prefilled again rather than copied from the cache
+prefix_cache_min_tokens = int(os.environ.get('prefix_cache_min_tokens', 64))
+
+
+class FirstTokenTimer():
+    """
+    generate() streamer that records when the first new token is produced, and the number of
+    decoding steps and new tokens (a step of assisted decoding emits several tokens).
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.calls = 0
+        self.ttft = None
+        self.new_tokens = 0
+        self.seconds = None
+
+    @property
+    def steps(self):
+        return max(self.calls - 1, 0)
+
+    def put(self, value):
+        # the first call receives the prompt, the next ones the tokens of each decoding step
+        self.calls += 1
+        if self.calls == 2:
+            self.ttft = time.time() - self.start
+        if self.calls >= 2:
+            self.new_tokens += value.numel()
+
+    def end(self):
+        self.seconds = time.time() - self.start
+        if self.ttft is None:
+            self.ttft = self.seconds
+
+
+class PrefixKVCache():
+    """
+    LRU of the key/value cache of recent prompt prefixes, keyed by a hash of their token ids.
+    Every planner step resends the same system prompt and in-context examples, so a request
+    only has to prefill the tokens after the longest prefix it shares with a cached one.
+    """
+
+    def __init__(self, max_entries=prefix_cache_size, min_tokens=prefix_cache_min_tokens):
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self.entries = OrderedDict()  # prefix hash -> (token ids, cache)
+        self.requests = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def key(ids):
+        return hashlib.sha1(ids.cpu().numpy().tobytes()).hexdigest()
+
+    def lookup(self, ids, limit):
+        """
+        (length, cache) of the longest cached prefix shared with the 1-d token ids, at most limit
+        tokens. The cache is a copy cropped to that length, or an empty cache on a miss.
+        """
+        self.requests += 1
+        self.prompt_tokens += len(ids)
+        best_key, best_len = None, 0
+        for key, (prefix, _) in self.entries.items():
+            n = min(len(prefix), limit)
+            diff = (prefix[:n] != ids[:n]).nonzero()
+            common = int(diff[0]) if len(diff) else n
+            if common > best_len:
+                best_key, best_len = key, common
+        if best_len < self.min_tokens:
+            return 0, DynamicCache()
+        self.entries.move_to_end(best_key)
+        cache = copy.deepcopy(self.entries[best_key][1])
+        cache.crop(best_len)
+        self.hits += 1
+        self.reused_tokens += best_len
+        return best_len, cache
+
+    def store(self, ids, cache):
+        """Cache (a copy of) the key/value cache of the prefix ids."""
+        if self.max_entries <= 0 or len(ids) < self.min_tokens:
+            return
+        key = self.key(ids)
+        if key not in self.entries:
+            self.entries[key] = (ids.clone(), copy.deepcopy(cache))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def summary(self):
+        return '{}/{} requests hit, {}/{} prompt tokens ({:.1%}) not prefilled again'.format(
+            self.hits, self.requests, self.reused_tokens, self.prompt_tokens,
+            self.reused_tokens / max(self.prompt_tokens, 1))
+
+
+def generate_with_prefix_cache(model, inputs, prefix_cache, prefix_limit=None, **gen_kwargs):
+    """
+    model.generate(**inputs, **gen_kwargs) with the prompt prefilled here: the longest cached
+    prefix is reused, the prompt up to prefix_limit (e.g. the first image token, the cache holds
+    text only) is prefilled and stored, and the rest of the prompt but its last token is prefilled
+    with the remaining model inputs (pixel values, ...) before generate() decodes.
+    Returns (output ids, stats) where stats has the prompt/reused tokens and the time to first token.
+    """
+    input_ids = inputs['input_ids']
+    attention_mask = inputs.get('attention_mask')
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    n = input_ids.shape[1]
+    store_len = n - 1 if prefix_limit is None else min(prefix_limit, n - 1)
+    start = time.time()
+
+    with torch.inference_mode():
+        reused, cache = prefix_cache.lookup(input_ids[0], store_len)
+
+        def prefill(begin, end, **extra):
+            if end > begin:
+                model(input_ids=input_ids[:, begin:end], attention_mask=attention_mask[:, :end],
+                      past_key_values=cache, cache_position=torch.arange(begin, end, device=input_ids.device),
+                      use_cache=True, **extra)
+
+        prefill(reused, store_len)
+        prefix_cache.store(input_ids[0, :store_len], cache)
+        extra = {k: v for k, v in inputs.items() if k not in ('input_ids', 'attention_mask')}
+        if 'token_type_ids' in extra:
+            extra['token_type_ids'] = extra['token_type_ids'][:, store_len:n - 1]
+        prefill(store_len, n - 1, **extra)
+
+        # generate() only runs the last prompt token, the multimodal inputs are dropped once the cache is filled
+        timer = FirstTokenTimer(start)
+        output = model.generate(**inputs, past_key_values=cache, streamer=timer, **gen_kwargs)
+    return output, {'prompt_tokens': n, 'reused_tokens': reused, 'ttft': timer.ttft, 'timer': timer}
+
+
+def generate_request(model, inputs, prefix_cache=None, image_token_id=None, **gen_kwargs):
+    """
+    The generate() call of server.py for the chat-template models: through the prefix cache when there is
+    one, the cached prefix stopping at the first image token, plain generate() otherwise.
+    Returns (output ids, FirstTokenTimer of the call).
+    """
+    if prefix_cache is None:
+        timer = FirstTokenTimer(time.time())
+        with torch.inference_mode():
+            output = model.generate(**inputs, streamer=timer, **gen_kwargs)
+        return output, timer
+    prefix_limit = None
+    if image_token_id is not None:
+        image_positions = (inputs['input_ids'][0] == image_token_id).nonzero()
+        prefix_limit = int(image_positions[0]) if len(image_positions) else None
+    output, stats = generate_with_prefix_cache(model, inputs, prefix_cache, prefix_limit, **gen_kwargs)
+    print('prefix cache: reused {} of {} prompt tokens, time to first token {:.3f}s; {}'.format(
+        stats['reused_tokens'], stats['prompt_tokens'], stats['ttft'], prefix_cache.summary()))
+    return output, stats['timer']
+
+
+def check_prefix_cache(model_id='hf-internal-testing/tiny-random-LlamaForCausalLM', max_new_tokens=16):
+    """
+    Greedy outputs with the prefix cache must match plain generate() on a text-only tiny model on CPU;
+    `python -m embodiedbench.planner.prefix_cache [model_id]` runs this, check_prefix_cache_constrained
+    and check_prefix_cache_multimodal.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+    system = 'You are a robot operating in a home. ' * 16
+    prompts = [system + 'Step 1: find the apple.', system + 'Step 2: pick up the apple.', system + 'Step 2: pick up the apple.']
+    prefix_cache = PrefixKVCache(max_entries=2, min_tokens=8)
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors='pt')
+        with torch.inference_mode():
+            expected = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        _, baseline = generate_with_prefix_cache(model, inputs, PrefixKVCache(max_entries=0),
+                                                 max_new_tokens=max_new_tokens, do_sample=False)
+        output, stats = generate_with_prefix_cache(model, inputs, prefix_cache, max_new_tokens=max_new_tokens, do_sample=False)
+        print('reused {} of {} prompt tokens, time to first token {:.4f}s (without cache {:.4f}s), same output: {}'.format(
+            stats['reused_tokens'], stats['prompt_tokens'], stats['ttft'], baseline['ttft'], torch.equal(expected, output)))
+        assert torch.equal(expected, output), 'prefix cache changed the greedy output'
+    print(prefix_cache.summary())
+
+
+def check_prefix_cache_constrained(model_id='hf-internal-testing/tiny-random-LlamaForCausalLM', max_new_tokens=32):
+    """
+    Requests as server.py runs them with constrained decoding on (the planner json schema enforced by an
+    lm-format-enforcer prefix_allowed_tokens_fn, same generate() kwargs), each through generate_request once
+    without and once with the prefix cache: the outputs must be identical. Needs `pip install lm-format-enforcer`.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from lmformatenforcer import JsonSchemaParser
+    from lmformatenforcer.integrations.transformers import build_transformers_prefix_allowed_tokens_fn, \
+                                                           build_token_enforcer_tokenizer_data
+    from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+    tokenizer_data = build_token_enforcer_tokenizer_data(tokenizer)
+    system = 'You are a robot operating in a home. Answer in json. ' * 12
+    prompts = [system + 'Step 1: find the apple.', system + 'Step 2: pick up the apple.', system + 'Step 2: pick up the apple.']
+    prefix_cache = PrefixKVCache(max_entries=2, min_tokens=8)
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors='pt')
+        outputs = []
+        for cache in (None, prefix_cache):
+            # the enforcer tracks the generated prefix, server.py builds one per request
+            constraint = build_transformers_prefix_allowed_tokens_fn(tokenizer_data, JsonSchemaParser(llm_generation_guide))
+            output, _ = generate_request(model, inputs, cache, max_new_tokens=max_new_tokens, do_sample=False,
+                                         temperature=0.0, use_cache=True, prefix_allowed_tokens_fn=constraint)
+            outputs.append(output)
+        print('constrained: {!r}, same output with the prefix cache: {}'.format(
+            tokenizer.decode(outputs[0][0, inputs['input_ids'].shape[1]:]), torch.equal(*outputs)))
+        assert torch.equal(*outputs), 'prefix cache changed the constrained output'
+    assert prefix_cache.hits > 0, 'the shared prefix was never reused'
+    print(prefix_cache.summary())
+
+
+def tiny_gemma3(seed=0):
+    """Randomly initialized Gemma3ForConditionalGeneration small enough for the cpu, with sliding window layers."""
+    from transformers import Gemma3Config, Gemma3ForConditionalGeneration
+    torch.manual_seed(seed)
+    config = Gemma3Config(
+        text_config=dict(vocab_size=320, hidden_size=64, intermediate_size=128, num_hidden_layers=6,
+                         num_attention_heads=4, num_key_value_heads=2, head_dim=16, sliding_window=16,
+                         max_position_embeddings=512),
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=1, num_attention_heads=2,
+                           image_size=28, patch_size=7),
+        mm_tokens_per_image=4, boi_token_index=300, eoi_token_index=301, image_token_index=302)
+    return Gemma3ForConditionalGeneration(config).eval()
+
+
+def check_prefix_cache_multimodal(max_new_tokens=16):
+    """
+    The server path: prompts with a shared text prefix followed by an image, prefix_limit at the first
+    image token, so the image chunk (pixel values and the token_type_ids of gemma3's bidirectional image
+    mask) is prefilled at a non-zero cache offset. Greedy outputs must match plain generate().
+    """
+    model = tiny_gemma3()
+    config = model.config
+    system = torch.randint(0, 300, (48,))
+    prefix_cache = PrefixKVCache(max_entries=2, min_tokens=8)
+    for step in range(3):
+        image_tokens = torch.tensor([config.boi_token_index] + [config.image_token_index] * config.mm_tokens_per_image
+                                    + [config.eoi_token_index])
+        input_ids = torch.cat([system, image_tokens, torch.randint(0, 300, (8 + step,))])[None]
+        inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids),
+                  'token_type_ids': (input_ids == config.image_token_index).long(),
+                  'pixel_values': torch.randn(1, 3, 28, 28)}
+        with torch.inference_mode():
+            expected = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        prefix_limit = int((input_ids[0] == config.image_token_index).nonzero()[0])
+        output, stats = generate_with_prefix_cache(model, inputs, prefix_cache, prefix_limit,
+                                                   max_new_tokens=max_new_tokens, do_sample=False)
+        print('multimodal: reused {} of {} prompt tokens, same output: {}'.format(
+            stats['reused_tokens'], stats['prompt_tokens'], torch.equal(expected, output)))
+        assert torch.equal(expected, output), 'prefix cache changed the greedy output of a prompt with an image'
+    assert prefix_cache.hits > 0, 'the shared text prefix was never reused'
+    print(prefix_cache.summary())
+
+
+if __name__ == '__main__':
+    check_prefix_cache(*sys.argv[1:2])
+    check_prefix_cache_constrained(*sys.argv[1:2])
+    check_prefix_cache_multimodal()
@@ -0,0 +1,149 @@
+import os
+import io
+import sys
+import time
+import resource
+import torch
+
+# 'auto' serves on the gpus (device_map='auto'), 'cpu' loads the model in float32 on the cpu
+server_device = os.environ.get('server_device', 'auto')
+# weight quantization of the linear layers: 'none', 'int8' (torch dynamic quantization, cpu only)
+# or 'int4' (optimum-quanto weight-only quantization, requires `pip install optimum-quanto`)
+quantize = os.environ.get('quantize', 'none')
+# torch intra-op threads on the cpu, 0 keeps the torch default (one per core)
+num_threads = int(os.environ.get('num_threads', 0))
+
+
+def load_kwargs(default_attn="eager"):
+    """from_pretrained kwargs for the serving device: bfloat16 on the gpus, float32 on the cpu."""
+    if server_device == 'cpu':
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        # dynamic quantization needs float32 linear layers, and flash attention needs a gpu
+        attn = 'sdpa' if default_attn == 'flash_attention_2' else default_attn
+        return dict(torch_dtype=torch.float32, device_map='cpu', attn_implementation=attn)
+    return dict(torch_dtype=torch.bfloat16, device_map='auto', attn_implementation=default_attn)
+
+
+def state_dict_bytes(module):
+    """Bytes of the weights and buffers of module, including the packed weights of quantized layers."""
+    def nbytes(value):
+        if isinstance(value, torch.Tensor):
+            return value.element_size() * value.nelement()
+        if isinstance(value, (tuple, list)):
+            return sum(nbytes(v) for v in value)
+        return 0
+    return sum(nbytes(value) for value in module.state_dict().values())
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def quantize_model(model, mode=quantize):
+    """Quantize the linear layers of model in place (mode 'int8' or 'int4') and print the weight footprint."""
+    before = state_dict_bytes(model)
+    if mode == 'int8':
+        if server_device != 'cpu':
+            raise ValueError('int8 dynamic quantization runs on the cpu, set server_device=cpu')
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif mode == 'int4':
+        from optimum.quanto import quantize as quanto_quantize, freeze, qint4
+        quanto_quantize(model, weights=qint4)
+        freeze(model)
+    elif mode != 'none':
+        raise ValueError(f'Unknown quantization: {mode}')
+    print('model weights: {:.1f} MB -> {:.1f} MB ({}), max rss {:.1f} MB, {} threads'.format(
+        before / 2**20, state_dict_bytes(model) / 2**20, mode, max_rss_mb(), torch.get_num_threads()))
+    return model
+
+
+class TextServerModel():
+    """Stands in for server.CustomModel with a causal lm and its tokenizer, text only, the schema is not enforced."""
+
+    def __init__(self, model, tokenizer, max_new_tokens=16):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+
+    def respond(self, prompt, image_path=None, schema=None, images=None, max_new_tokens=None):
+        inputs = self.tokenizer(prompt, return_tensors='pt')
+        with torch.inference_mode():
+            output = self.model.generate(**inputs, max_new_tokens=min(max_new_tokens or self.max_new_tokens, self.max_new_tokens),
+                                         do_sample=False)
+        return self.tokenizer.decode(output[0, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+
+
+def check_process_schema(served, prompt='Step 1: find the apple.'):
+    """
+    Posts to the /process route of server.py, as a form upload and as a msgpack body, with served as
+    the model: the replies must carry the fields the custom planner client reads, and bad requests an error.
+    Run it from the repository root, where server.py is.
+    """
+    from PIL import Image
+    import server
+    server.model = served
+    client = server.app.test_client()
+    image = io.BytesIO()
+    Image.new('RGB', (32, 32)).save(image, format='PNG')
+
+    response = client.post('/process', content_type='multipart/form-data', data={
+        'sentence': prompt, 'schema': 'llm', 'image': (io.BytesIO(image.getvalue()), 'obs.png')})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    body = response.get_json()
+    assert set(body) == {'response', 'constrained'}, f'form reply fields changed: {sorted(body)}'
+    assert isinstance(body['response'], str) and isinstance(body['constrained'], bool)
+
+    response = client.post('/process', data={'sentence': prompt})
+    assert response.status_code == 400 and 'error' in response.get_json(), 'a request without image must be rejected'
+
+    if server.msgpack is not None:
+        payload = server.msgpack.packb({'prompt': prompt, 'images': [image.getvalue()], 'schema': 'llm',
+                                        'params': {'max_new_tokens': 8}}, use_bin_type=True)
+        response = client.post('/process', data=payload, content_type='application/msgpack')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        body = server.msgpack.unpackb(response.data, raw=False)
+        assert set(body) == {'response', 'constrained', 'server_seconds'}, f'msgpack reply fields changed: {sorted(body)}'
+        assert isinstance(body['response'], str) and isinstance(body['constrained'], bool)
+    print('/process replies: {}'.format(body))
+
+
+def check_quantized(model_id='hf-internal-testing/tiny-random-LlamaForCausalLM', mode='int8', max_new_tokens=16,
+                    min_token_match=0.9):
+    """
+    Check of the cpu serving mode on a tiny model: loads it as server.py would, quantizes it and compares
+    greedy outputs and latency with the float32 model, then serves it through server.py's /process route.
+    A rounded weight can flip a near tie of the logits, after which the free-running outputs diverge, so
+    the assertion is on the tokens the quantized model picks after each prefix of the float32 output:
+    at least min_token_match of them must be the float32 token.
+    Run with `server_device=cpu python -m embodiedbench.planner.quantization [model_id] [mode]`.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, **load_kwargs()).eval()
+    inputs = tokenizer('You are a robot operating in a home. Step 1: find the apple.', return_tensors='pt')
+    input_len = inputs['input_ids'].shape[1]
+
+    def run(m):
+        start = time.time()
+        with torch.inference_mode():
+            output = m.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        return output[0, input_len:], time.time() - start
+
+    expected, seconds = run(model)
+    model = quantize_model(model, mode)
+    output, quantized_seconds = run(model)
+    same = sum(int(a == b) for a, b in zip(expected.tolist(), output.tolist()))
+    with torch.inference_mode():
+        logits = model(input_ids=torch.cat([inputs['input_ids'][0], expected])[None]).logits
+    match = (logits[0, input_len - 1:-1].argmax(-1) == expected).float().mean().item()
+    print('{}: {}/{} greedy tokens match float32, {:.1%} on the float32 prefixes, {:.3f}s vs {:.3f}s'.format(
+        mode, same, len(expected), match, quantized_seconds, seconds))
+    assert match >= min_token_match, '{} picks the float32 greedy token on {:.1%} of the prefixes, below {:.0%}'.format(
+        mode, match, min_token_match)
+    check_process_schema(TextServerModel(model, tokenizer, max_new_tokens))
+
+
+if __name__ == '__main__':
+    check_quantized(*sys.argv[1:3])
@@ -11,7 +11,7 @@ from lmdeploy import pipeline, GenerationConfig, PytorchEngineConfig
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
 from embodiedbench.planner.planner_config.generation_guide_manip import llm_generation_guide_manip, vlm_generation_guide_manip
 from embodiedbench.planner.planner_utils import convert_format_2claude, convert_format_2gemini, ActionPlan_1, ActionPlan, ActionPlan_lang, \
-                                             ActionPlan_1_manip, ActionPlan_manip, ActionPlan_lang_manip, fix_json
+                                             ActionPlan_1_manip, ActionPlan_manip, ActionPlan_lang_manip, fix_json, IncrementalPlanParser
 
 temperature = 0
 max_completion_tokens = 2048
@@ -24,12 +24,16 @@ class RemoteModel:
         model_type='remote',
         language_only=False,
         tp=1,
-        task_type=None # used to distinguish between manipulation and other environments
+        task_type=None, # used to distinguish between manipulation and other environments
+        stream=False, # stream the completion and parse the executable plan while it is generated
+        stop_on_plan=True # when streaming, stop generation as soon as the executable plan is complete
     ):
         self.model_name = model_name
         self.model_type = model_type
         self.language_only = language_only
         self.task_type = task_type
+        self.stream = stream
+        self.stop_on_plan = stop_on_plan
 
         if self.model_type == 'local':
             backend_config = PytorchEngineConfig(session_len=12000, dtype='float16', tp=tp)
@@ -106,6 +110,27 @@ class RemoteModel:
             else:
                 raise ValueError(f"Unsupported model name: {self.model_name}")
 
+    def _consume_stream(self, text_deltas):
+        parser = IncrementalPlanParser()
+        for delta in text_deltas:
+            if delta and parser.feed(delta) and self.stop_on_plan:
+                break
+        return parser.result()
+
+    def _openai_deltas(self, response):
+        for chunk in response:
+            if len(chunk.choices) and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _read_completion(self, response):
+        if not self.stream:
+            return response.choices[0].message.content
+        try:
+            return self._consume_stream(self._openai_deltas(response))
+        finally:
+            # closing the connection aborts the rest of the generation on the server side
+            response.close()
+
     def _call_local(self, message_history: list):
         if self.task_type == 'manip':
             response_format = {
@@ -123,15 +148,16 @@ class RemoteModel:
                     "schema": llm_generation_guide if self.language_only else vlm_generation_guide
                 }
             }
-        response = self.model(
-            message_history,
-            gen_config=GenerationConfig(
-                temperature=temperature,
-                response_format=response_format,
-                max_new_tokens=max_completion_tokens,
-            )
+        gen_config = GenerationConfig(
+            temperature=temperature,
+            response_format=response_format,
+            max_new_tokens=max_completion_tokens,
         )
-        out = response.text
+        if self.stream:
+            out = self._consume_stream(response.text for response in self.model.stream_infer(message_history, gen_config=gen_config))
+        else:
+            response = self.model(message_history, gen_config=gen_config)
+            out = response.text
         out = fix_json(out)
         return out
 
@@ -140,6 +166,15 @@ class RemoteModel:
         if not self.language_only:
             message_history = convert_format_2claude(message_history)
 
+        if self.stream:
+            with self.model.messages.stream(
+                model=self.model_name,
+                max_tokens=max_completion_tokens,
+                temperature=temperature,
+                messages=message_history
+            ) as stream:
+                return self._consume_stream(stream.text_stream)
+
         response = self.model.messages.create(
             model=self.model_name,
             max_tokens=max_completion_tokens,
@@ -192,9 +227,10 @@ class RemoteModel:
             messages=message_history,
             response_format=response_format,
             temperature=temperature,
-            max_tokens=max_completion_tokens
+            max_tokens=max_completion_tokens,
+            stream=self.stream
         )
-        out = response.choices[0].message.content
+        out = self._read_completion(response)
 
         return out
     
@@ -219,10 +255,11 @@ class RemoteModel:
             messages=message_history,
             response_format=response_format,
             temperature=temperature,
-            max_tokens=max_completion_tokens
+            max_tokens=max_completion_tokens,
+            stream=self.stream
         )
 
-        out = response.choices[0].message.content
+        out = self._read_completion(response)
         return out
     
     def _call_llama90(self, message_history: list):
@@ -231,18 +268,20 @@ class RemoteModel:
                 model="accounts/fireworks/models/llama-v3p2-90b-vision-instruct",
                 messages=message_history,
                 response_format={"type": "json_object", "schema": ActionPlan_1_manip.model_json_schema()},
-                temperature = temperature
+                temperature = temperature,
+                stream=self.stream
             )
-            out = response.choices[0].message.content
+            out = self._read_completion(response)
             
         else:
             response = self.model.chat.completions.create(
                 model="accounts/fireworks/models/llama-v3p2-90b-vision-instruct",
                 messages=message_history,
                 response_format={"type": "json_object", "schema": ActionPlan_1.model_json_schema()},
-                temperature = temperature
+                temperature = temperature,
+                stream=self.stream
             )
-            out = response.choices[0].message.content
+            out = self._read_completion(response)
         return out
     
     def _call_llama11b(self, message_history):
@@ -266,9 +305,10 @@ class RemoteModel:
             messages=message_history,
             response_format=response_format,
             temperature=temperature,
-            max_tokens=max_completion_tokens
+            max_tokens=max_completion_tokens,
+            stream=self.stream
         )
-        out = response.choices[0].message.content
+        out = self._read_completion(response)
         return out
     
 
@@ -292,11 +332,12 @@ class RemoteModel:
             messages=message_history,
             response_format=response_format,
             temperature=temperature,
-            max_tokens=max_completion_tokens
+            max_tokens=max_completion_tokens,
+            stream=self.stream
         )
 
         # easy to meet json errors
-        out = response.choices[0].message.content
+        out = self._read_completion(response)
         out = fix_json(out)
         return out
     
@@ -323,10 +364,11 @@ class RemoteModel:
             # response_format=response_format,
             temperature=temperature,
             max_tokens=max_completion_tokens,
+            stream=self.stream
         )
 
         # easy to meet json errors
-        out = response.choices[0].message.content
+        out = self._read_completion(response)
         out = fix_json(out)
         return out
 
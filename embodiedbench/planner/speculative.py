@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import torch
+from embodiedbench.planner.prefix_cache import FirstTokenTimer
+
+# assisted decoding in server.py: 'none', 'prompt_lookup' (draft tokens copied from n-grams of the
+# prompt, e.g. the action names of the action list) or 'draft' (a small draft model, draft_model_path)
+# server.py leaves it off for requests with a json schema and while the prefix cache is on, check_speculative
+# below only covers plain generate()
+speculative = os.environ.get('speculative', 'none')
+# the draft model must share the tokenizer of the served model and accept the same inputs,
+# e.g. google/gemma-3-4b-it for google/gemma-3-12b-it
+draft_model_path = os.environ.get('draft_model_path')
+# number of tokens drafted per step
+num_draft_tokens = int(os.environ.get('num_draft_tokens', 10))
+
+
+def load_draft_model(model_cls, **kwargs):
+    if speculative != 'draft':
+        return None
+    if draft_model_path is None:
+        raise ValueError('speculative=draft needs draft_model_path')
+    return model_cls.from_pretrained(draft_model_path, **kwargs).eval()
+
+
+def speculative_kwargs(draft_model=None):
+    """generate() kwargs of the assisted decoding mode, both are exact under greedy decoding."""
+    if speculative == 'prompt_lookup':
+        return {'prompt_lookup_num_tokens': num_draft_tokens}
+    if speculative == 'draft':
+        draft_model.generation_config.num_assistant_tokens = num_draft_tokens
+        return {'assistant_model': draft_model}
+    if speculative != 'none':
+        raise ValueError(f'Unknown speculative decoding mode: {speculative}')
+    return {}
+
+
+def decode_report(timer):
+    """
+    Tokens/sec and acceptance of one generate() call from its FirstTokenTimer streamer: every
+    decoding step emits the draft tokens the model accepted plus one token of its own.
+    """
+    accepted = timer.new_tokens - timer.steps
+    return '{} new tokens in {} steps, {:.2f} draft tokens accepted per step ({:.1%} of the output), {:.1f} tokens/s'.format(
+        timer.new_tokens, timer.steps, accepted / max(timer.steps, 1), accepted / max(timer.new_tokens, 1),
+        timer.new_tokens / max(timer.seconds, 1e-6))
+
+
+def check_speculative(model_id='hf-internal-testing/tiny-random-LlamaForCausalLM', draft_id=None, max_new_tokens=32):
+    """
+    Greedy outputs with prompt lookup and with a draft model (draft_id, the model itself by default)
+    must match plain generate(); run on a tiny model pair on CPU with
+    `python -m embodiedbench.planner.speculative [model_id] [draft_id]`.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+    draft = AutoModelForCausalLM.from_pretrained(draft_id or model_id, torch_dtype=torch.float32).eval()
+    draft.generation_config.num_assistant_tokens = num_draft_tokens
+    prompt = ('Action list: action id 0, find a apple; action id 1, pick up the apple; action id 2, find a fridge; '
+              'action id 3, open the fridge; action id 4, put down the object in hand. Plan: ')
+    inputs = tokenizer(prompt, return_tensors='pt')
+    modes = {'none': {}, 'prompt_lookup': {'prompt_lookup_num_tokens': num_draft_tokens}, 'draft': {'assistant_model': draft}}
+    expected = None
+    for mode, kwargs in modes.items():
+        timer = FirstTokenTimer(time.time())
+        with torch.inference_mode():
+            output = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False, streamer=timer, **kwargs)
+        expected = output if expected is None else expected
+        print('{}: {}, same output: {}'.format(mode, decode_report(timer), torch.equal(expected, output)))
+        assert torch.equal(expected, output), f'{mode} changed the greedy output'
+
+
+if __name__ == '__main__':
+    check_speculative(*sys.argv[1:3])
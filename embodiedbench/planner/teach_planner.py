@@ -7,6 +7,7 @@ import json
 from embodiedbench.planner.planner_utils import local_image_to_data_url, truncate_message_prompts
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
+from embodiedbench.planner.image_policy import ImagePolicy
 from embodiedbench.planner.planner_utils import template, template_lang
 from embodiedbench.main import logger
 
@@ -26,6 +27,7 @@ class EBTeachPlanner():
         self.output_json_error = 0
         self.kwargs = kwargs
         self.action_key = kwargs.pop('action_key', 'action_id')
+        self.image_policy = ImagePolicy(model_name)
         self.multiview = multiview
         self.multistep = multistep
         self.visual_icl = visual_icl
@@ -99,6 +101,7 @@ class EBTeachPlanner():
                 ],
             }
         
+        self.image_policy.fit(current_message["content"])
         messages = messages + [current_message]
         return messages[-MESSAGE_WINDOW_LEN:]
 
@@ -9,11 +9,12 @@ from embodiedbench.planner.planner_config.generation_guide import llm_generation
 from embodiedbench.planner.planner_utils import local_image_to_data_url, template, template_lang, fix_json
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
+from embodiedbench.planner.image_policy import ImagePolicy, EpisodeFrameCache
 from embodiedbench.main import logger
 
 class VLMPlanner():
     def __init__(self, model_name, model_type, actions, system_prompt, examples, n_shot=0, obs_key='head_rgb', 
-                chat_history=False, language_only=False, use_feedback=True, multistep=0, tp=1, kwargs={}):
+                chat_history=False, language_only=False, use_feedback=True, multistep=0, tp=1, stream=False, kwargs={}):
         self.model_name = model_name
         self.obs_key = obs_key
         self.system_prompt = system_prompt
@@ -25,7 +26,8 @@ class VLMPlanner():
         if model_type == 'custom':
             self.model = CustomModel(model_name, language_only)
         else:
-            self.model = RemoteModel(model_name, model_type, language_only, tp=tp)
+            # with streaming, generation stops as soon as the executable plan is complete
+            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, stream=stream)
 
         self.use_feedback = use_feedback
         self.multistep = multistep
@@ -34,6 +36,8 @@ class VLMPlanner():
         self.language_only = language_only
         self.kwargs = kwargs
         self.action_key = kwargs.pop('action_key', 'action_id')
+        self.image_policy = ImagePolicy(model_name)
+        self.frame_cache = EpisodeFrameCache()
     
     def set_actions(self, actions):
         self.actions = actions
@@ -114,17 +118,14 @@ class VLMPlanner():
             if self.multistep: # handle multiple images
                 ind = int(image_path.split('step_')[-1].strip('.png'))
                 content = [{"type": "text", "text": prompt}]
-                for i in range(max(ind - self.multistep + 1, 0), ind +1):
-                    temp_path = ''.join(image_path.split('step_')[:-1])+ f'step_{str(i)}.png'
-                    temp_data_url = local_image_to_data_url(image_path=temp_path)
-                    content.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": temp_data_url,
-                            }})
+                steps = list(range(max(ind - self.multistep + 1, 0), ind +1))
+                temp_paths = [''.join(image_path.split('step_')[:-1])+ f'step_{str(i)}.png' for i in steps]
+                # frames are encoded once per episode, unchanged frames are replaced by a back-reference
+                content.extend(self.frame_cache.image_items(temp_paths, [f'image of step {i}' for i in steps]))
             else:
                 data_url = local_image_to_data_url(image_path=image_path)
                 content = [{ "type": "image_url", "image_url": { "url": data_url,}}, {"type": "text", "text": prompt}]
+            self.image_policy.fit(content, self.frame_cache)
 
             return messages + [
                 {
@@ -139,6 +140,7 @@ class VLMPlanner():
         self.episode_act_feedback = []
         self.planner_steps = 0
         self.output_json_error = 0
+        self.frame_cache.reset()
 
     def language_to_action(self, output_text):
         pattern = r'\*\*\d+\*\*'
@@ -183,8 +185,9 @@ class VLMPlanner():
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        # fix common generated json errors
-        out = fix_json(out)
+        # fix common generated json errors, not needed when the server constrained decoding to the schema
+        if not self.model.constrained:
+            out = fix_json(out)
         logger.debug(f"Model Output:\n{out}\n")
         action = self.json_to_action(out)
         self.planner_steps += 1
@@ -14,11 +14,14 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), "teach_integrate", "t
 
 
 class RandomAgent:
-    def __init__(self, env_name, teach_data_dir=None):
+    def __init__(self, env_name, teach_data_dir=None, video_stride=1, video_scale=1.0):
         self.env_name = env_name
         self.env = None
         self.action_space = None
         self.rgb_key = 'head_rgb'  # Default for EmbodiedBench envs
+        # frames are encoded in the background while the episode runs
+        self.video_stride = video_stride
+        self.video_scale = video_scale
 
         # TEACh-specific state (native API)
         self.teach_data_dir = teach_data_dir
@@ -146,15 +149,10 @@ class RandomAgent:
                     return np.array(obs[key]).astype(np.uint8)
         return None
 
-    def save_video(self, frames, output_path, fps=10):
-        if not frames:
-            return
-        height, width, layers = frames[0].shape
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        for frame in frames:
-            video.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-        video.release()
+    def open_video(self, log_dir, fps=10):
+        from embodiedbench.envs.video_writer import BackgroundVideoWriter
+        return BackgroundVideoWriter(os.path.join(log_dir, "video.mp4"), fps=fps,
+                                     stride=self.video_stride, scale=self.video_scale)
 
     # ------------------------------------------------------------------ #
     #  Run episode                                                         #
@@ -187,10 +185,10 @@ class RandomAgent:
             "steps": []
         }
 
-        frames = []
+        video = self.open_video(log_dir)
         frame = self.get_frame(obs)
         if frame is not None:
-            frames.append(frame)
+            video.append(frame)
             cv2.imwrite(os.path.join(log_dir, "step_0.png"),
                         cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
             init_frame_path = os.path.join(log_dir, "step_0.png")
@@ -233,7 +231,7 @@ class RandomAgent:
             frame = self.get_frame(obs)
             frame_path = None
             if frame is not None:
-                frames.append(frame)
+                video.append(frame)
                 frame_path = os.path.join(log_dir, f"step_{i}.png")
                 cv2.imwrite(frame_path, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
 
@@ -253,7 +251,7 @@ class RandomAgent:
                 print(f"Episode finished at step {i}")
                 break
 
-        self._save_artifacts(log_dir, logs, frames)
+        self._save_artifacts(log_dir, logs, video)
         self.env.close()
 
     # -- TEACh (native teach API) ---------------------------------------- #
@@ -273,12 +271,12 @@ class RandomAgent:
             "steps": []
         }
 
-        frames = []
+        video = self.open_video(log_dir)
 
         # Initial frame
         frame = self._get_teach_frame()
         if frame is not None:
-            frames.append(frame)
+            video.append(frame)
             cv2.imwrite(os.path.join(log_dir, "step_0.png"),
                         cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
 
@@ -298,7 +296,7 @@ class RandomAgent:
             frame = self._get_teach_frame()
             frame_path = None
             if frame is not None:
-                frames.append(frame)
+                video.append(frame)
                 frame_path = os.path.join(log_dir, f"step_{i}.png")
                 cv2.imwrite(frame_path, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
 
@@ -314,18 +312,18 @@ class RandomAgent:
             })
             print(f"Step {i}: Action={action}, Success={success}")
 
-        self._save_artifacts(log_dir, logs, frames)
+        self._save_artifacts(log_dir, logs, video)
         self.er.simulator.shutdown_simulator()
 
     # -- Shared save ------------------------------------------------------ #
-    def _save_artifacts(self, log_dir, logs, frames):
+    def _save_artifacts(self, log_dir, logs, video):
         log_path = os.path.join(log_dir, "log.json")
-        video_path = os.path.join(log_dir, "video.mp4")
         with open(log_path, 'w') as f:
             json.dump(logs, f, indent=4)
-        self.save_video(frames, video_path)
+        video_path = video.close()
         print(f"Saved log   -> {log_path}")
-        print(f"Saved video -> {video_path}")
+        if video_path is not None:
+            print(f"Saved video -> {video_path}")
 
 
 def main():
@@ -339,9 +337,14 @@ def main():
                         help="TEACh data directory (default: teach_integrate/teach/data)")
     parser.add_argument("--steps", type=int, default=30,
                         help="Number of steps per episode")
+    parser.add_argument("--video_stride", type=int, default=1,
+                        help="Keep every n-th frame in the video (cheap previews)")
+    parser.add_argument("--video_scale", type=float, default=1.0,
+                        help="Downscale factor for video frames")
     args = parser.parse_args()
 
-    agent = RandomAgent(args.env, teach_data_dir=args.teach_data_dir)
+    agent = RandomAgent(args.env, teach_data_dir=args.teach_data_dir,
+                        video_stride=args.video_stride, video_scale=args.video_scale)
     try:
         agent.run_episode(num_steps=args.steps)
     except Exception as e:
@@ -1,15 +1,47 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import os
+import io
+import time
 from transformers import AutoProcessor, AutoModelForCausalLM, GenerationConfig, pipeline, Gemma3ForConditionalGeneration
 import torch
 from PIL import Image
+from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
+from embodiedbench.planner.planner_config.generation_guide_manip import llm_generation_guide_manip, vlm_generation_guide_manip
+from embodiedbench.planner.quantization import load_kwargs, quantize_model, quantize
+from embodiedbench.planner.prefix_cache import PrefixKVCache, generate_request, prefix_cache_size
+from embodiedbench.planner.speculative import load_draft_model, speculative_kwargs, decode_report, speculative
 
 max_token = 1024
+# constrain decoding to the json schema requested by the client, requires `pip install lm-format-enforcer`
+constrained_decoding = os.environ.get('constrained_decoding', '1') == '1'
+# the /process route also takes a msgpack body {prompt, images: [encoded image bytes], schema, params: {max_new_tokens}},
+# decoded in memory and answered in msgpack, requires `pip install msgpack`
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 # model_path = "microsoft/Phi-4-multimodal-instruct"
 # model_path = 'AIDC-AI/Ovis2-16B'
 # model_path = 'AIDC-AI/Ovis2-34B'
 model_path = 'google/gemma-3-12b-it'
 
+# the schemas a client can ask for, keyed by the name sent in the `schema` form field
+generation_guides = {
+    'vlm': vlm_generation_guide,
+    'llm': llm_generation_guide,
+    'vlm_manip': vlm_generation_guide_manip,
+    'llm_manip': llm_generation_guide_manip,
+}
+
+if constrained_decoding:
+    try:
+        from lmformatenforcer import JsonSchemaParser
+        from lmformatenforcer.integrations.transformers import build_transformers_prefix_allowed_tokens_fn, \
+                                                               build_token_enforcer_tokenizer_data
+    except ImportError:
+        print('lm-format-enforcer is not installed, falling back to unconstrained decoding')
+        constrained_decoding = False
+
 # Load the custom model
 class CustomModel:
     def __init__(self, model_path, language_only):
@@ -19,46 +51,79 @@ class CustomModel:
 
         if 'Ovis' in model_path:
             self.model = AutoModelForCausalLM.from_pretrained(model_path,
-                                             torch_dtype=torch.bfloat16,
                                              multimodal_max_length=20000,
                                              trust_remote_code=True,
-                                             attn_implementation="eager",
-                                             device_map='auto')
+                                             **load_kwargs("eager"))
             self.text_tokenizer = self.model.get_text_tokenizer()
             self.visual_tokenizer = self.model.get_visual_tokenizer()
         elif 'Phi-4' in model_path:
             self.processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
             self.model = AutoModelForCausalLM.from_pretrained(
                 model_path, 
-                torch_dtype=torch.bfloat16, 
                 trust_remote_code=True, 
-                device_map='auto',
-                attn_implementation="flash_attention_2"
+                **load_kwargs("flash_attention_2")
             )
             self.generation_config = GenerationConfig.from_pretrained(model_path)
         elif 'gemma' in model_path:
             self.model = Gemma3ForConditionalGeneration.from_pretrained(
-                model_path, device_map="auto", torch_dtype=torch.bfloat16,
-                attn_implementation="eager"
+                model_path, **load_kwargs("eager")
             )
             self.processor = AutoProcessor.from_pretrained(model_path)
-
-
-    def respond(self, prompt, image_path=None):
+        # int8/int4 weights for cpu-only smoke runs, also prints the memory footprint
+        self.model = quantize_model(self.model, quantize)
+
+        # key/value cache of the shared prompt prefixes (system prompt, in-context examples),
+        # only for the chat-template models, Phi-4 and Ovis run their own generate()
+        self.prefix_cache = None
+        self.image_token_id = getattr(self.model.config, 'image_token_index', None)
+        if prefix_cache_size > 0 and 'Ovis' not in model_path and 'Phi-4' not in model_path:
+            self.prefix_cache = PrefixKVCache()
+        # prompt-lookup or draft-model assisted decoding, same models as the prefix cache. It is only checked
+        # against plain generate(), so it is off with the prefix cache and for requests with a json schema
+        self.speculative_kwargs = {}
+        if speculative != 'none' and self.prefix_cache is not None:
+            print('speculative decoding is disabled while the prefix cache is on')
+        elif 'Ovis' not in model_path and 'Phi-4' not in model_path:
+            self.speculative_kwargs = speculative_kwargs(load_draft_model(Gemma3ForConditionalGeneration, **load_kwargs("eager")))
+
+        # building the token trie is expensive, do it once per tokenizer
+        self.tokenizer_data = None
+        if constrained_decoding:
+            tokenizer = self.text_tokenizer if 'Ovis' in model_path else self.processor.tokenizer
+            self.tokenizer_data = build_token_enforcer_tokenizer_data(tokenizer)
+
+    def get_constraint_kwargs(self, schema):
+        """
+        Build the generate() kwargs that restrict decoding to json following the given schema.
+        A fresh enforcer is created per request since it tracks the state of the generated prefix.
+        """
+        if self.tokenizer_data is None or schema is None:
+            return {}
+        parser = JsonSchemaParser(schema)
+        return {'prefix_allowed_tokens_fn': build_transformers_prefix_allowed_tokens_fn(self.tokenizer_data, parser)}
+
+    def respond(self, prompt, image_path=None, schema=None, images=None, max_new_tokens=max_token):
+        """
+        images: list of PIL images, image_path: a single image file (used when images is None).
+        """
+        if images is None:
+            images = [] if image_path is None else [Image.open(image_path)]
+        constraint_kwargs = self.get_constraint_kwargs(schema)
         if 'microsoft/Phi-4' in self.model_path:
             user_prompt = '<|user|>'
             assistant_prompt = '<|assistant|>'
             prompt_suffix = '<|end|>'
-            formatted_prompt = f'{user_prompt}<|image_1|>{prompt}{prompt_suffix}{assistant_prompt}'
+            image_tags = ''.join(f'<|image_{i + 1}|>' for i in range(len(images)))
+            formatted_prompt = f'{user_prompt}{image_tags}{prompt}{prompt_suffix}{assistant_prompt}'
             
-            image = Image.open(image_path)
-            inputs = self.processor(text=formatted_prompt, images=image, return_tensors='pt').to(self.model.device)
+            inputs = self.processor(text=formatted_prompt, images=images or None, return_tensors='pt').to(self.model.device)
             with torch.no_grad():
                 generate_ids = self.model.generate(
                     **inputs,
-                    max_new_tokens=max_token,  # Adjust as needed
+                    max_new_tokens=max_new_tokens,  # Adjust as needed
                     temperature=0.0,      # Adjust as needed
                     generation_config=self.generation_config,
+                    **constraint_kwargs
                 )
         
             generate_ids = generate_ids[:, inputs['input_ids'].shape[1]:]
@@ -66,9 +131,8 @@ class CustomModel:
                 generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
             )[0]
         elif 'Ovis' in self.model_path:
-            images = [Image.open(image_path)]
             max_partition = 9
-            query = f'<image>\n{prompt}'
+            query = '<image>\n' * len(images) + prompt
             prompt, input_ids, pixel_values = self.model.preprocess_inputs(query, images, max_partition=max_partition)
             attention_mask = torch.ne(input_ids, self.text_tokenizer.pad_token_id)
             input_ids = input_ids.unsqueeze(0).to(device=self.model.device)
@@ -79,7 +143,7 @@ class CustomModel:
             # generate output
             with torch.inference_mode():
                 gen_kwargs = dict(
-                    max_new_tokens=max_token,
+                    max_new_tokens=max_new_tokens,
                     do_sample=False,
                     temperature=0.0,
                     repetition_penalty=None,
@@ -87,7 +151,7 @@ class CustomModel:
                     pad_token_id=self.text_tokenizer.pad_token_id,
                     use_cache=True
                 )
-                output_ids = self.model.generate(input_ids,  pixel_values=pixel_values, attention_mask=attention_mask, **gen_kwargs)[0]
+                output_ids = self.model.generate(input_ids,  pixel_values=pixel_values, attention_mask=attention_mask, **gen_kwargs, **constraint_kwargs)[0]
                 response = self.text_tokenizer.decode(output_ids, skip_special_tokens=True)
         else:
             messages = [
@@ -97,8 +161,7 @@ class CustomModel:
                 },
                 {
                     "role": "user",
-                    "content": [
-                        {"type": "image", "url": image_path},
+                    "content": [{"type": "image", "image": image} for image in images] + [
                         {"type": "text", "text": prompt}
                     ]
                 }
@@ -110,39 +173,70 @@ class CustomModel:
 
             input_len = inputs["input_ids"].shape[-1]
             print(input_len)
-            with torch.inference_mode():
-                generation = self.model.generate(**inputs, max_new_tokens=max_token, do_sample=False, temperature=0.0, use_cache=True)
-                generation = generation[0][input_len:]
+            if constraint_kwargs and self.speculative_kwargs:
+                print('speculative decoding skipped for a request with a json schema')
+            gen_kwargs = dict(max_new_tokens=max_new_tokens, do_sample=False, temperature=0.0, use_cache=True,
+                              **(constraint_kwargs or self.speculative_kwargs))
+            generation, timer = generate_request(self.model, inputs, self.prefix_cache, self.image_token_id, **gen_kwargs)
+            print('decoding: ' + decode_report(timer))
+            generation = generation[0][input_len:]
 
             response = self.processor.decode(generation, skip_special_tokens=True)
         return response
 
 # Initialize Flask app and model
 app = Flask(__name__)
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-model = CustomModel(model_path=model_path, language_only=False)
+# loaded when the server starts, so the checks in embodiedbench/planner can import this module and serve a tiny model
+model = None
+
+def process_msgpack_request():
+    start = time.time()
+    if msgpack is None:
+        return jsonify({'error': 'msgpack is not installed on the server'}), 415
+    body = msgpack.unpackb(request.get_data(), raw=False)
+    if 'prompt' not in body:
+        return jsonify({'error': 'Missing prompt'}), 400
+    schema_name = body.get('schema')
+    if schema_name is not None and schema_name not in generation_guides:
+        return jsonify({'error': f'Unknown schema: {schema_name}'}), 400
+    schema = generation_guides[schema_name] if schema_name is not None else None
+    params = body.get('params') or {}
+
+    # decode the images from memory, nothing is written to disk
+    images = [Image.open(io.BytesIO(data)).convert('RGB') for data in body.get('images', [])]
+    model_response = model.respond(body['prompt'], schema=schema, images=images,
+                                   max_new_tokens=min(params.get('max_new_tokens', max_token), max_token))
+
+    payload = msgpack.packb({'response': model_response,
+                             'constrained': constrained_decoding and schema is not None,
+                             'server_seconds': time.time() - start}, use_bin_type=True)
+    return Response(payload, mimetype='application/msgpack')
 
 @app.route('/process', methods=['POST'])
 def process_request():
+    if request.mimetype == 'application/msgpack':
+        return process_msgpack_request()
+
     if 'image' not in request.files or 'sentence' not in request.form:
         return jsonify({'error': 'Missing image or sentence'}), 400
 
     image = request.files['image']
     sentence = request.form['sentence']
+    schema_name = request.form.get('schema')
+    if schema_name is not None and schema_name not in generation_guides:
+        return jsonify({'error': f'Unknown schema: {schema_name}'}), 400
+    schema = generation_guides[schema_name] if schema_name is not None else None
 
     if image.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    # Save the image temporarily
-    image_path = os.path.join(UPLOAD_FOLDER, image.filename)
-    image.save(image_path)
-
-    # Generate response from the model
-    model_response = model.respond(sentence, image_path=image_path)
+    # Generate response from the model, the upload is decoded in memory
+    model_response = model.respond(sentence, schema=schema, images=[Image.open(image.stream).convert('RGB')])
 
-    return jsonify({'response': model_response})
+    # tell the client whether the output is guaranteed to parse, so it can skip json repair
+    return jsonify({'response': model_response, 'constrained': constrained_decoding and schema is not None})
 
 if __name__ == '__main__':
+    model = CustomModel(model_path=model_path, language_only=False)
     app.run(host='0.0.0.0', port=23333)